@@ -1,24 +1,22 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
 Created on Fri Dec 16 01:01:42 2016
 
 @author: barnabysandeford
+
+A 3D plot of a bundle of rays through the single spherical surface.
+Importing this doesn't trace or plot anything; run it as a script, or call
+main, for the plot.
 """
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import raytracer as rt
-reload(rt)
+import analysis
+from single_surface import optical_system
 
-s = rt.SphericalRefraction(100,0.03,1.0,1.5,(1/0.03))
-# Finding the paraxial focal point of the spherical optical element
-F = rt.focal_point1(s)
-# The output plane is automatically placed at the paraxial focal point of "s".
-p=rt.OutputPlane(F, 10000)
 
 def zx_plot(n, rmax, m):
     """Creates a z-x plot of a bundle of rays propogated through "s".
-    
+
        Parameters
        ----------
        n:    integer_type
@@ -30,13 +28,14 @@ def zx_plot(n, rmax, m):
              The rate at which the number of rays per concentric circle
              increases.
     """
+    plt = analysis.pyplot()
+    system = optical_system()[2]
     bundle=rt.bundle(n, rmax, m)
     fig = plt.figure()
-    ax = Axes3D(fig)
+    ax = fig.add_subplot(projection='3d')
     for ray in bundle:
         "Loop that plots the z-x positions of the parallel rays."
-        s.propagate_ray(ray)
-        p.propagate_ray(ray)
+        system.propagate_ray(ray)
         x = []
         y = []
         z = []
@@ -45,5 +44,16 @@ def zx_plot(n, rmax, m):
             y.append(position[1]) # Appends all y positions to the list "y".
             z.append(position[2]) # Appends all z positions to the list "z".
         ax.plot(xs = z,ys = y,zs = x)
-        
-zx_plot(10,40,4)
+
+
+def main(plot=True):
+    """Makes the 3D plot of the ray propagation.  Nothing is done if plot is
+       False.
+    """
+    if plot:
+        zx_plot(10,40,4)
+        analysis.pyplot().show()
+
+
+if __name__ == '__main__':
+    main()
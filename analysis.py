@@ -0,0 +1,139 @@
+"""
+Spot diagram and root mean square (rms) radius analysis of traced rays.
+
+All of the analysis works on (N,2) arrays of x-y positions, and only needs
+NumPy.  Matplotlib is imported when a spot diagram is plotted, and not
+before, so the analysis can be run on machines without a display.
+"""
+import numpy as np
+
+
+def spot_positions(bundle, include_lost=False):
+    """Finds the x-y positions of the rays in a traced RayBundle as an (N,2)
+       array.
+
+       Parameters
+       ----------
+       bundle:       instance_type
+                     RayBundle object that has been propagated to an output
+                     plane.
+       include_lost: bool_type
+                     If True, rays that were lost are included at their last
+                     known positions.
+    """
+    xy = bundle.p()[:, :2]
+    if include_lost:
+        return xy.copy()
+    return xy[~bundle.lost]
+
+
+def trace_spot(system, bundle, include_lost=False):
+    """Propagates a RayBundle through an optical system, such as an
+       OpticalSystem ending in an output plane, and returns the (N,2) array
+       of x-y positions where the rays finish.
+    """
+    system.propagate_bundle(bundle)
+    return spot_positions(bundle, include_lost)
+
+
+def centroid(xy):
+    """Finds the mean x-y position of an (N,2) array of positions.
+    """
+    return np.asarray(xy, dtype=float).mean(axis=0)
+
+
+def _radii(xy, about_centroid):
+    "Finds the radial distances of the positions from the axis or centroid."
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if about_centroid:
+        xy = xy - centroid(xy)
+    return np.sqrt(np.einsum('ij,ij->i', xy, xy))
+
+
+def rms_radius(xy, about_centroid=False):
+    """Finds the root mean square radial deviation of an (N,2) array of x-y
+       positions.
+
+       Parameters
+       ----------
+       xy:             array_type
+                       (N,2) array of x-y positions.
+       about_centroid: bool_type
+                       If True, the radii are measured from the centroid of
+                       the positions, rather than from the z axis.
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if about_centroid:
+        xy = xy - centroid(xy)
+    return np.sqrt(np.einsum('ij,ij->', xy, xy) / len(xy))
+
+
+def geometric_radius(xy, about_centroid=False):
+    """Finds the largest radial distance of an (N,2) array of x-y positions.
+       The parameters are the same as for rms_radius.
+    """
+    return _radii(xy, about_centroid).max()
+
+
+def encircled_energy(xy, radii=None, about_centroid=True):
+    """Finds the fraction of the rays that fall within each of a set of
+       radii.  Returns the tuple (radii, fraction) of arrays.
+
+       Parameters
+       ----------
+       xy:             array_type
+                       (N,2) array of x-y positions.
+       radii:          array_type
+                       The radii to find the encircled fraction at.  If None,
+                       100 radii up to the geometric radius are used.
+       about_centroid: bool_type
+                       If True, the radii are measured from the centroid of
+                       the positions, rather than from the z axis.
+    """
+    r = np.sort(_radii(xy, about_centroid))
+    if radii is None:
+        radii = np.linspace(0., r[-1], 100)
+    radii = np.asarray(radii, dtype=float)
+    fraction = np.searchsorted(r, radii, side='right') / float(len(r))
+    return radii, fraction
+
+
+def plot_spot_diagram(xy, ax=None, **kwargs):
+    """Plots a spot diagram of an (N,2) array of x-y positions with a single
+       scatter call.  Returns the matplotlib axes.
+
+       Parameters
+       ----------
+       xy: array_type
+           (N,2) array of x-y positions.
+       ax: instance_type
+           Matplotlib axes to plot on.  The current axes are used if None.
+
+       Any other keyword arguments are passed on to scatter.
+    """
+    if ax is None:
+        ax = pyplot().gca()
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    kwargs.setdefault('s', 4)
+    kwargs.setdefault('c', 'b')
+    ax.scatter(xy[:, 0], xy[:, 1], **kwargs)
+    ax.set_xlabel('x axis /mm')
+    ax.set_ylabel('y axis /mm')
+    return ax
+
+
+def pyplot(backend=None):
+    """Imports matplotlib.pyplot on first use and returns it, so that nothing
+       imports matplotlib until something is plotted.
+
+       Parameters
+       ----------
+       backend: string_type
+                A matplotlib backend to use, such as 'Agg' to plot without a
+                display.  It must be chosen before pyplot is first imported.
+    """
+    import matplotlib
+    if backend is not None:
+        matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,259 @@
+"""
+Interchangeable backends for tracing bundles of rays through whole systems.
+
+The numpy backend propagates the bundle one element at a time with the array
+kernels in raytracer, and works for every kind of optical element.  The
+numba backend, used by default when Numba is installed, compiles a single
+loop that takes each ray through every surface in turn, keeping its state
+in registers, so no intermediate arrays are made for the intercepts,
+normals or refracted directions.  It handles systems made only of
+SphericalRefraction surfaces and output planes that are centred on the z
+axis, and any other system is passed to the numpy backend.
+
+Both backends append only the final positions and directions to the bundle,
+as parallel.propagate_bundle does, and update the lost mask, status codes,
+terminating elements and optical path lengths in the same way as
+OpticalSystem.propagate_bundle.  The loop does the same arithmetic, in the
+same order, as the array kernels, so both backends give exactly the same
+results, which test_backend.py checks.
+"""
+from math import sqrt, copysign, isfinite
+import importlib.util
+import numpy as np
+import raytracer as rt
+
+# Numba is slow to import, so it is only imported when the kernel is first
+# compiled.
+_HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+# The kinds of surface in the parameter table of a system.
+REFRACTING = 0
+PLANE = 1
+
+_settings = {'backend': 'numba' if _HAVE_NUMBA else 'numpy'}
+
+
+def available():
+    """Finds the list of backends that can be used.
+    """
+    if not _HAVE_NUMBA:
+        return ['numpy']
+    return ['numpy', 'numba']
+
+
+def set_backend(name):
+    """Chooses the backend used by propagate_bundle when none is given.
+
+       Parameters
+       ----------
+       name: string_type
+             'numpy' or 'numba'.
+    """
+    if name not in available():
+        raise Exception("The %s backend isn't available." % name)
+    _settings['backend'] = name
+
+
+def get_backend():
+    """Finds the name of the backend used by propagate_bundle when none is
+       given.
+    """
+    return _settings['backend']
+
+
+def surface_table(elements, wavelength=None):
+    """Flattens a sequence of optical elements into arrays of surface
+       parameters for the compiled kernel.  Returns the tuple
+       (kind, z0, curv, n1, n2, ap_r), where n1 and n2 have shape (S,1), or
+       (S,N) for a bundle with a wavelength for each ray.  Returns None if
+       any element can't be traced by the kernel.
+
+       Parameters
+       ----------
+       elements:   list_type
+                   Optical elements in the order that rays pass through them.
+       wavelength: array_type
+                   The wavelength of each ray in metres, or None.
+    """
+    rows = []
+    for e in elements:
+        if e._rotation is not None:
+            return None
+        if type(e) is rt.SphericalRefraction:
+            n1, n2 = e.indices(wavelength)
+            rows.append((REFRACTING, e._z0, e._curv, n1, n2, e._ap_r))
+        elif type(e) is rt.OutputPlane:
+            rows.append((PLANE, e._z0, 0., 1., 1., e._ap_r))
+        else:
+            return None
+    kind = np.array([row[0] for row in rows], dtype=np.int64)
+    z0, curv, ap_r = [np.array([row[i] for row in rows], dtype=float)
+                      for i in (1, 2, 5)]
+    m = 1 if wavelength is None else len(wavelength)
+    n1, n2 = [np.array([np.broadcast_to(row[i], (m,)) for row in rows],
+                       dtype=float).reshape(len(rows), m)
+              for i in (3, 4)]
+    return kind, z0, curv, n1, n2, ap_r
+
+
+def _trace_rays(p, k, status, terminated, opl, index, offset, kind, z0, curv,
+                n1, n2, ap_r):
+    """Traces (N,3) arrays of rays through every surface in a parameter
+       table, one ray at a time, updating the arrays in place.  This is the
+       loop compiled by the numba backend, and follows the same steps as
+       raytracer.intercept_status, surface_normals and refract_bundle.
+    """
+    n_surfaces = len(kind)
+    per_ray = n1.shape[1] > 1
+    for j in range(len(p)):
+        st = status[j]
+        if st >= rt.VIGNETTED:
+            continue
+        m = j if per_ray else 0
+        path, n = opl[j], index[j]
+        px, py, pz = p[j, 0], p[j, 1], p[j, 2]
+        kx, ky, kz = k[j, 0], k[j, 1], k[j, 2]
+        for i in range(n_surfaces):
+            c = curv[i]
+            qz = pz - z0[i]
+            qq = px * px + py * py + qz * qz
+            qk = px * kx + py * ky + qz * kz
+            b = c * qk - kz
+            cc = c * qq - 2 * qz
+            disc = b * b - c * cc
+            length = -1.
+            if disc >= 0:
+                near = copysign(sqrt(disc), -b) - b
+                length = cc / near
+                if c * (qz + length * kz) > 1:
+                    length = near / c
+            if not (isfinite(length) and length >= 0):
+                st = rt.MISSED
+                terminated[j] = offset + i
+                break
+            x = px + kx * length
+            y = py + ky * length
+            z = pz + kz * length
+            if x * x + y * y > ap_r[i] * ap_r[i]:
+                st = rt.VIGNETTED
+                terminated[j] = offset + i
+                break
+            # The step is measured as RayBundle.append_point measures it.
+            dx, dy, dz = x - px, y - py, z - pz
+            step = sqrt(dx * dx + dy * dy + dz * dz)
+            px, py, pz = x, y, z
+            if kind[i] == PLANE:
+                path += n * step
+                continue
+            path += n1[i, m] * step
+            n = n2[i, m]
+            nx, ny, nz = c * x, c * y, c * (z - z0[i]) - 1
+            size = sqrt(nx * nx + ny * ny + nz * nz)
+            nx, ny, nz = nx / size, ny / size, nz / size
+            dot = -(nx * kx + ny * ky + nz * kz)
+            if dot < 0:
+                nx, ny, nz, dot = -nx, -ny, -nz, -dot
+            r = n1[i, m] / n2[i, m]
+            sin2 = (r * r) * (1 - (dot * dot))
+            if sin2 > 1:
+                # Totally internally reflected.
+                kx, ky, kz = (kx + 2 * dot * nx, ky + 2 * dot * ny,
+                              kz + 2 * dot * nz)
+                st = rt.REFLECTED
+                n = n1[i, m]
+            else:
+                a = r * dot - sqrt(1 - sin2)
+                kx, ky, kz = r * kx + a * nx, r * ky + a * ny, r * kz + a * nz
+                # refract_bundle normalises the directions, and then
+                # RayBundle.append_vector normalises them again.
+                size = sqrt(kx * kx + ky * ky + kz * kz)
+                kx, ky, kz = kx / size, ky / size, kz / size
+                st = rt.REFRACTED
+            size = sqrt(kx * kx + ky * ky + kz * kz)
+            kx, ky, kz = kx / size, ky / size, kz / size
+        p[j, 0], p[j, 1], p[j, 2] = px, py, pz
+        k[j, 0], k[j, 1], k[j, 2] = kx, ky, kz
+        status[j] = st
+        opl[j], index[j] = path, n
+
+
+_compiled = {}
+
+
+def _kernel():
+    "Finds the compiled kernel, compiling it on first use."
+    if 'trace_rays' not in _compiled:
+        import numba
+        _compiled['trace_rays'] = numba.njit(
+            cache=True, error_model='numpy')(_trace_rays)
+    return _compiled['trace_rays']
+
+
+def _propagate_numpy(elements, bundle):
+    "Propagates a bundle through the elements one at a time."
+    trace = rt.RayBundle(bundle.p(), bundle.d(), bundle.wavelength)
+    trace.lost[:] = bundle.lost
+    trace.status[:] = bundle.status
+    trace.opl[:] = bundle.opl
+    trace.index[:] = bundle.index
+    rt.OpticalSystem(elements).propagate_bundle(trace)
+    newly = trace.terminated >= 0
+    bundle.terminated[newly] = (trace.terminated[newly]
+                                + len(bundle.positions) - 1)
+    bundle.append_point(trace.p())
+    bundle.append_vector(trace.d())
+    bundle.lost[:] = trace.lost
+    bundle.status[:] = trace.status
+    bundle.opl[:] = trace.opl
+    bundle.index[:] = trace.index
+
+
+def _propagate_numba(elements, bundle, table):
+    "Propagates a bundle through a parameter table with the fused kernel."
+    p = bundle.p().copy()
+    k = bundle.d().copy()
+    status = bundle.live_status()
+    terminated = bundle.terminated.copy()
+    opl = bundle.opl.copy()
+    index = bundle.index.copy()
+    _kernel()(p, k, status, terminated, opl, index,
+              len(bundle.positions) - 1, *table)
+    bundle.append_point(p)
+    bundle.append_vector(k)
+    # Rays that were already lost keep their status codes.
+    bundle.status[:] = np.where(bundle.lost, bundle.status, status)
+    bundle.lost[:] = status >= rt.VIGNETTED
+    bundle.terminated[:] = terminated
+    bundle.opl[:] = opl
+    bundle.index[:] = index
+
+
+def propagate_bundle(elements, bundle, backend=None):
+    """Propagates a bundle of rays through a sequence of optical elements
+       with one of the backends.  Only the final positions and directions
+       are appended to the bundle.
+
+       Parameters
+       ----------
+       elements: list_type
+                 Optical elements, or an OpticalSystem, in the order that
+                 rays pass through them.
+       bundle:   instance_type
+                 RayBundle object to propagate.
+       backend:  string_type
+                 'numpy' or 'numba'.  Defaults to the backend chosen with
+                 set_backend.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    elements = list(elements)
+    if backend is None:
+        backend = _settings['backend']
+    if backend not in available():
+        raise Exception("The %s backend isn't available." % backend)
+    if backend == 'numba' and len(bundle):
+        table = surface_table(elements, bundle.wavelength)
+        if table is not None:
+            _propagate_numba(elements, bundle, table)
+            return
+    _propagate_numpy(elements, bundle)
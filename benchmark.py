@@ -0,0 +1,288 @@
+"""
+Benchmarks for the optical ray tracer.
+
+Run this module as a script to time each benchmark case at several ray
+counts.  The results, in rays per second with the peak memory used, are
+printed as JSON and can be saved with --output.  With --compare, the results
+are checked against a saved baseline and any case that has slowed down by
+more than the threshold is reported as a regression.
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+
+benchmark_baseline.json holds a run of every case, to compare against on
+the machine it was made on, or to remake with --output on another one.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import backend
+import raytracer as rt
+import single_surface
+import tolerance
+import wavefront
+
+# The numbers of concentric circles used for bundle(n, rmax, 6), giving
+# roughly 100, 1000 and 10000 rays.
+RINGS = (5, 18, 57)
+
+
+def _single_surface():
+    "The optical system from single_surface.py."
+    s = rt.SphericalRefraction(100, 0.03, 1.0, 1.5, (1 / 0.03))
+    return rt.OpticalSystem([s, rt.OutputPlane(rt.focal_point1(s), 10000)])
+
+
+def _planoconvex():
+    "The convex-first plano-convex lens from planoconvex.py."
+    convex = rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8)
+    plane1 = rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8)
+    output_plane = rt.OutputPlane(rt.focal_point2(convex, plane1), 10000)
+    return rt.OpticalSystem([convex, plane1, output_plane])
+
+
+def _scalar_trace(system, n):
+    "Returns a case tracing bundle(n, 2.5, 6) ray by ray."
+    def run():
+        for ray in rt.bundle(n, 2.5, 6):
+            system.propagate_ray(ray)
+    return run, len(rt.bundle(n, 2.5, 6))
+
+
+def _bundle_trace(system, n):
+    "Returns a case tracing ray_bundle(n, 2.5, 6) as one RayBundle."
+    def run():
+        system.propagate_bundle(rt.ray_bundle(n, 2.5, 6))
+    return run, len(rt.ray_bundle(n, 2.5, 6))
+
+
+def case_single_ray(n):
+    "A single ray through single_surface.py's system, repeated n times."
+    system = _single_surface()
+
+    def run():
+        for i in range(n):
+            system.propagate_ray(rt.Ray([1., 0.5, 0.], [0., 0., 1.]))
+    return run, n
+
+
+def case_scalar_ray(n):
+    """100 n rays, each created and traced through a spherical surface and
+       then an output plane with propagate_ray, without an OpticalSystem.
+       This is the per-ray cost of the scalar path.
+    """
+    s = rt.SphericalRefraction(100, 0.03, 1.0, 1.5, (1 / 0.03))
+    p = rt.OutputPlane(200, 10000)
+
+    def run():
+        for i in range(100 * n):
+            ray = rt.Ray([1., 0.5, 0.], [0., 0., 1.])
+            s.propagate_ray(ray)
+            p.propagate_ray(ray)
+    return run, 100 * n
+
+
+def case_bundle(n):
+    "Constructing bundle(n, 2.5, 6)."
+    return (lambda: rt.bundle(n, 2.5, 6)), len(rt.bundle(n, 2.5, 6))
+
+
+def case_single_surface(n):
+    "single_surface.py's system, traced ray by ray."
+    return _scalar_trace(_single_surface(), n)
+
+
+def case_single_surface_bundle(n):
+    "single_surface.py's system, traced as a RayBundle."
+    return _bundle_trace(_single_surface(), n)
+
+
+def case_planoconvex(n):
+    "planoconvex.py's convex-first lens, traced ray by ray."
+    return _scalar_trace(_planoconvex(), n)
+
+
+def case_planoconvex_bundle(n):
+    "planoconvex.py's convex-first lens, traced as a RayBundle."
+    return _bundle_trace(_planoconvex(), n)
+
+
+def case_planoconvex_backend(n):
+    """planoconvex.py's convex-first lens, traced as a RayBundle with the
+       default backend, which is fused into one kernel when Numba is
+       installed.
+    """
+    system = _planoconvex()
+
+    def run():
+        backend.propagate_bundle(system, rt.ray_bundle(n, 2.5, 6))
+    return run, len(rt.ray_bundle(n, 2.5, 6))
+
+
+def case_planoconvex_mtf(n):
+    """The pupil wavefront and MTF of planoconvex.py's convex-first lens,
+       from a square grid with about as many rays as the other cases.
+    """
+    system = _planoconvex()
+    size = int(np.sqrt(len(rt.ray_bundle(n, 2.5, 6)) * 4 / np.pi))
+
+    def run():
+        wavefront.mtf(wavefront.pupil_wavefront(system, size, radius=5.))
+    return run, len(wavefront.pupil_grid(size, 1.)[0])
+
+
+def case_focalradius_sweep(n):
+    """single_surface.focalradius, which finds the rms radius for 80 bundle
+       radii in one sweep, with n concentric circles per bundle instead of 6.
+    """
+    return (lambda: single_surface.focalradius(n)), (
+        80 * len(rt.ray_bundle(n, 1., 6)))
+
+
+def case_planoconvex_tolerance(n):
+    """1000 Monte Carlo trials of planoconvex.py's convex-first lens, with
+       n concentric circles per bundle instead of 6.
+    """
+    system = _planoconvex()
+    tolerances = {'curv': 1e-4, 'thickness': 0.05, 'index': 1e-3}
+
+    def run():
+        tolerance.monte_carlo(system, tolerances, 1000, 5., n, 6, seed=0)
+    return run, 1000 * len(rt.ray_bundle(n, 1., 6))
+
+
+CASES = {
+    'single_ray': case_single_ray,
+    'scalar_ray': case_scalar_ray,
+    'bundle': case_bundle,
+    'single_surface': case_single_surface,
+    'single_surface_bundle': case_single_surface_bundle,
+    'planoconvex': case_planoconvex,
+    'planoconvex_bundle': case_planoconvex_bundle,
+    'planoconvex_backend': case_planoconvex_backend,
+    'planoconvex_mtf': case_planoconvex_mtf,
+    'planoconvex_tolerance': case_planoconvex_tolerance,
+    'focalradius_sweep': case_focalradius_sweep,
+}
+
+
+def measure(func, rays, repeat=3):
+    """Times a benchmark function, returning a dictionary of the best time
+       in seconds, the rays per second and the peak memory in bytes.
+
+       Parameters
+       ----------
+       func:   function_type
+               The function to time, which takes no arguments.
+       rays:   integer_type
+               The number of rays that one call of func traces.
+       repeat: integer_type
+               The number of timed calls, of which the fastest is kept.
+    """
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    # The memory is measured separately, as tracing allocations is slow.
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'rays': rays,
+            'seconds': best,
+            'rays_per_sec': rays / best,
+            'peak_memory_bytes': peak}
+
+
+def run(cases=None, rings=RINGS, repeat=3):
+    """Runs the benchmark cases at each number of concentric circles.
+       Returns a list of result dictionaries.
+
+       Parameters
+       ----------
+       cases:  list_type
+               Names of the cases in CASES to run.  Runs all of them if None.
+       rings:  list_type
+               The numbers of concentric circles in each ray bundle, or the
+               number of rays for the single_ray case and hundreds of rays
+               for the scalar_ray case.
+       repeat: integer_type
+               The number of timed calls of each case.
+    """
+    results = []
+    for name in (cases or sorted(CASES)):
+        for n in rings:
+            func, rays = CASES[name](n)
+            result = {'case': name, 'size': n}
+            result.update(measure(func, rays, repeat))
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Compares benchmark results with a baseline.  Returns a list of the
+       results whose rays per second have fallen by more than threshold, as
+       a fraction of the baseline, each with an added 'baseline_rays_per_sec'
+       and 'change'.
+
+       Parameters
+       ----------
+       results:   list_type
+                  Result dictionaries from run.
+       baseline:  list_type
+                  Result dictionaries from an earlier run.
+       threshold: float_type
+                  The fractional slowdown that counts as a regression.
+    """
+    old = dict(((r['case'], r['size']), r) for r in baseline)
+    regressions = []
+    for result in results:
+        key = (result['case'], result['size'])
+        if key not in old:
+            continue
+        change = result['rays_per_sec'] / old[key]['rays_per_sec'] - 1
+        if change < -threshold:
+            regression = dict(result)
+            regression['baseline_rays_per_sec'] = old[key]['rays_per_sec']
+            regression['change'] = change
+            regressions.append(regression)
+    return regressions
+
+
+def main(argv=None):
+    "Runs the benchmarks from the command line."
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='case to run (default: all)')
+    parser.add_argument('--rings', type=int, nargs='+', default=RINGS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--compare', help='baseline results to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    results = run(args.case, args.rings, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            sys.stderr.write('Regression: %s (size %d) %.0f rays/s, was '
+                             '%.0f (%+.0f%%)\n'
+                             % (r['case'], r['size'], r['rays_per_sec'],
+                                r['baseline_rays_per_sec'],
+                                100 * r['change']))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+A cache of traced ray bundles, focal points and pupil wavefronts.
+
+Results are keyed by a hash of the type and parameters of every optical
+element, as given by their parameters method, and of the ray source.  As
+the key is made from the parameter values at the time of each lookup,
+changing an element simply gives a different key, so stale results are
+never returned.  Recently used results are kept in memory, up to a fixed
+number of entries, and can also be saved as .npz files in a directory so
+that they are kept between runs.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import numpy as np
+import raytracer as rt
+import wavefront as wf
+
+# The version of the values stored in the cache, which is part of every key,
+# so that files saved by older versions, such as traces without optical path
+# lengths, are traced again rather than read.
+FORMAT = 2
+
+
+def element_key(elements):
+    """Finds a tuple describing a sequence of optical elements, made of the
+       name and parameters of each element.
+
+       Parameters
+       ----------
+       elements: list_type
+                 Optical elements, or an OpticalSystem.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    return tuple((type(e).__name__,) + tuple(_value(a)
+                                            for a in e.parameters())
+                 for e in elements)
+
+
+def _value(parameter):
+    "Converts a parameter to a float, unless it is the name of a material."
+    if isinstance(parameter, str):
+        return parameter
+    return float(parameter)
+
+
+def make_key(*parts):
+    """Finds a hex digest hashing the repr of every part of a cache key, and
+       of the FORMAT version.  Floats are given with full precision by repr.
+    """
+    return hashlib.sha1(repr((FORMAT,) + parts).encode('utf-8')).hexdigest()
+
+
+class TraceCache:
+    """
+    Creates a cache of traced ray bundles, focal points and wavefronts, with
+    a least recently used memory tier and an optional directory on disk.
+    """
+
+    def __init__(self, max_entries=128, directory=None):
+        """
+        Initialises the TraceCache class.
+
+        Parameters
+        ----------
+        max_entries: integer_type
+                     The largest number of results kept in memory.
+        directory:   string_type
+                     The directory to save results in as .npz files.  No
+                     results are saved to disk if this is None.
+        """
+        self._max_entries = max_entries
+        self._directory = directory
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        "Finds the file that the result with a given key is saved in."
+        return os.path.join(self._directory, key + '.npz')
+
+    def get(self, key):
+        """
+        Finds the dictionary of arrays saved with a key, or None if there is
+        no such result.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if self._directory is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as f:
+                value = dict((name, f[name]) for name in f.files)
+            self._store(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Saves a dictionary of arrays with a key.
+        """
+        self._store(key, value)
+        if self._directory is not None:
+            np.savez(self._path(key), **value)
+
+    def _store(self, key, value):
+        "Keeps a result in memory, dropping the least recently used result."
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every result from memory.  Results saved on disk are kept.
+        """
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def trace(self, elements, n, rmax, m):
+        """
+        Finds ray_bundle(n, rmax, m) propagated through a sequence of
+        optical elements, tracing it only if it isn't already cached.  A new
+        RayBundle is returned each time, so it can be changed freely.
+
+        Parameters
+        ----------
+        elements: list_type
+                  Optical elements, or an OpticalSystem, in the order that
+                  rays pass through them.
+        n, m:     integer_type
+                  The numbers of concentric circles and the rate of increase
+                  of rays per circle, as for rt.bundle.
+        rmax:     float_type
+                  The maximum radius of the bundle.
+        """
+        key = make_key('trace', element_key(elements), 'ray_bundle',
+                       int(n), float(rmax), int(m))
+        value = self.get(key)
+        if value is None:
+            bundle = rt.ray_bundle(n, rmax, m)
+            if not hasattr(elements, 'elements'):
+                elements = rt.OpticalSystem(elements)
+            elements.propagate_bundle(bundle)
+            value = {'positions': np.array(bundle.positions),
+                     'directions': np.array(bundle.directions),
+                     'lost': bundle.lost,
+                     'terminated': bundle.terminated,
+                     'status': bundle.status,
+                     'opl': bundle.opl,
+                     'index': bundle.index}
+            self.put(key, value)
+        bundle = rt.RayBundle(value['positions'][0], value['directions'][0])
+        bundle.positions = [p.copy() for p in value['positions']]
+        bundle.directions = [d.copy() for d in value['directions']]
+        bundle.lost = value['lost'].copy()
+        bundle.terminated = value['terminated'].copy()
+        bundle.status = value['status'].copy()
+        bundle.opl = value['opl'].copy()
+        bundle.index = value['index'].copy()
+        return bundle
+
+    def focal_point(self, elements):
+        """
+        Finds the paraxial focal point of a sequence of optical elements, as
+        found by OpticalSystem.focal_point, tracing it only if it isn't
+        already cached.
+        """
+        key = make_key('focal_point', element_key(elements))
+        value = self.get(key)
+        if value is None:
+            if not hasattr(elements, 'elements'):
+                elements = rt.OpticalSystem(elements)
+            value = {'focal_point': np.array(elements.focal_point())}
+            self.put(key, value)
+        return float(value['focal_point'])
+
+    def wavefront(self, elements, size=64, wavelength=None, field=(0., 0.),
+                  radius=None, z_image=None):
+        """
+        Finds the pupil wavefront of a sequence of optical elements, as found
+        by wavefront.pupil_wavefront, tracing it only if it isn't already
+        cached for the same system, wavelength and field.  A new dictionary
+        of arrays is returned each time.
+        """
+        key = make_key('wavefront', element_key(elements), int(size),
+                       wavelength if wavelength is None else float(wavelength),
+                       tuple(float(a) for a in field), radius, z_image)
+        value = self.get(key)
+        if value is None:
+            value = wf.pupil_wavefront(elements, size, wavelength, field,
+                                       radius, z_image)
+            self.put(key, value)
+        return dict((name, a.copy()) for name, a in value.items())
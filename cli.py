@@ -0,0 +1,82 @@
+"""
+Command line entry point for the example analyses.
+
+Each analysis is a subcommand, which runs the main function of its module.
+Only the module for the chosen analysis is imported, and matplotlib is only
+imported once something is plotted, so runs with --no-plot never import it.
+With --save, the figures are drawn without a display and saved as PNG files
+in a directory rather than shown.
+
+    python cli.py single_surface
+    python cli.py planoconvex --no-plot
+    python cli.py three_d --save figures
+"""
+import argparse
+import importlib
+import os
+import sys
+import warnings
+
+# The module holding the main function of each analysis.
+COMMANDS = {
+    'single_surface': 'single_surface',
+    'planoconvex': 'planoconvex',
+    'three_d': 'Three_D_plot',
+}
+
+
+def run(command, plot=True, save=None):
+    """Runs one of the example analyses.  Returns the list of files that
+       figures were saved to.
+
+       Parameters
+       ----------
+       command: string_type
+                The name of the analysis, one of COMMANDS.
+       plot:    bool_type
+                If False, the analysis only prints its results.
+       save:    string_type
+                The directory to save the figures in.  The figures are shown
+                if this is None.
+    """
+    if command not in COMMANDS:
+        raise Exception('There is no analysis called %s.' % command)
+    headless = plot and save is not None
+    if headless:
+        import analysis
+        plt = analysis.pyplot('Agg')
+    module = importlib.import_module(COMMANDS[command])
+    with warnings.catch_warnings():
+        if headless:
+            # Showing a figure does nothing without a display.
+            warnings.simplefilter('ignore', UserWarning)
+        module.main(plot=plot)
+    saved = []
+    if headless:
+        if not os.path.isdir(save):
+            os.makedirs(save)
+        for number in plt.get_fignums():
+            path = os.path.join(save, '%s_%d.png' % (command, number))
+            plt.figure(number).savefig(path)
+            saved.append(path)
+        plt.close('all')
+    return saved
+
+
+def main(argv=None):
+    "Runs an analysis from the command line."
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('command', choices=sorted(COMMANDS),
+                        help='analysis to run')
+    parser.add_argument('--no-plot', action='store_true',
+                        help='only print the results')
+    parser.add_argument('--save', metavar='DIR',
+                        help='save the figures to a directory')
+    args = parser.parse_args(argv)
+    for path in run(args.command, not args.no_plot, args.save):
+        print('Saved %s' % path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
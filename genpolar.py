@@ -5,6 +5,7 @@ Created on Fri Nov 18 10:29:19 2016
 @author: bms115
 """
 from math import pi
+import numpy as np
 
 
 def rtpairs(R, N):
@@ -49,5 +50,200 @@ def rtuniform(n,rmax,m):
                 r, t = rad, theta
                 theta += two_pi/(i * m)
                 yield r, t
-        
-        
\ No newline at end of file
+
+
+def rtpairs_array(R, N):
+    """Creates the same distribution as rtpairs, returning arrays of the radii
+       and angles of all the points at once.
+
+        Parameters
+        ----------
+        R: list_type
+           A list of radii for the concentric circles.
+        N: list_type
+           A list of the number of anles for each radius.
+    """
+    N = np.asarray(N, dtype=int)
+    r = np.repeat(np.asarray(R, dtype=float), N)
+    # The index of each point around its own circle.
+    start = np.repeat(np.cumsum(N) - N, N)
+    n = np.arange(len(r)) - start
+    t = 2. / np.repeat(N, N) * n * pi
+    return r, t
+
+
+def rtuniform_array(n, rmax, m):
+    """Creates the same distribution as rtuniform, in the same order,
+       returning arrays of the radii and angles of all the points at once.
+
+        Parameters
+        ----------
+        n:    integer_type
+              The number of concentric circles of points within the
+              distribution.
+        rmax: float_type
+              The maximum radius of the distribution of points.
+        m:    integer_type
+              The rate at which the number of points per concentric circle
+              increases.
+    """
+    rmax = float(rmax)
+    two_pi = 2.*pi
+    r, t = [], []
+    for i in range(1, n+1):
+        # Each circle starts with a central point, as in rtuniform.
+        r.append(np.concatenate(([0.], np.full(i * m, rmax / n * i))))
+        # Summing the angle steps matches rtuniform's incremented angles.
+        steps = np.full(i * m, two_pi/(i * m))
+        steps[0] = 0.
+        t.append(np.concatenate(([0.], np.cumsum(steps))))
+    if not r:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(r), np.concatenate(t)
+
+
+def polar_to_xy(r, t):
+    """Converts arrays of radii and angles into an (N,2) array of x-y
+       points.
+    """
+    r = np.asarray(r, dtype=float)
+    t = np.asarray(t, dtype=float)
+    return np.stack((r * np.cos(t), r * np.sin(t)), axis=-1)
+
+
+def xyuniform(n, rmax, m):
+    """Creates the rtuniform distribution as an (N,2) array of x-y points.
+
+        Parameters
+        ----------
+        n:    integer_type
+              The number of concentric circles of points.
+        rmax: float_type
+              The maximum radius of the distribution of points.
+        m:    integer_type
+              The rate at which the number of points per concentric circle
+              increases.
+    """
+    return polar_to_xy(*rtuniform_array(n, rmax, m))
+
+
+def hexapolar(n, rmax):
+    """Creates a hexapolar distribution of points within a circle, as an
+       (N,2) array of x-y points.  There is one central point, and circle i
+       has 6i points.
+
+        Parameters
+        ----------
+        n:    integer_type
+              The number of concentric circles of points around the centre.
+        rmax: float_type
+              The maximum radius of the distribution of points.
+    """
+    rings = np.arange(1, n+1)
+    r, t = rtpairs_array(float(rmax) / n * rings, 6 * rings)
+    return np.concatenate((np.zeros((1, 2)), polar_to_xy(r, t)))
+
+
+def square_grid(n, rmax):
+    """Creates a square grid of points, n points along each side, clipped to
+       a circle of radius rmax.  Returns an (N,2) array of x-y points.
+
+        Parameters
+        ----------
+        n:    integer_type
+              The number of points along each side of the square.
+        rmax: float_type
+              The radius of the circle the grid is clipped to.
+    """
+    rmax = float(rmax)
+    x = np.linspace(-rmax, rmax, n)
+    xx, yy = np.meshgrid(x, x)
+    xy = np.stack((xx.ravel(), yy.ravel()), axis=-1)
+    return xy[np.einsum('ij,ij->i', xy, xy) <= rmax * rmax * (1 + 1e-12)]
+
+
+def _unit_to_disc(u, v, rmax):
+    """Maps points in the unit square to a disc of radius rmax, keeping a
+       uniform distribution uniform.
+    """
+    return polar_to_xy(float(rmax) * np.sqrt(u), 2. * pi * v)
+
+
+def uniform_random(N, rmax, seed=None):
+    """Creates N points uniformly distributed at random within a circle, as an
+       (N,2) array of x-y points.
+
+        Parameters
+        ----------
+        N:    integer_type
+              The number of points.
+        rmax: float_type
+              The radius of the circle.
+        seed: integer_type
+              Seed for the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    return _unit_to_disc(rng.random(N), rng.random(N), rmax)
+
+
+def _radical_inverse(i, base):
+    "Finds the radical inverse of an array of integers in a given base."
+    i = np.array(i, dtype=np.int64)
+    result = np.zeros(len(i))
+    f = 1. / base
+    while i.any():
+        result += f * (i % base)
+        i //= base
+        f /= base
+    return result
+
+
+def halton(N, rmax, skip=0):
+    """Creates N points of the 2D Halton low-discrepancy sequence (bases 2 and
+       3) within a circle, as an (N,2) array of x-y points.  The first point
+       is the centre of the circle.
+
+        Parameters
+        ----------
+        N:    integer_type
+              The number of points.
+        rmax: float_type
+              The radius of the circle.
+        skip: integer_type
+              The number of points at the start of the sequence to skip.
+    """
+    i = np.arange(skip, skip + N)
+    return _unit_to_disc(_radical_inverse(i, 2), _radical_inverse(i, 3), rmax)
+
+
+def sobol(N, rmax, skip=0):
+    """Creates N points of the 2D Sobol low-discrepancy sequence within a
+       circle, as an (N,2) array of x-y points.  The first point is the
+       centre of the circle.
+
+        Parameters
+        ----------
+        N:    integer_type
+              The number of points.
+        rmax: float_type
+              The radius of the circle.
+        skip: integer_type
+              The number of points at the start of the sequence to skip.
+    """
+    bits = 52
+    i = np.arange(skip, skip + N, dtype=np.uint64)
+    u = np.zeros(N, dtype=np.uint64)
+    v = np.zeros(N, dtype=np.uint64)
+    m = 1
+    for k in range(1, bits + 1):
+        bit = ((i >> np.uint64(k - 1)) & np.uint64(1)).astype(bool)
+        if not bit.any() and (1 << (k - 1)) > skip + N:
+            break
+        # The first dimension is the van der Corput sequence, and the second
+        # uses the primitive polynomial x + 1.
+        u[bit] ^= np.uint64(1 << (bits - k))
+        v[bit] ^= np.uint64(m << (bits - k))
+        m = (m << 1) ^ m
+    scale = 2.**-bits
+    return _unit_to_disc(u * scale, v * scale, rmax)
+
@@ -0,0 +1,156 @@
+"""
+Refractive indices that depend on wavelength.
+
+Materials give their refractive index at any wavelength, in metres, from a
+Sellmeier or Cauchy dispersion formula.  The index at each wavelength is
+only calculated once, and then looked up, so a bundle of rays with a few
+distinct wavelengths costs little more than a monochromatic one.  A small
+catalogue of glasses is included.
+"""
+import numpy as np
+
+# The helium d line, at which catalogue glasses are usually quoted.
+REFERENCE_WAVELENGTH = 587.56e-9
+
+
+class Material:
+    """
+    Creates a material, with a refractive index that depends on wavelength.
+    """
+
+    def __init__(self, name):
+        """
+        Initialises the Material class.
+
+        Parameters
+        ----------
+        name: string_type
+              The name of the material.
+        """
+        self.name = name
+        self._cache = {}
+
+    def _index(self, wavelength):
+        "Finds the refractive index at an array of wavelengths in metres."
+        raise NotImplementedError()
+
+    def index(self, wavelength=REFERENCE_WAVELENGTH):
+        """
+        Finds the refractive index of the material, for a wavelength or an
+        array of wavelengths in metres.
+
+        Parameters
+        ----------
+        wavelength: array_type
+                    The wavelength, or the wavelength of each ray.
+        """
+        wavelength = np.asarray(wavelength, dtype=float)
+        unique, inverse = np.unique(wavelength, return_inverse=True)
+        missing = [w for w in unique if w not in self._cache]
+        if missing:
+            for w, n in zip(missing, self._index(np.array(missing))):
+                self._cache[w] = float(n)
+        values = np.array([self._cache[w] for w in unique])
+        return values[inverse].reshape(wavelength.shape)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, self.name)
+
+
+class Constant(Material):
+    """
+    Creates a material with the same refractive index at every wavelength.
+    """
+
+    def __init__(self, name, n):
+        """
+        Initialises the Constant class.
+
+        Parameters
+        ----------
+        name: string_type
+              The name of the material.
+        n:    float_type
+              The refractive index.
+        """
+        Material.__init__(self, name)
+        self._n = float(n)
+
+    def _index(self, wavelength):
+        return np.full(np.shape(wavelength), self._n)
+
+
+class Sellmeier(Material):
+    """
+    Creates a material with a refractive index given by the Sellmeier
+    formula, n**2 = 1 + sum(B * L**2 / (L**2 - C)), for a wavelength L in
+    micrometres.
+    """
+
+    def __init__(self, name, B, C):
+        """
+        Initialises the Sellmeier class.
+
+        Parameters
+        ----------
+        name: string_type
+              The name of the material.
+        B:    list_type
+              The Sellmeier B coefficients.
+        C:    list_type
+              The Sellmeier C coefficients, in square micrometres.
+        """
+        Material.__init__(self, name)
+        self._B = np.array(B, dtype=float)
+        self._C = np.array(C, dtype=float)
+
+    def _index(self, wavelength):
+        L2 = (np.asarray(wavelength) * 1e6)[..., np.newaxis]**2
+        return np.sqrt(1 + np.sum(self._B * L2 / (L2 - self._C), axis=-1))
+
+
+class Cauchy(Material):
+    """
+    Creates a material with a refractive index given by the Cauchy formula,
+    n = A + B / L**2 + C / L**4 + ..., for a wavelength L in micrometres.
+    """
+
+    def __init__(self, name, coefficients):
+        """
+        Initialises the Cauchy class.
+
+        Parameters
+        ----------
+        name:         string_type
+                      The name of the material.
+        coefficients: list_type
+                      The coefficients A, B, C, ..., with B in square
+                      micrometres, C in micrometres to the fourth, etc.
+        """
+        Material.__init__(self, name)
+        self._coefficients = np.array(coefficients, dtype=float)
+
+    def _index(self, wavelength):
+        L2 = (np.asarray(wavelength) * 1e6)**2
+        powers = L2[..., np.newaxis]**-np.arange(len(self._coefficients))
+        return np.sum(self._coefficients * powers, axis=-1)
+
+
+CATALOGUE = dict((m.name, m) for m in [
+    Constant('AIR', 1.0),
+    Sellmeier('N-BK7', [1.03961212, 0.231792344, 1.01046945],
+              [0.00600069867, 0.0200179144, 103.560653]),
+    Sellmeier('N-SF11', [1.73759695, 0.313747346, 1.89878101],
+              [0.013188707, 0.0623068142, 155.23629]),
+    Sellmeier('F_SILICA', [0.6961663, 0.4079426, 0.8974794],
+              [0.0684043**2, 0.1162414**2, 9.896161**2]),
+])
+
+
+def get(name):
+    """Finds a material in the catalogue by name, such as 'N-BK7'.
+    """
+    try:
+        return CATALOGUE[name]
+    except KeyError:
+        raise Exception('There is no material called %s.' % name)
@@ -0,0 +1,445 @@
+"""
+Non-sequential tracing of ray bundles through scenes of optical elements.
+
+In a sequential OpticalSystem the order of the elements is fixed.  In a
+Scene, each ray goes on to whichever element it hits first, in any order
+and any number of times, so stray light paths can be followed through
+hundreds of surfaces.  Refracting surfaces refract rays from whichever side
+they arrive, using n1 on the side that the surface normals point into,
+which is the side of negative local z at the vertex, and n2 on the other,
+and reflect them on total internal reflection.  Mirrors reflect from either
+side, and output planes absorb the rays that reach them, as detectors.
+Each ray follows a single path, so ghost paths from partial reflections are
+not split off.
+
+Every element is put in an axis-aligned bounding box, made from its z
+position, its sag across the aperture and its aperture radius, and the
+boxes are organised in a bounding volume hierarchy (BVH).  The nearest hit
+of each ray is found by walking the hierarchy front to back, with every ray
+in the bundle taking a step at once, and testing only the elements whose
+boxes the ray enters before its nearest hit so far, so the cost grows with
+the logarithm of the number of elements rather than with the number of
+elements.
+"""
+import numpy as np
+import raytracer as rt
+
+# The kinds of element in a scene.
+REFRACTING = 0
+MIRROR = 1
+ASPHERE = 2
+PLANE = 3
+
+
+def _kind(element):
+    "Finds the kind of an element in a scene."
+    if isinstance(element, rt.AsphericRefraction):
+        return ASPHERE
+    if isinstance(element, rt.SphericalMirror):
+        return MIRROR
+    if isinstance(element, rt.SphericalRefraction):
+        return REFRACTING
+    if isinstance(element, rt.OutputPlane):
+        return PLANE
+    raise Exception('%s elements cannot be traced non-sequentially.'
+                    % type(element).__name__)
+
+
+def bounding_box(element, samples=65, padding=1e-6):
+    """Finds the axis-aligned bounding box of an optical element in global
+       coordinates, as the tuple (lo, hi) of its corners.
+
+       Parameters
+       ----------
+       element: instance_type
+                A SphericalRefraction, SphericalMirror, AsphericRefraction
+                or OutputPlane.
+       samples: integer_type
+                The number of radii at which the sag of an aspheric surface
+                is found.
+       padding: float_type
+                The distance the box is grown by on every side, so that
+                flat elements have boxes of finite thickness.
+    """
+    kind = _kind(element)
+    r = element._ap_r
+    sag = np.zeros(1)
+    if kind == ASPHERE:
+        radii = np.linspace(0., r, samples)
+        sag, g, valid = rt.asphere_sag(radii * radii, element._curv,
+                                       element._conic, element._coefficients)
+        sag = sag[valid]
+    elif kind != PLANE and element._curv != 0:
+        # The surface is the hemisphere nearest the vertex, at most.
+        r = min(r, 1. / abs(element._curv))
+        curv = element._curv
+        sag = np.array([0., curv * r * r
+                        / (1 + np.sqrt(max(1 - curv * curv * r * r, 0.)))])
+    lo = np.array([-r, -r, element._z0 + sag.min()])
+    hi = np.array([r, r, element._z0 + sag.max()])
+    if element._rotation is not None:
+        corners = np.array([[x, y, z] for x in (lo[0], hi[0])
+                            for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+        corners = element.to_global(corners, corners)[0]
+        lo, hi = corners.min(axis=0), corners.max(axis=0)
+    return lo - padding, hi + padding
+
+
+def build_bvh(lo, hi):
+    """Builds a bounding volume hierarchy over a set of boxes, splitting the
+       boxes at the median of their centres along the longest axis of the
+       centres at each level, with one box in each leaf.  Returns the tuple
+       (node_lo, node_hi, left, right, leaf) of arrays describing the nodes,
+       with the root first.  left and right are the indices of the children
+       of each node, and leaf is the index of the box in each leaf node, or
+       -1 for the other nodes.
+
+       Parameters
+       ----------
+       lo, hi: array_type
+               (S,3) arrays of the lower and upper corners of the boxes.
+    """
+    lo = np.asarray(lo, dtype=float).reshape(-1, 3)
+    hi = np.asarray(hi, dtype=float).reshape(-1, 3)
+    centre = (lo + hi) / 2
+    nodes = []
+
+    def build(boxes):
+        node = len(nodes)
+        nodes.append(None)
+        box_lo, box_hi = lo[boxes].min(axis=0), hi[boxes].max(axis=0)
+        if len(boxes) == 1:
+            nodes[node] = (box_lo, box_hi, -1, -1, boxes[0])
+            return node
+        spread = centre[boxes].max(axis=0) - centre[boxes].min(axis=0)
+        order = boxes[np.argsort(centre[boxes, np.argmax(spread)],
+                                 kind='stable')]
+        half = len(order) // 2
+        left = build(order[:half])
+        right = build(order[half:])
+        nodes[node] = (box_lo, box_hi, left, right, -1)
+        return node
+
+    build(np.arange(len(lo)))
+    return (np.array([node[0] for node in nodes]),
+            np.array([node[1] for node in nodes]),
+            np.array([node[2] for node in nodes]),
+            np.array([node[3] for node in nodes]),
+            np.array([node[4] for node in nodes]))
+
+
+def box_entry(p, inverse, lo, hi):
+    """Finds the distances along arrays of rays at which they enter and leave
+       boxes, by the slab method.  Returns the tuple (near, far).  A ray
+       passes through its box if far >= max(near, 0).
+
+       Parameters
+       ----------
+       p:       numpy.array_type
+                (N,3) array of ray positions.
+       inverse: numpy.array_type
+                (N,3) array of the reciprocals of the ray directions.
+       lo, hi:  numpy.array_type
+                (N,3) arrays of the corners of the box for each ray.
+    """
+    near = np.full(len(p), -np.inf)
+    far = np.full(len(p), np.inf)
+    with np.errstate(invalid='ignore'):
+        for axis in range(3):
+            t1 = (lo[:, axis] - p[:, axis]) * inverse[:, axis]
+            t2 = (hi[:, axis] - p[:, axis]) * inverse[:, axis]
+            # fmin and fmax ignore the NaNs of rays parallel to a face.
+            near = np.fmax(near, np.fmin(t1, t2))
+            far = np.fmin(far, np.fmax(t1, t2))
+    return near, far
+
+
+def sphere_lengths(p, k, z0, curv, ap_r, eps=1e-9):
+    """Finds the distance along each ray to its nearest intercept with a
+       spherical or plane surface, in local coordinates, from either side.
+       Both roots of the intercept are tried, and the nearest that is
+       further than eps, on the hemisphere nearest the vertex and within
+       the aperture radius, is taken.  Returns an array of distances, which
+       is inf for rays that don't hit the surface.
+
+       Parameters
+       ----------
+       p:    numpy.array_type
+             (N,3) array of ray positions.
+       k:    numpy.array_type
+             (N,3) array of normalised ray directions.
+       z0, curv, ap_r: array_type
+             The surface parameters, for all of the rays or for each ray.
+       eps:  float_type
+             The shortest distance to a hit, so that a ray leaving a
+             surface doesn't hit it again where it starts.
+    """
+    qz = p[:, 2] - z0
+    qq = p[:, 0] * p[:, 0] + p[:, 1] * p[:, 1] + qz * qz
+    qk = p[:, 0] * k[:, 0] + p[:, 1] * k[:, 1] + qz * k[:, 2]
+    b = curv * qk - k[:, 2]
+    cc = curv * qq - 2 * qz
+    best = np.full(len(p), np.inf)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        near = np.copysign(np.sqrt(b * b - curv * cc), -b) - b
+        for length in (cc / near, near / curv):
+            x = p[:, 0] + length * k[:, 0]
+            y = p[:, 1] + length * k[:, 1]
+            valid = ((length > eps) & (curv * (qz + length * k[:, 2]) <= 1)
+                     & (x * x + y * y <= ap_r * ap_r))
+            best = np.where(valid & (length < best), length, best)
+    return best
+
+
+class Scene:
+    """
+    Creates a non-sequential scene from a collection of optical elements,
+    with a bounding volume hierarchy over their bounding boxes.
+    """
+
+    def __init__(self, elements):
+        """
+        Initialises the Scene class.
+
+        Parameters
+        ----------
+        elements: list_type
+                  The optical elements, or an OpticalSystem, in any order.
+        """
+        if hasattr(elements, 'elements'):
+            elements = elements.elements()
+        self._elements = tuple(elements)
+        if not self._elements:
+            raise Exception('A scene needs at least one element.')
+        self._kind = np.array([_kind(e) for e in self._elements])
+        self._z0 = np.array([e._z0 for e in self._elements])
+        self._curv = np.array([getattr(e, '_curv', 0.)
+                               for e in self._elements])
+        self._ap_r = np.array([e._ap_r for e in self._elements])
+        self._transformed = any(e._rotation is not None
+                                for e in self._elements)
+        self._rotation = np.array([np.eye(3) if e._rotation is None
+                                   else e._rotation for e in self._elements])
+        self._offset = np.array([np.zeros(3) if e._rotation is None
+                                 else e._offset for e in self._elements])
+        boxes = [bounding_box(e) for e in self._elements]
+        self._lo = np.array([box[0] for box in boxes])
+        self._hi = np.array([box[1] for box in boxes])
+        self._bvh = build_bvh(self._lo, self._hi)
+        # Median splits give leaves at most this many levels below the root.
+        self._depth = int(np.ceil(np.log2(len(self._elements))))
+
+    def elements(self):
+        """
+        Finds the optical elements in the scene, in the order they were
+        given, which is the order of the element indices.
+        """
+        return self._elements
+
+    def _to_local(self, p, k, e):
+        "Transforms rays to the local coordinates of an element for each."
+        if not self._transformed:
+            return p, k
+        rotation = self._rotation[e]
+        return (np.einsum('ni,nij->nj', p, rotation) - self._offset[e],
+                np.einsum('ni,nij->nj', k, rotation))
+
+    def _to_global(self, p, k, e):
+        "Transforms rays from the local coordinates of an element for each."
+        if not self._transformed:
+            return p, k
+        rotation = self._rotation[e]
+        return (np.einsum('nj,nij->ni', p + self._offset[e], rotation),
+                np.einsum('nj,nij->ni', k, rotation))
+
+    def _lengths(self, p, k, e, eps):
+        """Finds the distances along rays to their intercepts with an element
+           for each, or inf where they don't hit it.
+        """
+        p, k = self._to_local(p, k, e)
+        length = sphere_lengths(p, k, self._z0[e], self._curv[e],
+                                self._ap_r[e], eps)
+        for i in np.unique(e[self._kind[e] == ASPHERE]):
+            chosen = e == i
+            points, status = self._elements[i]._local_intercept(p[chosen],
+                                                                k[chosen])
+            t = np.einsum('ij,ij->i', points - p[chosen], k[chosen])
+            length[chosen] = np.where((status == rt.REFRACTED) & (t > eps),
+                                      t, np.inf)
+        return length
+
+    def nearest_hit(self, p, k, eps=1e-9):
+        """
+        Finds the element that each of an array of rays hits first.  Every
+        ray descends the bounding volume hierarchy with its own stack of
+        nodes, nearest child first, and all of the rays take a step at
+        once.  Boxes that a ray enters beyond its nearest hit so far are
+        skipped, so most rays only test the elements along their path.
+        Returns the tuple (element, length) of the index of the element each
+        ray hits, or -1 for rays that hit nothing, and the distance to the
+        hit.
+
+        Parameters
+        ----------
+        p:   numpy.array_type
+             (N,3) array of ray positions.
+        k:   numpy.array_type
+             (N,3) array of normalised ray directions.
+        eps: float_type
+             The shortest distance to a hit, as for sphere_lengths.
+        """
+        node_lo, node_hi, left, right, leaf = self._bvh
+        n = len(p)
+        best = np.full(n, np.inf)
+        element = np.full(n, -1)
+        with np.errstate(divide='ignore'):
+            inverse = 1. / k
+        # Each stack holds at most one node per level, and the root.
+        stack = np.empty((n, self._depth + 1), dtype=int)
+        entry = np.empty((n, self._depth + 1))
+        size = np.zeros(n, dtype=int)
+        rays = np.arange(n)
+        root = np.zeros(n, dtype=int)
+        self._push(rays, root, box_entry(p, inverse, node_lo[root],
+                                         node_hi[root]), best, stack, entry,
+                   size)
+        rays = rays[size > 0]
+        while len(rays):
+            size[rays] -= 1
+            top = size[rays]
+            nodes = stack[rays, top]
+            # Boxes entered beyond the nearest hit so far can be skipped.
+            keep = entry[rays, top] < best[rays]
+            r, nodes = rays[keep], nodes[keep]
+            at_leaf = leaf[nodes] >= 0
+            if at_leaf.any():
+                hit, e = r[at_leaf], leaf[nodes[at_leaf]]
+                length = self._lengths(p[hit], k[hit], e, eps)
+                closer = length < best[hit]
+                best[hit[closer]] = length[closer]
+                element[hit[closer]] = e[closer]
+            r, nodes = r[~at_leaf], nodes[~at_leaf]
+            if len(r):
+                # The farther child is pushed first, so the nearer child is
+                # visited first.
+                pr, ir = p[r], inverse[r]
+                a, b = left[nodes], right[nodes]
+                box_a = box_entry(pr, ir, node_lo[a], node_hi[a])
+                box_b = box_entry(pr, ir, node_lo[b], node_hi[b])
+                swap = box_a[0] > box_b[0]
+                for node, box, chosen in ((a, box_a, swap), (b, box_b, ~swap),
+                                          (a, box_a, ~swap), (b, box_b, swap)):
+                    self._push(r[chosen], node[chosen],
+                               (box[0][chosen], box[1][chosen]), best,
+                               stack, entry, size)
+            rays = rays[size[rays] > 0]
+        return element, best
+
+    def _push(self, rays, nodes, box, best, stack, entry, size):
+        """Pushes a node onto the stack of each ray, if the ray enters its box
+           before its nearest hit so far.  box is the tuple (near, far) of
+           the distances at which the rays enter and leave the boxes.
+        """
+        near, far = box
+        near = np.maximum(near, 0.)
+        enters = (far >= near) & (near < best[rays])
+        rays, top = rays[enters], size[rays[enters]]
+        stack[rays, top] = nodes[enters]
+        entry[rays, top] = near[enters]
+        size[rays] += 1
+
+    def propagate_bundle(self, bundle, max_events=32, eps=1e-9):
+        """
+        Propagates a bundle of rays through the scene, moving every ray to
+        the element it hits first, then refracting or reflecting it, until
+        every ray has been absorbed by an output plane, has left the scene,
+        or has had max_events interactions.  The new positions and
+        directions after each interaction are appended to the bundle, and
+        the optical path lengths are updated.  Rays that leave the scene
+        are marked as lost and MISSED.  Returns an (events, N) array of the
+        index of the element that each ray hit at each interaction, or -1.
+
+        Parameters
+        ----------
+        bundle:     instance_type
+                    RayBundle object to propagate.
+        max_events: integer_type
+                    The largest number of interactions for each ray.
+        eps:        float_type
+                    The shortest distance to a hit, as for sphere_lengths.
+        """
+        n = len(bundle)
+        tables = [e.indices(bundle.wavelength) if self._kind[i] != PLANE
+                  else (1., 1.) for i, e in enumerate(self._elements)]
+        # The indices are only kept for every ray if they have wavelengths.
+        m = 1 if bundle.wavelength is None else n
+        n1, n2 = [np.array([np.broadcast_to(row[j], (m,)) for row in tables],
+                           dtype=float) for j in (0, 1)]
+        absorbed = np.zeros(n, dtype=bool)
+        path = []
+        for event in range(max_events):
+            active = np.nonzero(~bundle.lost & ~absorbed)[0]
+            if len(active) == 0:
+                break
+            p, k = bundle.p(), bundle.d()
+            element, length = self.nearest_hit(p[active], k[active], eps)
+            hits = element >= 0
+            r, e = active[hits], element[hits]
+            step = np.full(n, -1, dtype=np.int16)
+            step[r] = e
+            path.append(step)
+            status = bundle.live_status()
+            status[active[~hits]] = rt.MISSED
+            new_p, new_k = p.copy(), k.copy()
+            index = bundle.index.copy()
+            medium = bundle.index.copy()
+            if len(r):
+                local_p, local_k = self._to_local(p[r], k[r], e)
+                points = local_p + local_k * length[hits, np.newaxis]
+                kind = self._kind[e]
+                normals = rt.surface_normals(points, self._z0[e],
+                                             self._curv[e])
+                for i in np.unique(e[kind == ASPHERE]):
+                    chosen = e == i
+                    element_i = self._elements[i]
+                    normals[chosen] = rt.asphere_normals(
+                        points[chosen], element_i._z0, element_i._curv,
+                        element_i._conic, element_i._coefficients)
+                # The normals point into the n1 side, so rays travelling
+                # against them go from n1 to n2, and the others from n2 to
+                # n1, whichever way they travel along z.
+                forward = rt.dot_rows(local_k, normals) < 0
+                column = r if m > 1 else 0
+                n_in = np.where(forward, n1[e, column], n2[e, column])
+                n_out = np.where(forward, n2[e, column], n1[e, column])
+                refracting = (kind == REFRACTING) | (kind == ASPHERE)
+                refracted, tir = rt.refract_bundle(local_k, normals, n_in,
+                                                   n_out)
+                tir &= refracting
+                reflects = tir | (kind == MIRROR)
+                directions = np.where(
+                    reflects[:, np.newaxis],
+                    rt.reflect_bundle(local_k, normals),
+                    np.where(refracting[:, np.newaxis], refracted, local_k))
+                points, directions = self._to_global(points, directions, e)
+                new_p[r] = points
+                new_k[r] = directions
+                index[r] = np.where(refracting, n_in, bundle.index[r])
+                medium[r] = np.where(refracting & ~tir, n_out, index[r])
+                status[r] = np.where(reflects, rt.REFLECTED,
+                                     np.where(refracting, rt.REFRACTED,
+                                              status[r]))
+                absorbed[r[kind == PLANE]] = True
+            bundle.append_point(new_p, index)
+            bundle.append_vector(new_k)
+            bundle.set_status(status)
+            bundle.set_index(medium)
+        if not path:
+            return np.zeros((0, n), dtype=np.int16)
+        return np.array(path)
+
+    def __len__(self):
+        return len(self._elements)
+
+    def __repr__(self):
+        return 'Scene(%d elements)' % len(self._elements)
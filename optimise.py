@@ -0,0 +1,244 @@
+"""
+Optimisation of lenses made of SphericalRefraction surfaces.
+
+The curvatures and positions of the surfaces are adjusted to minimise the
+rms spot radius at the focal plane, with the Levenberg-Marquardt method
+applied to the x-y positions of the rays in the spot diagram.  The
+derivatives are found by central finite differences, and every perturbed
+system, as well as every trial step, is traced together in one stacked
+trace with sweep.trace_stack, so each iteration costs two batched traces.
+"""
+import numpy as np
+import genpolar
+import paraxial
+import raytracer as rt
+import sweep
+
+
+def best_focus(p, k, lost=None):
+    """Finds the z position of the plane where the rms spot radius of stacks
+       of rays is smallest.  The spot size is quadratic in z, so this has a
+       closed form.  Returns a (G,) array.
+
+       Parameters
+       ----------
+       p:    array_type
+             (G,N,3) array of ray positions after the last surface.
+       k:    array_type
+             (G,N,3) array of ray directions after the last surface.
+       lost: array_type
+             (G,N) boolean array of rays to leave out.
+    """
+    slope = k[..., :2] / k[..., 2:]
+    offset = p[..., :2] - p[..., 2:] * slope
+    if lost is not None:
+        slope = np.where(lost[..., np.newaxis], 0., slope)
+        offset = np.where(lost[..., np.newaxis], 0., offset)
+    return (-np.einsum('gni,gni->g', offset, slope)
+            / np.einsum('gni,gni->g', slope, slope))
+
+
+def spot_stack(z0, curv, n1, n2, ap_r, xy, focus='paraxial'):
+    """Traces the same pupil sample through a stack of optical systems, and
+       finds the x-y positions of the rays on each focal plane.  Rays that
+       are lost keep the position where they were lost, so they add to the
+       spot size.  Returns the tuple (spots, z_focus) of the (G,N,2) array
+       of positions and the (G,) array of focal plane positions.
+
+       Parameters
+       ----------
+       focus: string_type
+              'paraxial' for the paraxial focal plane, or 'best' for the
+              plane with the smallest rms spot radius.
+
+       The other parameters are the same as for sweep.trace_stack.
+    """
+    p, k, lost = sweep.trace_stack(z0, curv, n1, n2, ap_r, xy)
+    if focus == 'paraxial':
+        z_focus = paraxial.cardinal_points(z0, curv, n1, n2)['focal_point']
+    elif focus == 'best':
+        z_focus = best_focus(p, k, lost)
+    else:
+        raise Exception("focus must be 'paraxial' or 'best'.")
+    length = (z_focus[:, np.newaxis] - p[..., 2]) / k[..., 2]
+    spots = p[..., :2] + length[..., np.newaxis] * k[..., :2]
+    spots = np.where(lost[..., np.newaxis], p[..., :2], spots)
+    return spots, z_focus
+
+
+def optimise(elements, rmax, n=6, m=6, vary_curv=True, vary_z0=False,
+             focus='paraxial', efl='keep', iterations=100, tolerance=1e-10,
+             step=1e-6, min_spacing=0.1):
+    """Minimises the rms spot radius of a bundle of parallel rays at the
+       focal plane of a sequence of SphericalRefraction surfaces, by
+       adjusting their curvatures and z axis intercepts.  The focal plane is
+       found again for every trial system.  Without a constraint on the
+       effective focal length, the spot can always be made smaller by
+       weakening the lens, so by default the starting focal length is kept
+       by solving for the last varied curvature.
+       Returns a dictionary of:
+
+       elements:    a list of the optimised SphericalRefraction surfaces,
+                    with the same media as the original surfaces.
+       curv, z0:    arrays of the optimised curvatures and intercepts.
+       rms:         the rms spot radius of the optimised system.
+       efl:         its effective focal length.
+       focal_point: the z position of its focal plane.
+       iterations:  the number of iterations used.
+       history:     a list of the rms spot radius after each iteration.
+
+       Parameters
+       ----------
+       elements:   list_type
+                   SphericalRefraction surfaces centred on the z axis, or an
+                   OpticalSystem, in the order that rays pass through them.
+                   Output planes are ignored.
+       rmax:       float_type
+                   The radius of the ray bundle.
+       n, m:       integer_type
+                   The numbers of concentric circles and the rate of increase
+                   of rays per circle, as for rt.bundle.
+       vary_curv:  array_type
+                   Whether to vary the curvature of all the surfaces, or a
+                   boolean for each surface.
+       vary_z0:    array_type
+                   Whether to vary the z axis intercept of all the surfaces,
+                   or a boolean for each surface.  The surfaces are kept in
+                   order, after z = 0 where the rays start, by min_spacing.
+       focus:      string_type
+                   'paraxial' or 'best', as for spot_stack.
+       efl:        float_type
+                   The effective focal length to hold the system to, 'keep'
+                   for the starting focal length, or None to leave it free.
+       iterations: integer_type
+                   The maximum number of iterations.
+       tolerance:  float_type
+                   The fractional decrease in the mean square spot radius
+                   below which the optimisation stops.
+       step:       float_type
+                   The relative step used for the finite differences.
+       min_spacing: float_type
+                   The smallest distance allowed between neighbouring
+                   vertices, and between z = 0 and the first vertex, when
+                   their z axis intercepts vary, or the starting distance
+                   if that is smaller.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    surfaces = [e for e in elements if hasattr(e, '_curv')]
+    if any(type(e) is not rt.SphericalRefraction for e in surfaces):
+        raise Exception('Only SphericalRefraction surfaces can be '
+                        'optimised.')
+    # The stacked trace is of surfaces centred on the z axis.
+    if any(e._rotation is not None for e in surfaces):
+        raise Exception('Tilted or decentred surfaces can not be '
+                        'optimised.')
+    z0, curv, n1, n2 = paraxial.surface_arrays(surfaces)
+    ap_r = np.array([e._ap_r for e in surfaces])
+    # The media are passed on to the optimised surfaces, so that materials
+    # keep their names and dispersion.
+    media = [e.parameters()[2:4] for e in surfaces]
+    S = len(surfaces)
+    vary_curv = np.array(np.broadcast_to(vary_curv, (S,)), dtype=bool)
+    vary_z0 = np.broadcast_to(vary_z0, (S,)).astype(bool)
+    if efl == 'keep':
+        efl = paraxial.cardinal_points(z0, curv, n1, n2)['efl']
+    solve = None
+    if efl is not None:
+        # The power of the system is linear in the curvature of any one
+        # surface, so the last varied curvature is solved for exactly to
+        # give the focal length, rather than being a free parameter.
+        if not vary_curv.any():
+            raise Exception('A curvature must vary to hold the focal '
+                            'length.')
+        solve = np.nonzero(vary_curv)[0][-1]
+        vary_curv[solve] = False
+    nc = vary_curv.sum()
+    x = np.concatenate((curv[vary_curv], z0[vary_z0]))
+    P = len(x)
+    if P == 0:
+        raise Exception('There are no parameters to vary.')
+    xy = genpolar.xyuniform(n, rmax, m)
+    # The rays start at z = 0, which is kept in front of the first vertex.
+    floor = np.minimum(min_spacing, np.diff(np.concatenate(([0.], z0))))
+
+    def ordered(z):
+        "Moves vertices on so each is at least floor after the one before."
+        gaps = np.maximum(np.diff(z, axis=1, prepend=0.), floor)
+        return np.cumsum(gaps, axis=1)
+
+    def systems(X):
+        "Builds (G,S) surface parameter arrays from (G,P) parameters."
+        G = len(X)
+        c = np.tile(curv, (G, 1))
+        z = np.tile(z0, (G, 1))
+        c[:, vary_curv] = X[:, :nc]
+        z[:, vary_z0] = X[:, nc:]
+        if vary_z0.any():
+            z = ordered(z)
+        n1s, n2s = np.tile(n1, (G, 1)), np.tile(n2, (G, 1))
+        if solve is not None:
+            c[:, solve] = 0.
+            C0 = paraxial.system_matrix(z, c, n1s, n2s)[2]
+            c[:, solve] = 1.
+            C1 = paraxial.system_matrix(z, c, n1s, n2s)[2]
+            c[:, solve] = (-1. / efl - C0) / (C1 - C0)
+        return z, c, n1s, n2s, np.tile(ap_r, (G, 1))
+
+    def residuals(X):
+        "Finds the (G,2N) spot positions and focal planes of each system."
+        spots, z_focus = spot_stack(*systems(X), xy=xy, focus=focus)
+        return spots.reshape(len(X), -1), z_focus
+
+    h = step * (1 + np.abs(x))
+    damping = 1e-3
+    cost = np.inf
+    history = []
+    for iteration in range(1, iterations + 1):
+        # The base system and every perturbed system are traced together.
+        X = np.vstack((x, x + np.diag(h), x - np.diag(h)))
+        R = residuals(X)[0]
+        r = R[0]
+        cost = np.sum(r**2)
+        J = (R[1:P + 1] - R[P + 1:]).T / (2 * h)
+        A = J.T.dot(J)
+        g = J.T.dot(r)
+        scale = np.diag(A) + 1e-30
+        dampings = damping * np.array([0.01, 0.1, 1., 10., 100.])
+        steps = np.array([-np.linalg.solve(A + d * np.diag(scale), g)
+                          for d in dampings])
+        # Every trial step is traced together too.
+        R_trial, _ = residuals(x + steps)
+        costs = np.sum(R_trial**2, axis=1)
+        # Trial systems that lose every ray have a cost of NaN.
+        best = 0
+        if np.isfinite(costs).any():
+            best = np.nanargmin(costs)
+        if not costs[best] < cost:
+            damping *= 100
+            history.append(np.sqrt(cost / len(xy)))
+            if damping > 1e12:
+                break
+            continue
+        improvement = (cost - costs[best]) / cost
+        x = x + steps[best]
+        if vary_z0.any():
+            x[nc:] = systems(x[np.newaxis])[0][0, vary_z0]
+        cost = costs[best]
+        damping = dampings[best]
+        history.append(np.sqrt(cost / len(xy)))
+        if improvement < tolerance:
+            break
+    z, c, n1s, n2s, aps = [a[0] for a in systems(x[np.newaxis])]
+    z_focus = residuals(x[np.newaxis])[1][0]
+    optimised = [rt.SphericalRefraction(z[i], c[i], media[i][0],
+                                        media[i][1], aps[i])
+                 for i in range(S)]
+    return {'elements': optimised,
+            'curv': c,
+            'z0': z,
+            'rms': np.sqrt(cost / len(xy)),
+            'efl': float(paraxial.cardinal_points(z, c, n1s, n2s)['efl']),
+            'focal_point': z_focus,
+            'iterations': iteration,
+            'history': history}
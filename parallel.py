@@ -0,0 +1,145 @@
+"""
+Parallel tracing of ray bundles across several processes.
+
+The bundle is split into contiguous slices, one per task, and the ray state
+is kept in shared memory so the workers write their results in place rather
+than sending them back through pickling.  Each ray is traced by exactly the
+same code as in the serial path, so the results, and their order, are
+identical to OpticalSystem.propagate_bundle.
+"""
+import numpy as np
+from multiprocessing import Pool, cpu_count, shared_memory
+import raytracer as rt
+
+# State attached to in each worker process by _attach.
+_worker = {}
+
+
+def _attach(names, n, elements, offset):
+    "Attaches a worker process to the shared ray state arrays."
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    _worker['blocks'] = blocks
+    _worker['p'] = np.ndarray((n, 3), dtype=float, buffer=blocks[0].buf)
+    _worker['d'] = np.ndarray((n, 3), dtype=float, buffer=blocks[1].buf)
+    _worker['lost'] = np.ndarray((n,), dtype=bool, buffer=blocks[2].buf)
+    _worker['terminated'] = np.ndarray((n,), dtype=np.int16,
+                                       buffer=blocks[3].buf)
+    _worker['status'] = np.ndarray((n,), dtype=np.uint8, buffer=blocks[4].buf)
+    _worker['opl'] = np.ndarray((n,), dtype=float, buffer=blocks[5].buf)
+    _worker['index'] = np.ndarray((n,), dtype=float, buffer=blocks[6].buf)
+    _worker['offset'] = offset
+    _worker['wavelength'] = None
+    if len(blocks) > 7:
+        _worker['wavelength'] = np.ndarray((n,), dtype=float,
+                                           buffer=blocks[7].buf)
+    _worker['system'] = rt.OpticalSystem(elements)
+
+
+def _trace_slice(bounds):
+    "Traces the rays between the bounds (start, stop) in a worker process."
+    start, stop = bounds
+    p, d, lost = _worker['p'], _worker['d'], _worker['lost']
+    wavelength = _worker['wavelength']
+    if wavelength is not None:
+        wavelength = wavelength[start:stop]
+    bundle = rt.RayBundle(p[start:stop], d[start:stop], wavelength)
+    bundle.lost[:] = lost[start:stop]
+    status = _worker['status'][start:stop]
+    bundle.status[:] = status
+    opl = _worker['opl'][start:stop]
+    index = _worker['index'][start:stop]
+    bundle.opl[:] = opl
+    bundle.index[:] = index
+    _worker['system'].propagate_bundle(bundle)
+    p[start:stop] = bundle.p()
+    d[start:stop] = bundle.d()
+    lost[start:stop] = bundle.lost
+    status[:] = bundle.status
+    opl[:] = bundle.opl
+    index[:] = bundle.index
+    # Element indices count from the first element of the whole bundle.
+    terminated = _worker['terminated'][start:stop]
+    newly = bundle.terminated >= 0
+    terminated[newly] = bundle.terminated[newly] + _worker['offset']
+
+
+def _slices(n, tasks):
+    "Splits n rays into at most tasks contiguous (start, stop) slices."
+    edges = np.linspace(0, n, min(tasks, n) + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def propagate_bundle(elements, bundle, workers=None, chunks_per_worker=4):
+    """Propagates a bundle of rays through a sequence of optical elements,
+       sharing the rays between a pool of worker processes.  Only the final
+       positions and directions are appended to the bundle, and the lost
+       mask, status codes and optical path lengths are updated as in the
+       serial path.
+
+       Parameters
+       ----------
+       elements:          list_type
+                          Optical elements, or an OpticalSystem, in the order
+                          that rays pass through them.
+       bundle:            instance_type
+                          RayBundle object to propagate.
+       workers:           integer_type
+                          The number of worker processes.  Defaults to the
+                          number of CPUs.  With one worker the bundle is
+                          traced in this process.
+       chunks_per_worker: integer_type
+                          The number of slices given to each worker, which
+                          helps to balance the load.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    elements = list(elements)
+    if workers is None:
+        workers = cpu_count()
+    n = len(bundle)
+    if workers <= 1 or n == 0:
+        rt.OpticalSystem(elements).propagate_bundle(bundle)
+        return
+    sizes = [n * 3 * 8, n * 3 * 8, n, n * 2, n, n * 8, n * 8]
+    if bundle.wavelength is not None:
+        sizes.append(n * 8)
+    blocks = [shared_memory.SharedMemory(create=True, size=max(size, 1))
+              for size in sizes]
+    try:
+        p = np.ndarray((n, 3), dtype=float, buffer=blocks[0].buf)
+        d = np.ndarray((n, 3), dtype=float, buffer=blocks[1].buf)
+        lost = np.ndarray((n,), dtype=bool, buffer=blocks[2].buf)
+        p[:] = bundle.p()
+        d[:] = bundle.d()
+        lost[:] = bundle.lost
+        terminated = np.ndarray((n,), dtype=np.int16, buffer=blocks[3].buf)
+        terminated[:] = bundle.terminated
+        status = np.ndarray((n,), dtype=np.uint8, buffer=blocks[4].buf)
+        status[:] = bundle.status
+        opl = np.ndarray((n,), dtype=float, buffer=blocks[5].buf)
+        opl[:] = bundle.opl
+        index = np.ndarray((n,), dtype=float, buffer=blocks[6].buf)
+        index[:] = bundle.index
+        if bundle.wavelength is not None:
+            np.ndarray((n,), dtype=float,
+                       buffer=blocks[7].buf)[:] = bundle.wavelength
+        offset = len(bundle.positions) - 1
+        names = [block.name for block in blocks]
+        pool = Pool(workers, initializer=_attach,
+                    initargs=(names, n, elements, offset))
+        try:
+            pool.map(_trace_slice, _slices(n, workers * chunks_per_worker))
+        finally:
+            pool.close()
+            pool.join()
+        bundle.append_point(p.copy())
+        bundle.append_vector(d.copy())
+        bundle.lost[:] = lost
+        bundle.terminated[:] = terminated
+        bundle.status[:] = status
+        bundle.opl[:] = opl
+        bundle.index[:] = index
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,156 @@
+"""
+Paraxial ray transfer (ABCD) matrices for sequences of spherical surfaces.
+
+The matrices act on (y, n*u), the height of a ray and its reduced angle, so
+every matrix has a determinant of one.  All of the functions accept arrays of
+surface parameters whose last axis runs over the surfaces, and any leading
+axes run over separate lens prescriptions, so thousands of prescriptions can
+be solved at once.
+"""
+import numpy as np
+
+
+def surface_arrays(elements, wavelength=None):
+    """Finds the z axis intercepts, curvatures and refractive indices of the
+       refracting surfaces in a sequence of optical elements.  Elements
+       without a curvature, such as output planes, are skipped.  Mirrors are
+       treated as refracting surfaces with n2 = -n1, so the refractive
+       indices change sign after every reflection.  Decentres and tilts are
+       ignored, as they have no first order effect on axial rays in a
+       centred system.  Returns the tuple
+       (z0, curv, n1, n2) of 1D arrays.
+
+       Parameters
+       ----------
+       elements:   list_type
+                   Optical elements, or an OpticalSystem, in the order that
+                   rays pass through them.
+       wavelength: float_type
+                   The wavelength in metres, for surfaces made of materials.
+                   The reference wavelength is used if this is None.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    surfaces = [e for e in elements if hasattr(e, '_curv')]
+    if not surfaces:
+        raise Exception('There are no refracting surfaces.')
+    z0 = np.array([e._z0 for e in surfaces])
+    curv = np.array([e._curv for e in surfaces])
+    indices = np.array([e.indices(wavelength) for e in surfaces], dtype=float)
+    # Light travels backwards after an odd number of reflections.
+    mirror = indices[:, 1] < 0
+    reflections = np.cumsum(mirror) - mirror
+    sign = np.where(reflections % 2 == 0, 1., -1.)
+    return z0, curv, sign * indices[:, 0], sign * indices[:, 1]
+
+
+def system_matrix(z0, curv, n1, n2):
+    """Finds the ray transfer matrix from the first surface to the last
+       surface.  Returns the tuple (A, B, C, D), with one value for each
+       prescription.
+
+       Parameters
+       ----------
+       z0:   array_type
+             The z axis intercepts of the surfaces.
+       curv: array_type
+             The curvatures of the surfaces.
+       n1:   array_type
+             The refractive indices to the left of the surfaces.
+       n2:   array_type
+             The refractive indices to the right of the surfaces.
+    """
+    z0, curv, n1, n2 = np.broadcast_arrays(*[np.asarray(a, dtype=float)
+                                             for a in (z0, curv, n1, n2)])
+    shape = z0.shape[:-1]
+    A, B = np.ones(shape), np.zeros(shape)
+    C, D = np.zeros(shape), np.ones(shape)
+    for i in range(z0.shape[-1]):
+        if i > 0:
+            # Transfer through the medium between the two surfaces.
+            t = (z0[..., i] - z0[..., i - 1]) / n2[..., i - 1]
+            A, B = A + t * C, B + t * D
+        # Refraction at the surface.
+        power = (n2[..., i] - n1[..., i]) * curv[..., i]
+        C, D = C - power * A, D - power * B
+    return A, B, C, D
+
+
+def cardinal_points(z0, curv, n1, n2):
+    """Finds the paraxial properties of a sequence of spherical surfaces.
+       Returns a dictionary of arrays, with one value for each prescription:
+
+       efl:                the effective focal length, 1/power.
+       bfd:                the back focal distance from the last surface.
+       ffd:                the front focal distance from the first surface.
+       focal_point:        the z position of the rear focal point.
+       front_focal_point:  the z position of the front focal point.
+       principal_plane1:   the z position of the front principal plane.
+       principal_plane2:   the z position of the rear principal plane.
+
+       The parameters are the same as for system_matrix.
+    """
+    z0 = np.asarray(z0, dtype=float)
+    n1 = np.asarray(n1, dtype=float)
+    n2 = np.asarray(n2, dtype=float)
+    A, B, C, D = system_matrix(z0, curv, n1, n2)
+    n_in = np.broadcast_to(n1, z0.shape)[..., 0]
+    n_out = np.broadcast_to(n2, z0.shape)[..., -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        efl = -1 / C
+        bfd = -A * n_out / C
+        ffd = -D * n_in / C
+        focal_point = z0[..., -1] + bfd
+        front_focal_point = z0[..., 0] - ffd
+        principal_plane1 = front_focal_point - n_in / C
+        principal_plane2 = focal_point + n_out / C
+    return {'efl': efl,
+            'bfd': bfd,
+            'ffd': ffd,
+            'focal_point': focal_point,
+            'front_focal_point': front_focal_point,
+            'principal_plane1': principal_plane1,
+            'principal_plane2': principal_plane2}
+
+
+def image(z0, curv, n1, n2, z_object):
+    """Finds the paraxial image of an object at z position z_object.  Returns
+       the tuple (z_image, magnification) of arrays.
+
+       Parameters
+       ----------
+       z_object: array_type
+                 The z position of the object, in front of the first
+                 surface.
+
+       The other parameters are the same as for system_matrix.
+    """
+    z0 = np.asarray(z0, dtype=float)
+    n1 = np.asarray(n1, dtype=float)
+    n2 = np.asarray(n2, dtype=float)
+    A, B, C, D = system_matrix(z0, curv, n1, n2)
+    n_in = np.broadcast_to(n1, z0.shape)[..., 0]
+    n_out = np.broadcast_to(n2, z0.shape)[..., -1]
+    # Include the transfer from the object to the first surface.
+    t = (z0[..., 0] - np.asarray(z_object, dtype=float)) / n_in
+    B, D = B + t * A, D + t * C
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_image = z0[..., -1] - n_out * B / D
+        magnification = 1 / D
+    return z_image, magnification
+
+
+def focal_point(elements, wavelength=None):
+    """Finds the paraxial focal point of a sequence of optical elements
+       without tracing any rays.
+
+       Parameters
+       ----------
+       elements:   list_type
+                   Optical elements, or an OpticalSystem, in the order that
+                   rays pass through them.
+       wavelength: float_type
+                   The wavelength in metres, as for surface_arrays.
+    """
+    arrays = surface_arrays(elements, wavelength)
+    return float(cardinal_points(*arrays)['focal_point'])
@@ -0,0 +1,359 @@
+"""
+Lens prescriptions read from plain text files.
+
+A prescription file holds any number of lenses, each a table of refracting
+surfaces.  Lines are split on whitespace, and anything after a # is a
+comment.
+
+    # A plano-convex singlet, curved side first.
+    lens convex_first
+    z 100                  # the z position of the next vertex
+    #       curv  thickness  material  aperture
+    surface 0.02  5          1.5168    21.8
+    surface 0     0          AIR       21.8
+    image focus
+
+lens starts a new lens with a name.  Each surface line gives the curvature,
+the distance to the next vertex, the medium after the surface, as a
+refractive index or the name of a material in the catalogue, and the
+aperture radius.  The first vertex is at z = 0 unless a z line gives its
+position, and z lines can also move any later vertex forwards.  object
+gives the medium before the first surface, which is AIR by default.  image
+gives the z position of the output plane, or focus for the paraxial focal
+point.  Without an image line, the output plane is at the thickness after
+the last surface, or at the paraxial focal point if that thickness is 0.
+The rays are started at z = 0, so no vertex may be behind it, and a focal
+point used as the image must be after the last surface.  Numbers must be
+finite.
+
+Files are parsed once, and the lenses are then compiled into a table of
+(P,S) arrays of the surface parameters of P lenses with up to S surfaces,
+which the stacked trace kernels in sweep and optimise take directly.  Lenses
+with fewer than S surfaces are padded at the front with planes that don't
+change the rays, at z = 0 where the stacked kernels start the rays, so every
+lens in the table is traced at once.
+"""
+import glob
+import os
+import numpy as np
+import materials
+import paraxial
+import raytracer as rt
+import sweep
+
+# The extension of prescription files found in a directory.
+EXTENSION = '.lens'
+
+
+def _number(token, source, line):
+    "Converts a token to a float, or raises an Exception saying where."
+    try:
+        value = float(token)
+    except ValueError:
+        raise Exception('%s, line %d: %s is not a number.'
+                        % (source, line, token))
+    if not np.isfinite(value):
+        raise Exception('%s, line %d: %s is not a finite number.'
+                        % (source, line, token))
+    return value
+
+
+def _medium(token, source, line):
+    """Checks that a token is a refractive index or the name of a material,
+       and returns it as a float or the name.
+    """
+    try:
+        n = float(token)
+    except ValueError:
+        if token not in materials.CATALOGUE:
+            raise Exception('%s, line %d: there is no material called %s.'
+                            % (source, line, token))
+        return token
+    if not np.isfinite(n):
+        raise Exception('%s, line %d: %s is not a finite number.'
+                        % (source, line, token))
+    if n < 1:
+        raise Exception('%s, line %d: the refractive index %s is less than '
+                        '1.' % (source, line, token))
+    return n
+
+
+def parse(text, source='<string>'):
+    """Parses the text of a prescription file.  Returns a list of lenses,
+       each a dictionary with the lens "name", the "object" medium, a list
+       of (z0, curv, medium, ap_r) tuples of its "surfaces", and the z
+       position of its "image" plane, or None for the paraxial focal point.
+
+       Parameters
+       ----------
+       text:   string_type
+               The contents of a prescription file.
+       source: string_type
+               The name of the file, for error messages.
+    """
+    lenses = []
+    lens = None
+    z = 0.
+    thickness = 0.
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        keyword, values = words[0].lower(), words[1:]
+        sizes = {'lens': 1, 'object': 1, 'z': 1, 'surface': 4, 'image': 1}
+        if keyword not in sizes:
+            raise Exception('%s, line %d: unknown keyword %s.'
+                            % (source, number, words[0]))
+        if len(values) != sizes[keyword]:
+            raise Exception('%s, line %d: %s takes %d values.'
+                            % (source, number, keyword, sizes[keyword]))
+        if keyword == 'lens':
+            lens = {'name': values[0], 'object': 'AIR', 'surfaces': [],
+                    'image': None, 'thickness': 0., 'line': number}
+            lenses.append(lens)
+            z = 0.
+            continue
+        if lens is None:
+            raise Exception('%s, line %d: %s comes before the first lens.'
+                            % (source, number, keyword))
+        if lens['image'] is not None or lens.get('focus'):
+            raise Exception('%s, line %d: %s comes after the image.'
+                            % (source, number, keyword))
+        if keyword == 'object':
+            if lens['surfaces']:
+                raise Exception('%s, line %d: object comes after a surface.'
+                                % (source, number))
+            lens['object'] = _medium(values[0], source, number)
+        elif keyword == 'z':
+            new_z = _number(values[0], source, number)
+            if new_z < 0:
+                raise Exception('%s, line %d: z is behind z = 0, where the '
+                                'rays start.' % (source, number))
+            if lens['surfaces'] and new_z < z:
+                raise Exception('%s, line %d: z moves back past the last '
+                                'surface.' % (source, number))
+            z = new_z
+        elif keyword == 'surface':
+            curv, thickness = [_number(v, source, number)
+                               for v in values[:2]]
+            medium = _medium(values[2], source, number)
+            ap_r = _number(values[3], source, number)
+            if thickness < 0:
+                raise Exception('%s, line %d: the thickness is negative.'
+                                % (source, number))
+            if not ap_r > 0:
+                raise Exception('%s, line %d: the aperture radius must be '
+                                'positive.' % (source, number))
+            if abs(curv) * ap_r > 1:
+                raise Exception('%s, line %d: the aperture radius is larger '
+                                'than the radius of curvature.'
+                                % (source, number))
+            if lens['surfaces'] and z <= lens['surfaces'][-1][0]:
+                raise Exception('%s, line %d: the surface is not after the '
+                                'last surface.' % (source, number))
+            lens['surfaces'].append((z, curv, medium, ap_r))
+            lens['thickness'] = thickness
+            z += thickness
+        elif keyword == 'image':
+            if not lens['surfaces']:
+                raise Exception('%s, line %d: image comes before the '
+                                'surfaces.' % (source, number))
+            if values[0].lower() == 'focus':
+                lens['focus'] = True
+                lens['line'] = number
+                continue
+            lens['image'] = _number(values[0], source, number)
+            if lens['image'] <= lens['surfaces'][-1][0]:
+                raise Exception('%s, line %d: the image is not after the '
+                                'last surface.' % (source, number))
+    names = set()
+    for lens in lenses:
+        if not lens['surfaces']:
+            raise Exception('%s: lens %s has no surfaces.'
+                            % (source, lens['name']))
+        if lens['name'] in names:
+            raise Exception('%s: there are two lenses called %s.'
+                            % (source, lens['name']))
+        names.add(lens['name'])
+        thickness = lens.pop('thickness')
+        line = lens.pop('line')
+        if lens['image'] is None and not lens.pop('focus', False) and (
+                thickness > 0):
+            lens['image'] = lens['surfaces'][-1][0] + thickness
+        lens.pop('focus', None)
+        if lens['image'] is None and not (
+                _focal_point(lens) > lens['surfaces'][-1][0]):
+            raise Exception('%s, line %d: the focal point of lens %s is not '
+                            'after the last surface.'
+                            % (source, line, lens['name']))
+    return lenses
+
+
+def load(paths):
+    """Parses prescription files.  Returns the list of lenses in all of
+       them, as for parse.
+
+       Parameters
+       ----------
+       paths: list_type
+              A file, a directory, whose files ending in EXTENSION are read
+              in order of name, or a list of files and directories.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path,
+                                                       '*' + EXTENSION))))
+        else:
+            files.append(path)
+    lenses = []
+    for path in files:
+        with open(path) as f:
+            lenses.extend(parse(f.read(), path))
+    return lenses
+
+
+def _indices(media, wavelength):
+    """Finds the refractive index of each of a list of media, evaluating each
+       material only once.
+    """
+    found = {}
+    for medium in set(media):
+        if isinstance(medium, str):
+            found[medium] = float(materials.get(medium).index(wavelength))
+        else:
+            found[medium] = medium
+    return np.array([found[medium] for medium in media])
+
+
+def _focal_point(lens, wavelength=None):
+    """Finds the paraxial focal point of a lens, which is NaN or infinite if
+       it has no finite focal point.
+    """
+    if wavelength is None:
+        wavelength = materials.REFERENCE_WAVELENGTH
+    n = _indices([lens['object']] + [s[2] for s in lens['surfaces']],
+                 wavelength)
+    z0, curv = [np.array([s[i] for s in lens['surfaces']]) for i in (0, 1)]
+    z = paraxial.cardinal_points(z0, curv, n[:-1], n[1:])['focal_point']
+    return float(z) if np.isfinite(z) else np.nan
+
+
+def compile_table(lenses, wavelength=None):
+    """Compiles lenses into a table of surface parameters.  Returns a
+       dictionary of arrays:
+
+       z0, curv, n1, n2, ap_r: (P,S) arrays of the surface parameters of the
+                               P lenses, padded at the front to S surfaces.
+       surfaces:               (P,) array of the number of real surfaces.
+       z_image:                (P,) array of the z positions of the image
+                               planes.
+       names:                  (P,) array of the names of the lenses.
+       wavelength:             The wavelength the indices were found at.
+
+       Parameters
+       ----------
+       lenses:     list_type
+                   Lenses, as made by parse or load.
+       wavelength: float_type
+                   The wavelength in metres, for the indices of materials.
+                   The reference wavelength is used if this is None.
+    """
+    if wavelength is None:
+        wavelength = materials.REFERENCE_WAVELENGTH
+    P = len(lenses)
+    if P == 0:
+        raise Exception('There are no lenses to compile.')
+    counts = np.array([len(lens['surfaces']) for lens in lenses])
+    S = counts.max()
+    # The media before and after every surface, in one flat list, so each
+    # material is evaluated once for the whole table.
+    before, after = [], []
+    for lens in lenses:
+        media = [lens['object']] + [s[2] for s in lens['surfaces']]
+        before.extend(media[:-1])
+        after.extend(media[1:])
+    n_before = _indices(before, wavelength)
+    n_after = _indices(after, wavelength)
+    n_object = _indices([lens['object'] for lens in lenses], wavelength)
+    flat = np.array([s[:2] + (s[3],) for lens in lenses
+                     for s in lens['surfaces']], dtype=float)
+    # The row and column of every real surface, so that the last surface of
+    # every lens is in the last column.
+    row = np.repeat(np.arange(P), counts)
+    column = (np.arange(len(row)) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+              + np.repeat(S - counts, counts))
+    z0 = np.zeros((P, S))
+    curv = np.zeros((P, S))
+    ap_r = np.full((P, S), np.inf)
+    n1 = np.repeat(n_object[:, np.newaxis], S, axis=1)
+    n2 = n1.copy()
+    z0[row, column] = flat[:, 0]
+    curv[row, column] = flat[:, 1]
+    ap_r[row, column] = flat[:, 2]
+    n1[row, column] = n_before
+    n2[row, column] = n_after
+    z_image = np.array([np.nan if lens['image'] is None else lens['image']
+                        for lens in lenses])
+    focus = np.isnan(z_image)
+    if focus.any():
+        z_image[focus] = paraxial.cardinal_points(
+            z0[focus], curv[focus], n1[focus], n2[focus])['focal_point']
+        # parse checks the focal points at the reference wavelength only.
+        virtual = focus & ~(np.isfinite(z_image) & (z_image > z0[:, -1]))
+        if virtual.any():
+            raise Exception('The focal point of lens %s is not after the '
+                            'last surface at a wavelength of %g m.'
+                            % (lenses[np.argmax(virtual)]['name'],
+                               wavelength))
+    return {'z0': z0, 'curv': curv, 'n1': n1, 'n2': n2, 'ap_r': ap_r,
+            'surfaces': counts, 'z_image': z_image,
+            'names': np.array([lens['name'] for lens in lenses]),
+            'wavelength': np.array(float(wavelength))}
+
+
+def trace_table(table, rmax, n=6, m=6, workers=1, chunk_size=256):
+    """Traces a uniform bundle of parallel rays, starting at z = 0, through
+       every lens in a table at once, to its image plane.  Returns the
+       dictionary of (P,) arrays given by sweep.sweep, with the rms spot
+       radius, diffraction-limited radius, image plane position and fraction
+       of rays lost for each lens.
+
+       Parameters
+       ----------
+       table: instance_type
+              A table made by compile_table.
+       rmax:  array_type
+              The radius of the bundle, for all of the lenses or for each.
+
+       The other parameters are the same as for sweep.sweep.
+    """
+    return sweep.sweep(table['z0'], table['curv'], table['n1'],
+                       table['n2'], table['ap_r'], rmax, n, m,
+                       float(table['wavelength']), table['z_image'], workers,
+                       chunk_size)
+
+
+def elements(lens):
+    """Makes the optical elements of a lens, as SphericalRefraction surfaces
+       followed by an output plane at its image, for the analyses that work
+       on elements.
+
+       Parameters
+       ----------
+       lens: instance_type
+             A lens, as made by parse or load.
+    """
+    surfaces = []
+    before = lens['object']
+    for z0, curv, medium, ap_r in lens['surfaces']:
+        surfaces.append(rt.SphericalRefraction(z0, curv, before, medium,
+                                               ap_r))
+        before = medium
+    z_image = lens['image']
+    if z_image is None:
+        z_image = paraxial.focal_point(surfaces)
+    return surfaces + [rt.OutputPlane(z_image, 10000)]
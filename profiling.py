@@ -0,0 +1,267 @@
+"""
+Per-surface instrumentation of ray traces.
+
+A TraceProfiler counts, for every optical element that rays are propagated
+through, the rays that reach it, the rays that pass it, the rays that are
+vignetted or miss it, the rays that are totally internally reflected by it,
+and the time spent in it.  Both propagate_ray and propagate_bundle are
+recorded.  The profiler is switched on by wrapping the propagate methods of
+the element classes, and switched off by restoring them, so traces cost
+nothing extra while no profiler is enabled.
+
+    with profiling.TraceProfiler() as profiler:
+        system.propagate_bundle(bundle)
+    profiler.print_stats()
+
+The fused numba backend and the worker processes of the parallel module
+don't call the element methods, so their traces are not recorded.  Use the
+numpy backend with one worker to profile them.
+"""
+from collections import OrderedDict
+from time import perf_counter
+import json
+import pstats
+import sys
+import numpy as np
+import raytracer as rt
+
+# The counters kept for each element, in order.
+COUNTERS = ('calls', 'rays_in', 'rays_out', 'vignetted', 'missed', 'tir',
+            'seconds')
+
+# The profiler that is enabled, if any.
+_enabled = {}
+
+
+def _element_classes():
+    """Finds every subclass of OpticalElement, other than OpticalSystem, that
+       defines its own propagate methods, as the list of tuples
+       (class, method name).
+    """
+    found = []
+    classes = list(rt.OpticalElement.__subclasses__())
+    while classes:
+        cls = classes.pop(0)
+        classes.extend(cls.__subclasses__())
+        if issubclass(cls, rt.OpticalSystem):
+            continue
+        for name in ('propagate_ray', 'propagate_bundle'):
+            if name in cls.__dict__:
+                found.append((cls, name))
+    return found
+
+
+def _refracting(element):
+    "Finds whether total internal reflection at an element is counted."
+    return (isinstance(element, rt.SphericalRefraction)
+            and not isinstance(element, rt.SphericalMirror))
+
+
+class TraceProfiler:
+    """
+    Records per-surface counters and timings of ray traces while enabled.
+    Only one profiler can be enabled at a time.
+    """
+
+    def __init__(self):
+        """
+        Initialises the TraceProfiler class.
+        """
+        self._elements = OrderedDict()
+        self._originals = []
+
+    def enable(self):
+        """
+        Starts recording, by wrapping the propagate methods of every optical
+        element class.
+        """
+        if _enabled:
+            raise Exception('A TraceProfiler is already enabled.')
+        _enabled['profiler'] = self
+        for cls, name in _element_classes():
+            method = cls.__dict__[name]
+            self._originals.append((cls, name, method))
+            wrap = self._wrap_ray if name == 'propagate_ray' else (
+                self._wrap_bundle)
+            setattr(cls, name, wrap(method))
+
+    def disable(self):
+        """
+        Stops recording, by restoring the original propagate methods.
+        """
+        for cls, name, method in self._originals:
+            setattr(cls, name, method)
+        self._originals = []
+        _enabled.clear()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+
+    def _counters(self, element):
+        "Finds the counters of an element, adding them if it is new."
+        key = id(element)
+        if key not in self._elements:
+            self._elements[key] = (element, np.zeros(len(COUNTERS)))
+        return self._elements[key][1]
+
+    def _wrap_ray(self, method):
+        "Wraps a propagate_ray method to record each call."
+        profiler = self
+
+        def propagate_ray(element, ray):
+            start = perf_counter()
+            passed = method(element, ray)
+            seconds = perf_counter() - start
+            status = ray.status
+            profiler._counters(element)[:] += (
+                1, 1, bool(passed), status == rt.VIGNETTED,
+                status == rt.MISSED,
+                passed and status == rt.REFLECTED and _refracting(element),
+                seconds)
+            return passed
+        propagate_ray.__doc__ = method.__doc__
+        return propagate_ray
+
+    def _wrap_bundle(self, method):
+        "Wraps a propagate_bundle method to record each call."
+        profiler = self
+
+        def propagate_bundle(element, bundle):
+            live = ~bundle.lost
+            start = perf_counter()
+            method(element, bundle)
+            seconds = perf_counter() - start
+            passed = ~bundle.lost
+            newly = live & bundle.lost
+            status = bundle.status
+            tir = 0
+            if _refracting(element):
+                tir = np.count_nonzero(passed & (status == rt.REFLECTED))
+            profiler._counters(element)[:] += (
+                1, np.count_nonzero(live), np.count_nonzero(passed),
+                np.count_nonzero(newly & (status == rt.VIGNETTED)),
+                np.count_nonzero(newly & (status == rt.MISSED)), tir,
+                seconds)
+        propagate_bundle.__doc__ = method.__doc__
+        return propagate_bundle
+
+    def clear(self):
+        """
+        Removes every recorded counter.
+        """
+        self._elements.clear()
+
+    def _rows(self):
+        """
+        Finds the counters of every element that rays were propagated
+        through, in the order they were first reached, as a list of
+        dictionaries.  Each dictionary has the index and name of the
+        element, and the counters named in COUNTERS.
+        """
+        result = []
+        for i, (element, counters) in enumerate(self._elements.values()):
+            row = OrderedDict([('surface', i),
+                               ('element', _label(element))])
+            for name, value in zip(COUNTERS, counters):
+                row[name] = float(value) if name == 'seconds' else int(value)
+            result.append(row)
+        return result
+
+    def to_dict(self):
+        """
+        Finds the counters as a dictionary, with the total time in
+        "seconds", and a list of the counters of every element, in the
+        order they were first reached, in "surfaces".  The counters of each
+        element are a dictionary with its index as "surface", its name as
+        "element", and the counters named in COUNTERS.
+        """
+        rows = self._rows()
+        return OrderedDict([('seconds', sum(row['seconds'] for row in rows)),
+                            ('surfaces', rows)])
+
+    def to_json(self, path=None):
+        """
+        Finds the counters as a JSON string, and saves them to a file if a
+        path is given.
+
+        Parameters
+        ----------
+        path: string_type
+              The file to save the JSON in, or None.
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def create_stats(self):
+        """
+        Makes the stats dictionary read by pstats.Stats, so that
+        pstats.Stats(profiler) gives a cProfile style report of the time
+        spent in each element.  Each element is listed as a function named
+        after it, with the surface index as its line number.
+        """
+        # pstats takes the dictionary from the stats attribute.
+        self.stats = {}
+        for row in self._rows():
+            key = ('surface', row['surface'], row['element'])
+            self.stats[key] = (row['calls'], row['calls'], row['seconds'],
+                               row['seconds'], {})
+
+    def summary(self, sort=None):
+        """
+        Finds a table of the counters, laid out like a cProfile report, with
+        one line for each element.
+
+        Parameters
+        ----------
+        sort: string_type
+              The name of a counter to sort the elements by, largest first.
+              They are in the order they were first reached if None.
+        """
+        rows = self._rows()
+        if sort is not None:
+            rows.sort(key=lambda row: row[sort], reverse=True)
+        total = sum(row['seconds'] for row in rows)
+        lines = ['%d element calls in %.6f seconds' % (
+                     sum(row['calls'] for row in rows), total), '',
+                 '%8s %10s %10s %10s %10s %10s %10s %10s  %s' % (
+                     'ncalls', 'rays_in', 'rays_out', 'vignetted',
+                     'missed', 'tir', 'tottime', 'percall', 'surface')]
+        for row in rows:
+            lines.append('%8d %10d %10d %10d %10d %10d %10.6f %10.6f  %d %s'
+                         % (row['calls'], row['rays_in'], row['rays_out'],
+                            row['vignetted'], row['missed'], row['tir'],
+                            row['seconds'], row['seconds'] / row['calls'],
+                            row['surface'], row['element']))
+        return '\n'.join(lines)
+
+    def print_stats(self, sort=None, stream=None):
+        """
+        Prints the table made by summary.
+
+        Parameters
+        ----------
+        sort:   string_type
+                The counter to sort by, as for summary.
+        stream: instance_type
+                The file to print to.  Defaults to standard output.
+        """
+        print(self.summary(sort), file=stream or sys.stdout)
+
+
+def _label(element):
+    "Finds a short name for an element, from its type and z position."
+    return '%s(z0=%g)' % (type(element).__name__, element._z0)
+
+
+def pstats_report(profiler, sort='tottime'):
+    """Finds a pstats.Stats object for the times recorded by a profiler,
+       sorted by one of the pstats sort keys.
+    """
+    return pstats.Stats(profiler).sort_stats(sort)
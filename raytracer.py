@@ -5,19 +5,32 @@ Created on Thu Nov 24 15:24:37 2016
 @author: bms115
 """
 import numpy as np
-from math import cos,sin
+from math import sqrt, copysign, isfinite
 import genpolar
+import materials
 import vector_math as vm
-from vector_math import norm, normal_vector
+from vector_math import norm, normal_vector, norm_rows, dot_rows
 
+# Status codes for each ray, giving what happened to it at the latest element
+# it reached.  Rays that are vignetted or miss an element are lost there.
+REFRACTED = 0   # Refracted, or passed an element without changing direction.
+REFLECTED = 1   # Reflected by a mirror, or totally internally reflected.
+VIGNETTED = 2   # Hit the surface outside the aperture radius.
+MISSED = 3      # Never intercepted the surface.
 
-class Ray:  
+
+class Ray(object):
     """
     Creates a light ray. Each light ray is initialised with a position and a 
-    direction vector.
+    direction vector.  The path of the ray is stored in preallocated
+    (max_surfaces+1, 3) arrays, so propagating a ray doesn't create a new
+    array for every surface.
     """
-    
-    def __init__(self, p=[0., 0., 0.], k=[0., 0., 0.]):
+    __slots__ = ('_points', '_vectors', '_n_points', '_n_vectors',
+                 '_record_path', 'status')
+
+    def __init__(self, p=[0., 0., 0.], k=[0., 0., 0.], max_surfaces=4,
+                 record_path=True):
         """
         Initialises the Ray class.
         
@@ -28,28 +41,53 @@ class Ray:
        
         k: list_like
         Second argument, is the direction vector.
+
+        max_surfaces: integer_type
+        The number of surfaces the path buffers are sized for.  The buffers
+        grow if the ray is propagated through more surfaces than this.
+
+        record_path: bool_type
+        If False, only the latest position and direction are kept, which is
+        all that is needed for spot diagrams.
         """
-        p, k = np.array(p), norm(np.array(k))        
-        positions = []
-        directions = []
-        self.positions = positions
-        self.directions = directions
-        positions.append(p)
-        directions.append(k)
-        
+        size = max_surfaces + 1 if record_path else 1
+        self._points = np.empty((size, 3))
+        self._vectors = np.empty((size, 3))
+        self._points[0] = p
+        self._vectors[0] = k
+        self._n_points = 1
+        self._n_vectors = 1
+        self._record_path = record_path
+        self.status = REFRACTED
+        _normalise(self._vectors[0])
+
+    @property
+    def positions(self):
+        """
+        positions: A view of all the recorded positions of the light ray.
+        """
+        return self._points[:self._n_points]
+
+    @property
+    def directions(self):
+        """
+        directions: A view of all the recorded directions of the light ray.
+        """
+        return self._vectors[:self._n_vectors]
+
     def p(self):
         """
         p: Finds the last known position of the light ray from the list of
              positions.
         """
-        return self.positions[-1]
+        return self._points[self._n_points - 1]
 
     def d(self):
         """
         d: Finds the last known direction of the light ray from the list of
              directions.
         """
-        return self.directions[-1]
+        return self._vectors[self._n_vectors - 1]
 
     def append_point(self, point):
         """
@@ -60,7 +98,13 @@ class Ray:
         point: list_like
 
         """
-        self.positions.append(np.array(point))
+        if not self._record_path:
+            self._points[0] = point
+            return
+        if self._n_points == len(self._points):
+            self._points = _grow(self._points)
+        self._points[self._n_points] = point
+        self._n_points += 1
 
     def append_vector(self, vector):
         """
@@ -71,12 +115,188 @@ class Ray:
         vector: list_like 
 
         """
-        self.directions.append(norm(np.array(vector)))
+        if not self._record_path:
+            self._vectors[0] = vector
+            _normalise(self._vectors[0])
+            return
+        if self._n_vectors == len(self._vectors):
+            self._vectors = _grow(self._vectors)
+        self._vectors[self._n_vectors] = vector
+        _normalise(self._vectors[self._n_vectors])
+        self._n_vectors += 1
 
     def __repr__(self):
         return 'r=(%s, %s)' % (self.p().__repr__(), self.d().__repr__())
 
 
+def _normalise(vector):
+    "Normalises a vector in place, provided it has a non-zero magnitude."
+    n = sqrt(vector.dot(vector))
+    if n > 0:
+        vector /= n
+
+
+def _grow(buffer):
+    "Returns a copy of a path buffer with twice as many rows."
+    grown = np.empty((2 * len(buffer), 3))
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+class RayBundle:
+    """
+    Creates a bundle of N light rays, stored as (N,3) arrays of positions and
+    directions so that the whole bundle can be propagated through an optical
+    element in one pass.  Rays that miss an element are flagged in the
+    boolean array "lost" rather than being returned as None, and
+    the index of the element where each ray was lost, counting from the
+    first element the bundle passed through, is kept in "terminated" (-1
+    for rays that haven't been lost).  The status code of each ray, such as
+    REFLECTED or VIGNETTED, is kept as a uint8 in "status".  The optical
+    path length travelled by each ray, the sum of the refractive index times
+    the length of each segment of its path, is kept in "opl", and the
+    refractive index of the medium that each ray is in is kept in "index".
+    """
+
+    def __init__(self, p, k, wavelength=None):
+        """
+        Initialises the RayBundle class.
+
+        Parameters
+        ----------
+        p: array_like
+           First argument, an (N,3) array of position vectors.
+        k: array_like
+           Second argument, an (N,3) array of direction vectors.
+        wavelength: array_like
+           The wavelength in metres, of all the rays or of each ray.  If
+           None, materials use their index at the reference wavelength.
+        """
+        p = np.array(p, dtype=float).reshape(-1, 3)
+        k = norm_rows(np.array(k, dtype=float).reshape(-1, 3))
+        if p.shape != k.shape:
+            raise Exception('Positions and directions must have the same '
+                            'shape.')
+        self.positions = [p]
+        self.directions = [k]
+        self.lost = np.zeros(len(p), dtype=bool)
+        self.terminated = np.full(len(p), -1, dtype=np.int16)
+        self.status = np.zeros(len(p), dtype=np.uint8)
+        self.opl = np.zeros(len(p))
+        self.index = np.ones(len(p))
+        self.wavelength = None
+        if wavelength is not None:
+            self.wavelength = np.array(np.broadcast_to(
+                np.asarray(wavelength, dtype=float), (len(p),)))
+
+    def p(self):
+        """
+        p: Finds the last known positions of the rays in the bundle.
+        """
+        return self.positions[-1]
+
+    def d(self):
+        """
+        d: Finds the last known directions of the rays in the bundle.
+        """
+        return self.directions[-1]
+
+    def append_point(self, points, index=None):
+        """
+        It appends an (N,3) array of points to the list of positions, and
+        adds the optical path length from the previous positions to the
+        optical path length of each ray.
+
+        Parameters
+        ----------
+        points: array_like
+        index:  array_like
+                The refractive index of the medium that the rays crossed to
+                reach the points, for all of the rays or for each ray.  If
+                None, the rays are taken to have stayed in the same medium.
+
+        """
+        points = np.asarray(points, dtype=float)
+        if index is not None:
+            self.set_index(index)
+        step = points - self.positions[-1]
+        self.opl += self.index * np.sqrt(dot_rows(step, step))
+        self.positions.append(points)
+
+    def set_index(self, index):
+        """
+        Sets the refractive index of the medium that the rays are in.  Rays
+        that have been lost stay in the medium where they stopped.
+
+        Parameters
+        ----------
+        index: array_like
+               The refractive index for all of the rays or for each ray.
+
+        """
+        self.index = np.where(self.lost, self.index,
+                              np.asarray(index, dtype=float))
+
+    def append_vector(self, vectors):
+        """
+        It appends an (N,3) array of vectors to the list of directions.
+
+        Parameters
+        ----------
+        vectors: array_like
+
+        """
+        self.directions.append(norm_rows(vectors))
+
+    def stop(self, lost):
+        """
+        Marks rays as lost at the element that the latest positions were
+        appended by.
+
+        Parameters
+        ----------
+        lost: array_like
+              Boolean array that is True for every ray that is now lost.
+
+        """
+        newly = lost & ~self.lost
+        self.terminated[newly] = len(self.positions) - 2
+        self.status[newly] = np.maximum(self.status[newly], VIGNETTED)
+        self.lost |= newly
+
+    def live_status(self):
+        """
+        Finds the status codes to pass to the trace kernels, in which every
+        lost ray is at least VIGNETTED, even if it was only marked as lost in
+        the lost array.
+        """
+        return np.where(self.lost, np.maximum(self.status, VIGNETTED),
+                        self.status)
+
+    def set_status(self, status):
+        """
+        Sets the status of every ray that hasn't been lost to its status at
+        the element that the latest positions were appended by, and marks
+        rays that were vignetted or missed as lost there.
+
+        Parameters
+        ----------
+        status: array_like
+                Array of status codes for every ray.
+
+        """
+        status = np.asarray(status, dtype=np.uint8)
+        active = ~self.lost
+        self.status[active] = status[active]
+        self.stop(status >= VIGNETTED)
+
+    def __len__(self):
+        return len(self.lost)
+
+    def __repr__(self):
+        return 'RayBundle(%d rays, %d lost)' % (len(self), self.lost.sum())
+
+
 class OpticalElement:
     """
     Creates some kind of optical element. The optical element is a surface
@@ -87,6 +307,66 @@ class OpticalElement:
         "Propogates a ray through some optical element."
         raise NotImplementedError()
 
+    def propagate_bundle(self, bundle):
+        "Propagates a bundle of rays through some optical element."
+        raise NotImplementedError()
+
+    def parameters(self):
+        "Finds the tuple of parameters that define the optical element."
+        raise NotImplementedError()
+
+    # The rotation taking global directions to the local directions of the
+    # element, or None for an element centred on the z axis.
+    _rotation = None
+
+    def _set_transform(self, decenter, tilt):
+        """
+        Precomputes the transform between global coordinates and the local
+        coordinates of the element, in which it is centred on the z axis.
+        The element is decentred by (dx, dy), and then tilted about its
+        vertex by tilt_x degrees about the x axis followed by tilt_y degrees
+        about the y axis.
+        """
+        self._decenter = (float(decenter[0]), float(decenter[1]))
+        self._tilt = (float(tilt[0]), float(tilt[1]))
+        if self._decenter == (0., 0.) and self._tilt == (0., 0.):
+            self._rotation = None
+            return
+        ax, ay = np.radians(self._tilt)
+        rx = np.array([[1., 0., 0.],
+                       [0., np.cos(ax), -np.sin(ax)],
+                       [0., np.sin(ax), np.cos(ax)]])
+        ry = np.array([[np.cos(ay), 0., np.sin(ay)],
+                       [0., 1., 0.],
+                       [-np.sin(ay), 0., np.cos(ay)]])
+        # The columns of the rotation are the local axes in global
+        # coordinates, so row vectors are taken to local coordinates by
+        # multiplying by it on the right.
+        self._rotation = rx.dot(ry)
+        vertex = np.array([self._decenter[0], self._decenter[1], self._z0])
+        self._offset = vertex.dot(self._rotation) - [0., 0., self._z0]
+
+    def to_local(self, p, k):
+        """
+        Transforms (...,3) arrays of positions and directions from global
+        coordinates to the local coordinates of the element, with one matrix
+        multiplication each.  Returns the tuple (p, k).
+        """
+        if self._rotation is None:
+            return p, k
+        return p.dot(self._rotation) - self._offset, k.dot(self._rotation)
+
+    def to_global(self, p, k):
+        """
+        Transforms (...,3) arrays of positions and directions from the local
+        coordinates of the element to global coordinates.  Returns the tuple
+        (p, k).
+        """
+        if self._rotation is None:
+            return p, k
+        return ((p + self._offset).dot(self._rotation.T),
+                k.dot(self._rotation.T))
+
 
 class SphericalRefraction(OpticalElement):
     """
@@ -94,7 +374,8 @@ class SphericalRefraction(OpticalElement):
         defined by 5 parameters.
     """
 
-    def __init__(self, z0, curv, n1, n2, ap_r):
+    def __init__(self, z0, curv, n1, n2, ap_r, decenter=(0., 0.),
+                 tilt=(0., 0.)):
         """
         Initialises the SphericalRefraction class.
 
@@ -106,18 +387,64 @@ class SphericalRefraction(OpticalElement):
               The curvature of the surface or the reciprocal of the radius
               of curvature.
         n1:   float_type
-              The refractive index to the left of the optical element.
+              The refractive index to the left of the optical element, or a
+              Material, or the name of a material in the catalogue.
         n2:   float_type
-              The refractive index to the right of the optical element.
+              The refractive index to the right of the optical element, or a
+              Material, or the name of a material in the catalogue.
         ap_r: float_type
               The aperture radius of the optical element, or how far either
               side of the z axis it extends.
+        decenter: list_type
+              The (x, y) offset of the vertex from the z axis.
+        tilt: list_type
+              The angles in degrees that the element is tilted by about the
+              x axis and then the y axis, through its vertex.
         """
         self._z0 = float(z0)
         self._curv = float(curv)
-        self._n1 = float(n1)
-        self._n2 = float(n2)
+        self._set_transform(decenter, tilt)
+        # Materials are kept for bundles with wavelengths, and the indices at
+        # the reference wavelength are used everywhere else.
+        self._material1 = _material(n1)
+        self._material2 = _material(n2)
+        self._n1 = _reference_index(n1, self._material1)
+        self._n2 = _reference_index(n2, self._material2)
         self._ap_r = float(ap_r)
+        # Constants used for every ray, so they are only calculated once.
+        self._ap_r2 = self._ap_r * self._ap_r
+        if self._curv != 0.:
+            self._centre = np.array([0., 0., self._z0 + (1 / self._curv)])
+
+    def parameters(self):
+        """
+        Finds the parameters that define the optical element, as the tuple
+        (z0, curv, n1, n2, ap_r, dx, dy, tilt_x, tilt_y).  The name of a
+        material is given in place of its refractive index.
+        """
+        n1, n2 = self._n1, self._n2
+        if self._material1 is not None:
+            n1 = self._material1.name
+        if self._material2 is not None:
+            n2 = self._material2.name
+        return ((self._z0, self._curv, n1, n2, self._ap_r) + self._decenter
+                + self._tilt)
+
+    def indices(self, wavelength=None):
+        """
+        Finds the refractive indices (n1, n2) either side of the optical
+        element, for a wavelength or an array of wavelengths in metres.  If
+        the wavelength is None, the indices at the reference wavelength are
+        given.
+        """
+        if wavelength is None:
+            return self._n1, self._n2
+        n1, n2 = self._n1, self._n2
+        if self._material1 is not None:
+            n1 = self._material1.index(wavelength)
+        if self._material2 is not None:
+            n2 = self._material2.index(wavelength)
+        return n1, n2
 
     def centre(self):
         """Finds the centre of the spherical object, as long as the curvature
@@ -125,7 +452,22 @@ class SphericalRefraction(OpticalElement):
         if self._curv == 0.:
             raise Exception('This is a plane surface.')
         else:
-            return np.array([0., 0., self._z0 + (1 / self._curv)])
+            return self.to_global(self._centre.copy(), np.zeros(3))[0]
+
+    def normal(self, point):
+        """
+        Finds the normal vector to the optical element at a point on it, in
+        global coordinates.  The normal points in the negative z direction
+        of the element.
+        """
+        if self._rotation is None:
+            return self._local_normal(point)
+        local = point.dot(self._rotation) - self._offset
+        return self._local_normal(local).dot(self._rotation.T)
+
+    def _local_normal(self, point):
+        "Finds the normal vector at a point in local coordinates."
+        return normal_vector(self, point)
 
     def rad_curv(self):
         """
@@ -133,80 +475,302 @@ class SphericalRefraction(OpticalElement):
         """
         return 1 / np.absolute(self._curv)
 
+    def find_intercept(self, ray):
+        """
+        Finds the interception point of a ray with the optical element, and
+        the status of the ray there, as the tuple (point, status).  The point
+        is None if the ray never intercepts the surface, and the status is
+        VIGNETTED if it intercepts outside the aperture radius.
+        """
+        p, k = ray.p(), ray.d()
+        if self._rotation is not None:
+            p, k = self.to_local(p, k)
+        # The same intercept as intercept_status, in plain floats, so that
+        # single rays and bundles agree.
+        x, y, z = p.tolist()
+        kx, ky, kz = k.tolist()
+        curv = self._curv
+        qz = z - self._z0
+        b = curv * (x * kx + y * ky + qz * kz) - kz
+        c = curv * (x * x + y * y + qz * qz) - 2 * qz
+        disc = b * b - curv * c
+        if disc < 0:
+            return None, MISSED
+        near = copysign(sqrt(disc), -b) - b
+        if near == 0:
+            return None, MISSED
+        length = c / near
+        # Rays that start beyond the centre of curvature need the other
+        # intercept, which is on the same side of the centre as the vertex.
+        if curv * (qz + length * kz) > 1:
+            length = near / curv
+        if not (isfinite(length) and length >= 0):
+            return None, MISSED
+        x = x + kx * length
+        y = y + ky * length
+        point = np.array([x, y, z + kz * length])
+        if self._rotation is not None:
+            point = self.to_global(point, k)[0]
+        if x * x + y * y > self._ap_r2:
+            return point, VIGNETTED
+        return point, REFRACTED
+
+    def _local_intercept(self, p, k):
+        "Finds the intercepts and status codes of rays in local coordinates."
+        return intercept_status(p, k, self._z0, self._curv, self._ap_r)
+
     def intercept(self, ray):
         """
-        Finds the interception point of a ray with the optical element.
-        """
-        r2 = self._ap_r**2
-        k = ray.d()
-        p = ray.p()
-        if self._curv == 0:
-            # Distance between the ray's start point and the plane.
-            length = (self._z0 - p[2]) / k[2]
-            x2 = (p + k * length)[0]**2
-            y2 = (p + k * length)[1]**2
-            # Check if the ray intercepts within the aperture radius.
-            if x2 + y2 <= r2:
-                return (p + k * length)
-            else:
-                return 'no intercept'
-        else:
-            r = ray.p() - self.centre()
-            R = self.rad_curv()
-            dot = np.dot(r, k)
-            if ((dot * dot) - (np.dot(r, r) - (R * R))) < 0:
-                return 'no intercept'
-            else:
-                L1 =- dot + np.sqrt((dot * dot) - (np.dot(r, r) - (R * R)))
-                L2 =- dot - np.sqrt((dot * dot) - (np.dot(r, r) - (R * R)))  
-                a2 = (p + k * L1)[0]**2
-                b2 = (p + k * L1)[1]**2
-                c2 = (p + k * L2)[0]**2
-                d2 = (p + k * L2)[1]**2
-                if self._curv > 0:
-                    # For positive curvature, the closer intercept is wanted.
-                    if L1 < L2:
-                        if (a2 + b2 <= r2):
-                            return ray.p() + ray.d() * L1
-                        else:
-                            return 'no intercept'
-                    else:
-                        if (c2 + d2 <= r2):
-                            return ray.p() + ray.d() * L2
-                        else:
-                            return 'no intercept'
-                if self._curv < 0:
-                    # For negative curvature, the further intercept is wanted.
-                    if L1 < L2:
-                        if (c2 +d2 <= r2):
-                            return ray.p() + ray.d() * L2
-                        else:
-                            return 'no intercept'
-                    else:
-                        if (a2 + b2 <= r2):
-                            return ray.p() + ray.d() * L1
-                        else:
-                            return 'no intercept'
-                 
+        Finds the interception point of a ray with the optical element, or
+        None if it doesn't intercept within the aperture radius.
+        """
+        point, status = self.find_intercept(ray)
+        if status == VIGNETTED:
+            return None
+        return point
+
     def propagate_ray(self, ray):
         """
         Propagates a ray from its starting position, to the optical element,
         appends all new positions to the ray, and all new directions through
-        refraction to the ray. Stops if the ray doesn't intercept with an
-        optical element, or is reflected at the boundary.
+        refraction to the ray.  Rays that are totally internally reflected
+        are given the reflected direction.  Stops if the ray doesn't
+        intercept with the optical element.  Returns True if the ray was
+        refracted or reflected, and False if it was stopped, and sets the
+        status of the ray.
+        """
+        point, status = self.find_intercept(ray)
+        ray.status = status
+        if status != REFRACTED:
+            return False
+        ray.append_point(point)
+        normal = self.normal(point)
+        refracted = refract(ray, normal, self._n1, self._n2)
+        if refracted is None:
+            ray.append_vector(reflect(ray.d(), normal))
+            ray.status = REFLECTED
+        else:
+            ray.append_vector(refracted)
+        return True
+
+    def intercept_bundle(self, bundle):
+        """
+        Finds the interception points of a bundle of rays with the optical
+        element.  Returns an (N,3) array of points and a boolean array that
+        is True where a ray intercepts within the aperture radius.
+        """
+        p, k = self.to_local(bundle.p(), bundle.d())
+        points, hit = surface_intercept(p, k, self._z0, self._curv,
+                                        self._ap_r)
+        return self.to_global(points, k)[0], hit
+
+    def propagate_bundle(self, bundle):
+        """
+        Propagates a bundle of rays to the optical element and refracts them,
+        appending the new positions and directions to the bundle.  Rays that
+        are totally internally reflected are given the reflected direction.
+        Rays that don't intercept the element within the aperture radius are
+        marked as lost and keep their previous position and direction.
         """
-        if type(self.intercept(ray)) == np.ndarray:
-            ray.append_point(self.intercept(ray))
-        #Delete this alteration of putting the next section inside the if 
-        #statement if it doesn't work
-            normal = normal_vector(self, self.intercept(ray))
-            if type(refract(ray, normal, self._n1, self._n2)) == np.ndarray:
-                ray.append_vector(refract(ray, normal, self._n1, self._n2))
+        n1, n2 = self.indices(bundle.wavelength)
+        p, k = self.to_local(bundle.p(), bundle.d())
+        p, k, status = refract_surface(p, k, bundle.live_status(), self._z0,
+                                       self._curv, n1, n2, self._ap_r)
+        p, k = self.to_global(p, k)
+        bundle.append_point(p, n1)
+        bundle.append_vector(k)
+        bundle.set_status(status)
+        # Totally internally reflected rays stay in the first medium.
+        bundle.set_index(np.where(status == REFLECTED, n1, n2))
+
+
+class SphericalMirror(SphericalRefraction):
+    """
+        Creates an optical element that is a curved mirror, which is defined
+        by 3 parameters.  Rays are reflected back the way they came, so
+        later elements should be placed in the direction they then travel.
+    """
+
+    def __init__(self, z0, curv, ap_r, decenter=(0., 0.), tilt=(0., 0.)):
+        """
+        Initialises the SphericalMirror class.
+
+        Parameters
+        ----------
+        z0:   float_type
+              The z axis intercept of the mirror.
+        curv: float_type
+              The curvature of the mirror or the reciprocal of the radius
+              of curvature.
+        ap_r: float_type
+              The aperture radius of the mirror.
+
+        The decenter and tilt are the same as for SphericalRefraction.
+        """
+        SphericalRefraction.__init__(self, z0, curv, 1., 1., ap_r, decenter,
+                                     tilt)
+
+    def parameters(self):
+        """
+        Finds the parameters that define the mirror, as the tuple
+        (z0, curv, ap_r, dx, dy, tilt_x, tilt_y).
+        """
+        return ((self._z0, self._curv, self._ap_r) + self._decenter
+                + self._tilt)
+
+    def indices(self, wavelength=None):
+        """
+        Finds the refractive indices (n1, n2) either side of the mirror, for
+        paraxial calculations.  A mirror acts as a refracting surface with
+        n2 = -n1.
+        """
+        return 1., -1.
+
+    def propagate_ray(self, ray):
+        """
+        Propagates a ray from its starting position to the mirror, and
+        appends the new position and the reflected direction to the ray.
+        Returns True if the ray was reflected, and False if it doesn't
+        intercept the mirror, and sets the status of the ray.
+        """
+        point, status = self.find_intercept(ray)
+        ray.status = status
+        if status != REFRACTED:
+            return False
+        ray.append_point(point)
+        ray.append_vector(reflect(ray.d(), self.normal(point)))
+        ray.status = REFLECTED
+        return True
+
+    def propagate_bundle(self, bundle):
+        """
+        Propagates a bundle of rays to the mirror and reflects them, appending
+        the new positions and directions to the bundle.  Rays that don't
+        intercept the mirror within the aperture radius are marked as lost.
+        """
+        p, k = self.to_local(bundle.p(), bundle.d())
+        p, k, status = reflect_surface(p, k, bundle.live_status(), self._z0,
+                                       self._curv, self._ap_r)
+        p, k = self.to_global(p, k)
+        bundle.append_point(p)
+        bundle.append_vector(k)
+        bundle.set_status(status)
+
+
+def _material(n):
+    """Finds the Material for a refractive index given as a Material or the
+       name of one, or None for a fixed refractive index.
+    """
+    if isinstance(n, str):
+        return materials.get(n)
+    if hasattr(n, 'index'):
+        return n
+    return None
+
+
+def _reference_index(n, material):
+    "Finds a refractive index at the reference wavelength as a float."
+    if material is not None:
+        return float(material.index())
+    return float(n)
+
+
+class AsphericRefraction(SphericalRefraction):
+    """
+        Creates an optical element that is a conic or even aspheric surface,
+        with sag z - z0 = c r**2 / (1 + sqrt(1 - (1 + K) c**2 r**2))
+        + A4 r**4 + A6 r**6 + ...
+    """
+
+    def __init__(self, z0, curv, n1, n2, ap_r, conic=0., coefficients=(),
+                 decenter=(0., 0.), tilt=(0., 0.)):
+        """
+        Initialises the AsphericRefraction class.
+
+        Parameters
+        ----------
+        conic:        float_type
+                      The conic constant K, which is 0 for a sphere, -1 for
+                      a paraboloid, and less than -1 for a hyperboloid.
+        coefficients: list_type
+                      The aspheric coefficients A4, A6, A8, ... of the even
+                      powers of r from r**4.
+
+        The other parameters are the same as for SphericalRefraction.
+        """
+        SphericalRefraction.__init__(self, z0, curv, n1, n2, ap_r, decenter,
+                                     tilt)
+        self._conic = float(conic)
+        self._coefficients = tuple(float(a) for a in coefficients)
+
+    def parameters(self):
+        """
+        Finds the parameters that define the optical element, as the tuple
+        (z0, curv, n1, n2, ap_r, dx, dy, tilt_x, tilt_y, conic, A4, A6, ...).
+        """
+        return (SphericalRefraction.parameters(self) + (self._conic,)
+                + self._coefficients)
+
+    def sag(self, r):
+        """
+        Finds the sag of the surface at a distance r from its axis.
+        """
+        r = np.asarray(r, dtype=float)
+        return asphere_sag(r * r, self._curv, self._conic,
+                           self._coefficients)[0]
+
+    def find_intercept(self, ray):
+        """
+        Finds the interception point of a ray with the optical element, and
+        the status of the ray there, as for SphericalRefraction.
+        """
+        p, k = self.to_local(ray.p()[np.newaxis], ray.d()[np.newaxis])
+        points, status = self._local_intercept(p, k)
+        if status[0] == MISSED:
+            return None, MISSED
+        return self.to_global(points, k)[0][0], int(status[0])
+
+    def _local_intercept(self, p, k):
+        "Finds the intercepts and status codes of rays in local coordinates."
+        return asphere_intercept(p, k, self._z0, self._curv, self._conic,
+                                 self._coefficients, self._ap_r)
+
+    def _local_normal(self, point):
+        "Finds the normal vector at a point in local coordinates."
+        return asphere_normals(point[np.newaxis], self._z0, self._curv,
+                               self._conic, self._coefficients)[0]
+
+    def intercept_bundle(self, bundle):
+        """
+        Finds the interception points of a bundle of rays with the optical
+        element, as for SphericalRefraction.intercept_bundle.
+        """
+        p, k = self.to_local(bundle.p(), bundle.d())
+        points, status = self._local_intercept(p, k)
+        return self.to_global(points, k)[0], status == REFRACTED
+
+    def propagate_bundle(self, bundle):
+        """
+        Propagates a bundle of rays to the optical element and refracts them,
+        as for SphericalRefraction.propagate_bundle.
+        """
+        n1, n2 = self.indices(bundle.wavelength)
+        p, k = self.to_local(bundle.p(), bundle.d())
+        points, found = self._local_intercept(p, k)
+        normals = asphere_normals(points, self._z0, self._curv, self._conic,
+                                  self._coefficients)
+        p, k, status = refract_points(p, k, bundle.live_status(), points,
+                                      found, normals, n1, n2)
+        p, k = self.to_global(p, k)
+        bundle.append_point(p, n1)
+        bundle.append_vector(k)
+        bundle.set_status(status)
+        bundle.set_index(np.where(status == REFLECTED, n1, n2))
 
 
 class OutputPlane(OpticalElement):
 
-    def __init__(self, z0, ap_r):
+    def __init__(self, z0, ap_r, decenter=(0., 0.), tilt=(0., 0.)):
 
         """
         Initialises the OutputPlane class.
@@ -218,40 +782,146 @@ class OutputPlane(OpticalElement):
         ap_r: float_type
               The aperture radius of the optical element, or how far either
               side of the z axis it extends.
+
+        The decenter and tilt are the same as for SphericalRefraction.
         """
         self._z0 = float(z0)
         self._ap_r = float(ap_r)
+        self._ap_r2 = self._ap_r**2
+        self._set_transform(decenter, tilt)
+
+    def parameters(self):
+        """
+        Finds the parameters that define the output plane, as the tuple
+        (z0, ap_r, dx, dy, tilt_x, tilt_y).
+        """
+        return (self._z0, self._ap_r) + self._decenter + self._tilt
 
     def intercept(self, ray):
         """
-        Finds the interception point of a ray with the output plane.
+        Finds the interception point of a ray with the output plane, or None
+        if it doesn't intercept within the aperture radius.
+        """
+        point, status = self.find_intercept(ray)
+        if status == VIGNETTED:
+            return None
+        return point
+
+    def find_intercept(self, ray):
         """
-        k = ray.d()
-        p = ray.p()
+        Finds the interception point of a ray with the output plane, and the
+        status of the ray there, as for SphericalRefraction.find_intercept.
+        """
+        p, k = self.to_local(ray.p(), ray.d())
         length = (self._z0 - p[2]) / k[2]
-        r2 = self._ap_r**2
-        x2 = (p + k * length)[0]**2
-        y2 = (p + k * length)[1]**2
+        if not length >= 0:
+            return None, MISSED
+        point = p + k * length
+        status = REFRACTED
         # Check if the intercept is within the aperture radius.
-        if x2 + y2 <= r2:
-            return (p + k * length)
-        else:
-            return 'no intercept'
+        if point[0] * point[0] + point[1] * point[1] > self._ap_r2:
+            status = VIGNETTED
+        return self.to_global(point, k)[0], status
 
     def propagate_ray(self, ray):
         """
         Propagates a ray from its starting position, to the output plane and
         appends the new position to the ray. Stops if the ray doesn't
-        intercept with the output plane.
+        intercept with the output plane.  Returns True if the ray reached
+        the output plane, and False otherwise, and sets the status of the
+        ray.
+        """
+        point, status = self.find_intercept(ray)
+        if status != REFRACTED:
+            ray.status = status
+            return False
+        ray.append_point(point)
+        return True
+
+    def propagate_bundle(self, bundle):
+        """
+        Propagates a bundle of rays to the output plane and appends the new
+        positions to the bundle.  Rays that don't intercept the output plane
+        are marked as lost and keep their previous position.
+        """
+        p = bundle.p()
+        local, k = self.to_local(p, bundle.d())
+        points, status = intercept_status(local, k, self._z0, 0., self._ap_r)
+        points = self.to_global(points, k)[0]
+        hit = (status == REFRACTED) & ~bundle.lost
+        bundle.append_point(np.where(hit[:, np.newaxis], points, p))
+        bundle.append_vector(bundle.d())
+        # Rays that reach the output plane keep their status.
+        bundle.set_status(np.where(status == REFRACTED, bundle.status,
+                                   status))
+
+
+class OpticalSystem(OpticalElement):
+    """
+    Creates an optical system from an ordered sequence of optical elements.
+    Rays and bundles of rays are propagated through every element in turn,
+    stopping as soon as they are lost.
+    """
+
+    def __init__(self, elements):
         """
-        if type(self.intercept(ray)) == np.ndarray:
-            ray.append_point(self.intercept(ray))
+        Initialises the OpticalSystem class.
+
+        Parameters
+        ----------
+        elements: list_type
+                  The optical elements, in the order that rays pass through
+                  them.
+        """
+        self._elements = tuple(elements)
+
+    def elements(self):
+        """
+        Finds the optical elements in the system, in order.
+        """
+        return self._elements
+
+    def propagate_ray(self, ray):
+        """
+        Propagates a ray through every optical element in the system.  Stops
+        at the first element that the ray doesn't pass.  Returns True if the
+        ray passed all of the elements, and False otherwise.
+        """
+        for element in self._elements:
+            if not element.propagate_ray(ray):
+                return False
+        return True
+
+    def propagate_bundle(self, bundle):
+        """
+        Propagates a bundle of rays through every optical element in the
+        system.  Stops early if every ray in the bundle has been lost.
+        """
+        for element in self._elements:
+            if bundle.lost.all():
+                break
+            element.propagate_bundle(bundle)
+
+    def focal_point(self):
+        """ Finds the paraxial focal point of the system by propagating a ray
+            in the positive z direction, 0.1mm from the z axis, through every
+            optical element, and finding its z axis intercept.
+        """
+        r = Ray([0.1, 0, 0], [0, 0, 1], max_surfaces=len(self._elements))
+        self.propagate_ray(r)
+        return vm.x_intercept(r)[2]
+
+    def __len__(self):
+        return len(self._elements)
+
+    def __repr__(self):
+        return 'OpticalSystem(%d elements)' % len(self._elements)
 
 
 def refract(incident, normal, n1, n2):
     """
-    Finds the resulting refracted ray at a boundary. Returns nothing if the 
-    ray is reflected.
+    Finds the resulting refracted ray at a boundary. Returns None if the ray
+    is totally internally reflected.
 
     Paramters
     ---------
@@ -267,21 +937,365 @@ def refract(incident, normal, n1, n2):
     n1 = float(n1)
     n2 = float(n2)
     r = n1 / n2
-    dot = -np.dot(normal, incident.d())
+    k = incident.d()
+    dot = -normal.dot(k)
+    # The normal must face the incident ray, which travels in the negative z
+    # direction after a reflection.
+    if dot < 0:
+        normal = -normal
+        dot = -dot
+    sin2 = 1 - (dot * dot)
     # Check if the ray is reflected.
-    if np.sqrt(1 - (dot * dot)) > n2/n1:
-        return 'no refraction'
-    else:
-        if normal[2] < 0:
-            refracted = (r * incident.d() + normal * (
-                r * dot - np.sqrt(1 - (r * r) * (1 - (dot*dot)))
-                ))
-            return norm(refracted)
-        else:
-            raise Exception('Normal vector not in the negative z direction.')
+    if sqrt(sin2) > n2/n1:
+        return None
+    refracted = k * r + normal * (r * dot - sqrt(1 - (r * r) * sin2))
+    return norm(refracted)
 
 
-def bundle(n, rmax, m):
+def reflect(direction, normal):
+    """
+    Finds the direction of a ray reflected at a boundary.
+
+    Paramters
+    ---------
+    direction: numpy.array_type
+               The normalised direction of the incident ray.
+    normal:    numpy.array_type
+               The normal vector to the boundary, facing either way.
+    """
+    return direction - normal * (2 * normal.dot(direction))
+
+
+def refract_bundle(incident, normals, n1, n2):
+    """
+    Finds the refracted directions of a bundle of rays at a boundary.  Returns
+    an (...,3) array of refracted directions, and a boolean array that is True
+    where a ray is totally internally reflected.  The directions of reflected
+    rays are left unchanged.
+
+    Paramters
+    ---------
+    incident: numpy.array_type
+              (...,3) array of incident directions.
+    normals:  numpy.array_type
+              (...,3) array of normal vectors to the boundary.
+    n1:       array_type
+              The refractive index to the left of the boundary, for all the
+              rays or for each ray.
+    n2:       array_type
+              The refractive index to the right of the boundary, for all the
+              rays or for each ray.
+    """
+    r = np.asarray(n1, dtype=float) / np.asarray(n2, dtype=float)
+    dot = -dot_rows(normals, incident)
+    # Turn the normals to face the incident rays, for rays travelling in the
+    # negative z direction after a reflection.
+    facing = np.where(dot < 0, -1., 1.)
+    normals = normals * facing[..., np.newaxis]
+    dot = dot * facing
+    sin2 = (r * r) * (1 - (dot * dot))
+    # Check which rays are reflected.
+    tir = sin2 > 1
+    cos_t = np.sqrt(np.where(tir, 0., 1 - sin2))
+    refracted = (r[..., np.newaxis] * incident
+                 + normals * (r * dot - cos_t)[..., np.newaxis])
+    refracted = np.where(tir[..., np.newaxis], incident, refracted)
+    return norm_rows(refracted), tir
+
+
+def reflect_bundle(incident, normals):
+    """
+    Finds the reflected directions of a bundle of rays at a boundary, as an
+    (...,3) array.  The normals can face either way.
+
+    Paramters
+    ---------
+    incident: numpy.array_type
+              (...,3) array of normalised incident directions.
+    normals:  numpy.array_type
+              (...,3) array of normal vectors to the boundary.
+    """
+    dot = dot_rows(normals, incident)
+    return incident - normals * (2 * dot)[..., np.newaxis]
+
+
+def surface_intercept(p, k, z0, curv, ap_r):
+    """
+    Finds the interception points of arrays of rays with spherical surfaces.
+    Returns an (...,3) array of points, and a boolean array that is True
+    where a ray intercepts within the aperture radius.  The parameters are
+    the same as for intercept_status.
+    """
+    points, status = intercept_status(p, k, z0, curv, ap_r)
+    return points, status == REFRACTED
+
+
+def intercept_status(p, k, z0, curv, ap_r):
+    """
+    Finds the interception points of arrays of rays with spherical surfaces.
+    The surface parameters can be single values, or arrays giving a
+    different surface for each ray.  The intercept nearest the vertex of the
+    surface is found, in a form that stays accurate as the curvature tends
+    to zero, so planes need no special case.  Returns an (...,3) array of
+    points, and a uint8 array of status codes: REFRACTED where a ray
+    intercepts within the aperture radius, VIGNETTED where it intercepts
+    outside it and MISSED where it never intercepts the surface ahead of
+    it.
+
+    Parameters
+    ----------
+    p:    numpy.array_type
+          (...,3) array of ray positions.
+    k:    numpy.array_type
+          (...,3) array of normalised ray directions.
+    z0:   array_type
+          The z axis intercept of the surface.
+    curv: array_type
+          The curvature of the surface.
+    ap_r: array_type
+          The aperture radius of the surface.
+    """
+    z0 = np.asarray(z0, dtype=float)
+    curv = np.asarray(curv, dtype=float)
+    x, y, qz = p[..., 0], p[..., 1], p[..., 2] - z0
+    qq = x * x + y * y + qz * qz
+    qk = x * k[..., 0] + y * k[..., 1] + qz * k[..., 2]
+    # The surface is curv * |q|**2 - 2 * q_z = 0, for q relative to the
+    # vertex, giving a quadratic in the distance along the ray.
+    b = curv * qk - k[..., 2]
+    c = curv * qq - 2 * qz
+    disc = b * b - curv * c
+    hit = disc >= 0
+    root = np.sqrt(np.where(hit, disc, 0.))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        near = np.copysign(root, -b) - b
+        length = c / near
+        # This is the intercept closest to the start of the ray, which is
+        # on the far side of the centre of curvature from the vertex for rays
+        # that start beyond the centre, so the other intercept is used.
+        far = curv * (qz + length * k[..., 2]) > 1
+        length = np.where(far, near / curv, length)
+    hit &= np.isfinite(length) & (length >= 0)
+    points = p + k * np.where(hit, length, 0.)[..., np.newaxis]
+    r2 = points[..., 0]**2 + points[..., 1]**2
+    inside = r2 <= np.asarray(ap_r, dtype=float)**2
+    status = np.where(hit, np.where(inside, REFRACTED, VIGNETTED), MISSED)
+    return points, status.astype(np.uint8)
+
+
+def surface_normals(points, z0, curv):
+    """
+    Finds the normal vectors to spherical surfaces at an (...,3) array of
+    points on them.  The normals point in the negative z direction near the
+    vertex, as for normal_vector.  The parameters are the same as for
+    surface_intercept.
+    """
+    curv = np.asarray(curv, dtype=float)
+    normals = np.empty(np.shape(points))
+    normals[..., 0] = curv * points[..., 0]
+    normals[..., 1] = curv * points[..., 1]
+    normals[..., 2] = curv * (points[..., 2] - z0) - 1
+    return norm_rows(normals)
+
+
+def trace_surface(p, k, lost, z0, curv, n1, n2, ap_r):
+    """
+    Propagates arrays of rays to spherical refracting surfaces and refracts
+    them, as for refract_surface, but with a boolean lost mask in place of
+    status codes.  Returns the new positions, directions and lost mask.
+
+    Parameters
+    ----------
+    lost: numpy.array_type
+          Boolean array that is True for rays that have already been lost.
+
+    The other parameters are the same as for refract_surface.
+    """
+    status = np.where(lost, VIGNETTED, REFRACTED).astype(np.uint8)
+    p, k, status = refract_surface(p, k, status, z0, curv, n1, n2, ap_r)
+    return p, k, status >= VIGNETTED
+
+
+def refract_surface(p, k, status, z0, curv, n1, n2, ap_r):
+    """
+    Propagates arrays of rays to spherical refracting surfaces and refracts
+    them.  This is the kernel used by SphericalRefraction.propagate_bundle,
+    and the surface parameters can be arrays giving a different surface for
+    each ray, so that many systems can be traced at once.  Returns the new
+    positions, directions and status codes.  Rays that are totally
+    internally reflected are given the reflected direction.  Rays that don't
+    intercept the surface within the aperture radius, or were already lost,
+    keep their previous position and direction.
+
+    Parameters
+    ----------
+    p:      numpy.array_type
+            (...,3) array of ray positions.
+    k:      numpy.array_type
+            (...,3) array of normalised ray directions.
+    status: numpy.array_type
+            Array of the status codes of the rays.  Rays that are VIGNETTED
+            or MISSED have already been lost.
+
+    The other parameters are the same as for SphericalRefraction.
+    """
+    points, found = intercept_status(p, k, z0, curv, ap_r)
+    normals = surface_normals(points, z0, curv)
+    return refract_points(p, k, status, points, found, normals, n1, n2)
+
+
+def refract_points(p, k, status, points, found, normals, n1, n2):
+    """
+    Moves arrays of rays to their intercepts with a refracting surface and
+    refracts them, for any shape of surface.  Returns the new positions,
+    directions and status codes, as for refract_surface.
+
+    Parameters
+    ----------
+    points:  numpy.array_type
+             (...,3) array of the intercepts of the rays with the surface.
+    found:   numpy.array_type
+             Array of the status codes of the intercepts, as given by
+             intercept_status.
+    normals: numpy.array_type
+             (...,3) array of the normals to the surface at the intercepts.
+
+    The other parameters are the same as for refract_surface.
+    """
+    status = np.where(status >= VIGNETTED, status, found)
+    hit = status == REFRACTED
+    refracted, tir = refract_bundle(k, normals, n1, n2)
+    tir &= hit
+    refracted = np.where(tir[..., np.newaxis], reflect_bundle(k, normals),
+                         refracted)
+    p = np.where(hit[..., np.newaxis], points, p)
+    k = np.where(hit[..., np.newaxis], refracted, k)
+    return p, k, np.where(tir, REFLECTED, status).astype(np.uint8)
+
+
+def reflect_surface(p, k, status, z0, curv, ap_r):
+    """
+    Propagates arrays of rays to spherical mirrors and reflects them.  This
+    is the kernel used by SphericalMirror.propagate_bundle.  Returns the new
+    positions, directions and status codes, as for refract_surface.
+    """
+    points, found = intercept_status(p, k, z0, curv, ap_r)
+    status = np.where(status >= VIGNETTED, status, found)
+    hit = status == REFRACTED
+    reflected = reflect_bundle(k, surface_normals(points, z0, curv))
+    p = np.where(hit[..., np.newaxis], points, p)
+    k = np.where(hit[..., np.newaxis], reflected, k)
+    return p, k, np.where(hit, REFLECTED, status).astype(np.uint8)
+
+
+def asphere_sag(r2, curv, conic, coefficients):
+    """
+    Finds the sag of a conic or even aspheric surface, and the radial part
+    of its gradient, at an array of squared radial distances r2.  Returns
+    the tuple (sag, g, valid), where the gradient of the sag is
+    (g * x, g * y), and valid is False where the conic is not defined.
+
+    Parameters
+    ----------
+    r2:           numpy.array_type
+                  Array of the squared distances from the z axis.
+    curv:         float_type
+                  The curvature of the surface at the vertex.
+    conic:        float_type
+                  The conic constant, which is 0 for a sphere, -1 for a
+                  paraboloid, and less than -1 for a hyperboloid.
+    coefficients: list_type
+                  The even aspheric coefficients of r**4, r**6, r**8, ...
+    """
+    arg = 1 - (1 + conic) * curv * curv * r2
+    valid = arg >= 0
+    root = np.sqrt(np.where(valid, arg, 1.))
+    sag = curv * r2 / (1 + root)
+    g = curv / root
+    # Horner's method for the sums of A_i r**(2i + 4) and their gradient.
+    poly = np.zeros(np.shape(r2))
+    dpoly = np.zeros(np.shape(r2))
+    for i in range(len(coefficients) - 1, -1, -1):
+        poly = poly * r2 + coefficients[i]
+        dpoly = dpoly * r2 + (2 * i + 4) * coefficients[i]
+    sag = sag + poly * r2 * r2
+    g = g + dpoly * r2
+    return sag, g, valid
+
+
+def asphere_intercept(p, k, z0, curv, conic, coefficients, ap_r,
+                      iterations=20, tolerance=1e-12):
+    """
+    Finds the interception points of arrays of rays with a conic or even
+    aspheric surface, by Newton's method starting from the intercept with
+    the sphere of the same vertex curvature.  Each ray is iterated only
+    until it converges, so the cost depends on the rays that are slowest to
+    converge rather than on a fixed number of iterations.  Returns an
+    (N,3) array of points and an array of status codes, as for
+    intercept_status.  Rays that don't converge are MISSED.
+
+    Parameters
+    ----------
+    p:          numpy.array_type
+                (N,3) array of ray positions.
+    k:          numpy.array_type
+                (N,3) array of normalised ray directions.
+    iterations: integer_type
+                The largest number of Newton iterations.
+    tolerance:  float_type
+                The change in the distance along a ray below which it has
+                converged.
+
+    The other parameters are the same as for AsphericRefraction.
+    """
+    points, status = intercept_status(p, k, z0, curv, np.inf)
+    # Rays that miss the sphere start from the plane through the vertex.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        length = np.where(status == MISSED, (z0 - p[:, 2]) / k[:, 2],
+                          np.einsum('ij,ij->i', points - p, k))
+    converged = np.zeros(len(p), dtype=bool)
+    active = np.nonzero(np.isfinite(length))[0]
+    for iteration in range(iterations):
+        if len(active) == 0:
+            break
+        pa, ka, t = p[active], k[active], length[active]
+        x = pa[:, 0] + t * ka[:, 0]
+        y = pa[:, 1] + t * ka[:, 1]
+        sag, g, valid = asphere_sag(x * x + y * y, curv, conic,
+                                    coefficients)
+        # f(t) is the height of the surface above the ray along z.
+        f = z0 + sag - (pa[:, 2] + t * ka[:, 2])
+        df = g * (x * ka[:, 0] + y * ka[:, 1]) - ka[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = f / df
+        length[active] = t - step
+        done = np.abs(step) <= tolerance
+        converged[active[done & valid]] = True
+        active = active[~done & valid & np.isfinite(step)]
+    converged &= length >= 0
+    points = p + k * np.where(converged, length, 0.)[:, np.newaxis]
+    r2 = points[:, 0]**2 + points[:, 1]**2
+    status = np.where(converged, np.where(r2 <= ap_r * ap_r, REFRACTED,
+                                          VIGNETTED), MISSED)
+    return points, status.astype(np.uint8)
+
+
+def asphere_normals(points, z0, curv, conic, coefficients):
+    """
+    Finds the normal vectors to a conic or even aspheric surface at an
+    (N,3) array of points on it, from the gradient of the sag.  The normals
+    point in the negative z direction, as for surface_normals.
+    """
+    x, y = points[:, 0], points[:, 1]
+    g = asphere_sag(x * x + y * y, curv, conic, coefficients)[1]
+    normals = np.empty(np.shape(points))
+    normals[:, 0] = g * x
+    normals[:, 1] = g * y
+    normals[:, 2] = -1.
+    return norm_rows(normals)
+
+
+def bundle(n, rmax, m, record_path=True, field=(0., 0.), z_pupil=None):
     """Creates a uniform bundle of parallel rays with radius rmax, n concentric
        circles, m points per circle. Returns a list, rays, of all the rays.
        
@@ -295,16 +1309,18 @@ def bundle(n, rmax, m):
        m:    integer_type
              The rate at which the number of rays per concentric circle
              increases.
+       record_path: bool_type
+             If False, the rays only keep their latest position and
+             direction.
+       field, z_pupil:
+             The field angles and pupil position, as for parallel_bundle.
     """
-    x = []
-    y = []
-    rays = []
     # Use the genpolar module to create a uniform distribution of rays.
-    for r, t in genpolar.rtuniform(n, rmax, m):
-        x.append(r * cos(t))
-        y.append(r * sin(t))
-    for n in range(len(x)):
-        rays.append(Ray([x[n], y[n], 0], [0., 0., 1.]))
+    xy = genpolar.xyuniform(n, rmax, m)
+    p, k = field_rays(xy, 0., field, z_pupil)
+    rays = []
+    for point in p:
+        rays.append(Ray(point, k[0], record_path=record_path))
     return rays
 
 
@@ -313,10 +1329,7 @@ def focal_point1(opticalelement):
         a ray in the positive z direction, 0.1mm from the z axis, through the
         optical element, and finding its z axis intercept.
     """
-    # Use a ray close to the z axis to find the paraxial focal point.
-    r = Ray([0.1, 0, 0], [0, 0, 1])
-    opticalelement.propagate_ray(r)
-    return vm.x_intercept(r)[2]
+    return OpticalSystem([opticalelement]).focal_point()
 
 
 def focal_point2(opticalelement1, opticalelement2):
@@ -324,7 +1337,89 @@ def focal_point2(opticalelement1, opticalelement2):
         a ray in the positive z direction, 0.1mm from the z axis, through the
         optical elements, and finding its z axis intercept.
     """
-    r = Ray([0.1, 0, 0], [0, 0, 1])
-    opticalelement1.propagate_ray(r)
-    opticalelement2.propagate_ray(r)
-    return vm.x_intercept(r)[2]
\ No newline at end of file
+    return OpticalSystem([opticalelement1, opticalelement2]).focal_point()
+
+
+def ray_bundle(n, rmax, m, wavelength=None, field=(0., 0.), z_pupil=None):
+    """Creates a uniform bundle of parallel rays as a RayBundle, with the same
+       distribution as bundle.
+
+       Parameters:
+       -----------
+       n:    integer_type
+             The number of concentric circles of rays within the
+             distribution.
+       rmax: float_type
+             The maximum radius of the distribution of rays.
+       m:    integer_type
+             The rate at which the number of rays per concentric circle
+             increases.
+       wavelength, field, z_pupil:
+             The wavelength of the rays in metres, their field angles and
+             the pupil position, as for parallel_bundle.
+    """
+    return parallel_bundle(genpolar.xyuniform(n, rmax, m),
+                           wavelength=wavelength, field=field,
+                           z_pupil=z_pupil)
+
+
+def parallel_bundle(xy, z=0., wavelength=None, field=(0., 0.), z_pupil=None,
+                    per_ray=False):
+    """Creates a RayBundle of parallel rays, travelling in the positive z
+       direction, from an (N,2) array of x-y pupil points such as those made
+       by the genpolar module.  The rays are parallel to the z axis unless
+       field angles are given.
+
+       Parameters:
+       -----------
+       xy:   array_type
+             (N,2) array of the x-y starting positions of the rays.
+       z:    float_type
+             The z position that the rays start from.
+       wavelength: array_type
+             The wavelength in metres.  For a single wavelength, the bundle
+             has one ray per point.  For a list of wavelengths, every point
+             is repeated for each wavelength, giving a polychromatic bundle,
+             unless per_ray is True.
+       field: list_type
+             The angles in degrees between the rays and the z axis, in the
+             x-z and y-z planes.
+       z_pupil: float_type
+             The z position at which the rays pass through the pupil points,
+             such as the first surface or the aperture stop, so the bundle
+             stays centred on the pupil for every field angle.  Defaults to
+             z.
+       per_ray: bool_type
+             If True, wavelength is an (N,) array of the wavelength of the
+             ray through each point, and the points are not repeated.
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if wavelength is not None:
+        wavelength = np.asarray(wavelength, dtype=float)
+        if per_ray:
+            if wavelength.shape != (len(xy),):
+                raise Exception('There must be one wavelength for each '
+                                'point.')
+        elif wavelength.ndim == 1:
+            colours = len(wavelength)
+            wavelength = np.repeat(wavelength, len(xy))
+            xy = np.tile(xy, (colours, 1))
+    p, k = field_rays(xy, z, field, z_pupil)
+    return RayBundle(p, k, wavelength)
+
+
+def field_rays(xy, z, field=(0., 0.), z_pupil=None):
+    """Finds the (N,3) arrays of starting positions and directions of
+       parallel rays at field angles, which pass through an (N,2) array of
+       x-y pupil points.  The parameters are the same as for parallel_bundle.
+    """
+    if z_pupil is None:
+        z_pupil = z
+    slope = np.tan(np.radians(np.asarray(field, dtype=float)))
+    p = np.empty((len(xy), 3))
+    p[:, :2] = xy - slope * (z_pupil - z)
+    p[:, 2] = z
+    k = np.empty((len(xy), 3))
+    k[:, :2] = slope
+    k[:, 2] = 1.
+    return p, norm_rows(k)
@@ -1,19 +1,37 @@
 """This is the script for the "Getting started" section.  All optical elements
-   are as stated in the project guide.
+   are as stated in the project guide.  Importing it doesn't trace or plot
+   anything; run it as a script, or call main, for the analysis.
 """
 import numpy as np
-import matplotlib.pyplot as plt
 import raytracer as rt
+import analysis
+import cache
+import sweep
 
-s = rt.SphericalRefraction(100,0.03,1.0,1.5,(1/0.03))
-# Calculating the paraxial focal point of "s".
-F = rt.focal_point1(s)
-# The output plane is automatically placed at the paraxial focal point of "s".
-p=rt.OutputPlane(F, 10000)
+# Traces of the same bundle are only calculated once.
+traces = cache.TraceCache()
 # Defining the wavelength of the rays.
 Lb = 475 * 10**(-9) # Blue light
 Lg = 510 * 10**(-9) # Green light
 Lr = 650 * 10**(-9) # Red light
+# The optical elements, made by optical_system on first use.
+_system = {}
+
+
+def optical_system():
+    """Creates the spherical surface "s", finds its paraxial focal point F and
+       places an output plane there.  The elements are made on first use
+       only.  Returns the tuple (s, F, system).
+    """
+    if not _system:
+        s = rt.SphericalRefraction(100,0.03,1.0,1.5,(1/0.03))
+        # Calculating the paraxial focal point of "s".
+        F = rt.focal_point1(s)
+        # The output plane is automatically placed at the paraxial focal
+        # point of "s".
+        p=rt.OutputPlane(F, 10000)
+        _system['elements'] = (s, F, rt.OpticalSystem([s, p]))
+    return _system['elements']
 
 
 def zx_plot(n, rmax, m):
@@ -30,11 +48,12 @@ def zx_plot(n, rmax, m):
              The rate at which the number of rays per concentric circle
              increases.
     """
+    plt = analysis.pyplot()
+    system = optical_system()[2]
     bundle=rt.bundle(n, rmax, m)
     for ray in bundle:
         "Loop that plots the z-x positions of the parallel rays."
-        s.propagate_ray(ray)
-        p.propagate_ray(ray)
+        system.propagate_ray(ray)
         x=[]
         z=[]
         for position in ray.positions:
@@ -60,23 +79,15 @@ def spotdiagram(n, rmax, m):
              The rate at which the number of rays per concentric circle
              increases.
     """
-    bundle = rt.bundle(n, rmax, m)
-    for ray in bundle:
-        s.propagate_ray(ray)
-        p.propagate_ray(ray)
-        x = []
-        y = []
-        x.append(ray.positions[-1][0]) # Appends the last x position to "x".
-        y.append(ray.positions[-1][1]) # Appends the last y position to "y".
-        plt.plot(x,y, 'bo')
-    plt.xlabel('x axis /mm')
-    plt.ylabel('y axis /mm')
+    plt = analysis.pyplot()
+    bundle = traces.trace(optical_system()[2], n, rmax, m)
+    analysis.plot_spot_diagram(analysis.spot_positions(bundle, True))
     plt.show()
     plt.axis('auto')
    
 def xypositions(n, rmax, m):
-    """Creates a list of the x-y positions of the rays incident on the output
-       plane.
+    """Creates an array of the x-y positions of the rays incident on the
+       output plane.
        
        Parameters
        ----------
@@ -89,46 +100,37 @@ def xypositions(n, rmax, m):
              The rate at which the number of rays per concentric circle
              increases.
     """
-    positions = []
-    bundle = rt.bundle(n, rmax, m)
-    for ray in bundle:
-        s.propagate_ray(ray)
-        p.propagate_ray(ray)
-        x = []
-        y = []
-        x.append(ray.positions[-1][0]) # Appends the last x position to "x".
-        y.append(ray.positions[-1][1]) # Appends the last y position to "y".
-        positions.append([x[0],y[0]]) # Creates a list of x-y coordinates.
-    return positions 
+    # Propagating the whole bundle at once is much faster than ray by ray.
+    bundle = traces.trace(optical_system()[2], n, rmax, m)
+    return analysis.spot_positions(bundle, True)
+
+def focalradius(n=6):
+    """Finds the rms focal point radius of ray bundles of diameters from 2 to
+       18 mm incident on "s", and the diffraction limited focal point radii
+       for blue, green and red light.  Returns the tuple (D, rms,
+       diffraction), where diffraction has a row for each colour.
+
+       Parameters
+       ----------
+       n: integer_type
+          The number of concentric circles of rays within each bundle.
+    """
+    s, F, system = optical_system()
+    # The ray bundle radii, all traced at once by the sweep module.
+    d = np.arange(10, 90) * 0.1
+    wavelengths = np.array([[Lb], [Lg], [Lr]])
+    result = sweep.sweep([s._z0], [s._curv], [s._n1], [s._n2], [s._ap_r], d,
+                         n=n, m=6, wavelength=wavelengths, z_output=F)
+    return 2 * d, result['rms'][0], result['diffraction']
 
 def focalradius_plot():
     """Creates a graph of the diameter of incident ray bundles on "s" (defined
        above), against the rms focal point radius, and the diffraction limited 
        focal point radius.
     """
-    D = [] # List of the ray bundle radii.
-    rms = []  # List of the rms focal point radii.
-    # Lists of the diffraction limited focal point radii.
-    diffraction_blue = []  
-    diffraction_green = []
-    diffraction_red = []
-    focal_length = F - 100
-    for n in range(10,90):
-        # Incrementing the radius of the bundle.
-        d = n * 0.1 
-        two_d = 2 * d
-        two_d_metres = (2 * d / 1000) # Gives units of metres.
-        list1 = xypositions(6, d, 6)
-        root_mean = rootmean(list1)
-        # Calculating the diffraction scale.
-        b = Lb * (focal_length) / (two_d_metres) 
-        g = Lg * (focal_length) / (two_d_metres)
-        r = Lr * (focal_length) / (two_d_metres)
-        D.append(two_d)
-        rms.append(root_mean)
-        diffraction_blue.append(b)
-        diffraction_green.append(g)
-        diffraction_red.append(r)
+    plt = analysis.pyplot()
+    D, rms, diffraction = focalradius()
+    diffraction_blue, diffraction_green, diffraction_red = diffraction
     plt.plot(D, rms, 'k', label='Root mean square spot radius' )
     plt.plot(D, diffraction_blue, 'b', label = ('Diffraction-limited radius '
                                                             +'for blue light'))
@@ -149,30 +151,45 @@ def rootmean(list1):
         list1: list_type
                List of x-y positions.
     """
-    r_squares = []
-    for position in list1:
-        # Finding the square of the radial displacement.
-        r2 = (position[0] * position[0]) + (position[1] * position[1])
-        r_squares.append(r2)
-    mean=sum(r_squares)/len(r_squares)
-    rms=np.sqrt(mean)
-    return rms
+    return analysis.rms_radius(list1)
     
     
-# Plotting the propagation of the rays through the optical elements.
-plt.figure(1)
-zx_plot(10,2.5,5)
-# Tracing a bundle of rays (diameter of 5mm) to the paraxial focus point. 
-plt.figure(2)
-plt.axis('equal')
-spotdiagram(10, 2.5, 5)
-# Creating a list of the positions in the spot diagram.
-list1 = xypositions(10, 2.5, 5)
-# Giving a value of the rms value for this focus point.
-print 'Root mean square spot radius = ', rootmean(list1)
-# Calculating the diffraction scale, adjusting the diameter to be in metres.
-diffraction_scale = (Lg) * (F - 100) / (5 * 10**(-3)) 
-print 'Diffraction limited spot radius for green light = ', diffraction_scale
-# Creating a graph of the ray bundle diameter vs the focal point radii.
-plt.figure(3)
-focalradius_plot()
+def main(plot=True):
+    """Runs the "Getting started" analysis.  Prints the rms spot radius at
+       the paraxial focal point of "s" and the diffraction limited spot
+       radius, and makes the three figures.
+
+       Parameters
+       ----------
+       plot: bool_type
+             If False, only the spot radii are found, without plotting.
+    """
+    F = optical_system()[1]
+    if plot:
+        plt = analysis.pyplot()
+        # Plotting the propagation of the rays through the optical elements.
+        plt.figure(1)
+        zx_plot(10,2.5,5)
+        # Tracing a bundle of rays (diameter of 5mm) to the paraxial focus
+        # point.
+        plt.figure(2)
+        plt.axis('equal')
+        spotdiagram(10, 2.5, 5)
+    # Creating a list of the positions in the spot diagram.
+    list1 = xypositions(10, 2.5, 5)
+    # Giving a value of the rms value for this focus point.
+    print('Root mean square spot radius = ', rootmean(list1))
+    # Calculating the diffraction scale, adjusting the diameter to be in
+    # metres.
+    diffraction_scale = (Lg) * (F - 100) / (5 * 10**(-3))
+    print('Diffraction limited spot radius for green light = ',
+          diffraction_scale)
+    if plot:
+        # Creating a graph of the ray bundle diameter vs the focal point
+        # radii.
+        plt.figure(3)
+        focalradius_plot()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Chunked tracing of very large numbers of rays.
+
+Rays are pulled lazily from a ray source in fixed-size chunks, each chunk is
+traced as a RayBundle, and the spot positions are fed into running
+statistics.  Only one chunk is held in memory at a time, so the peak memory
+depends on the chunk size rather than the total number of rays.
+"""
+from itertools import chain, islice
+import numpy as np
+import genpolar
+import raytracer as rt
+
+
+def polar_chunks(pairs, chunk_size=100000):
+    """Creates RayBundles of parallel rays in the positive z direction from
+       an iterable of (r, theta) pairs, such as genpolar.rtuniform, with at
+       most chunk_size rays in each bundle.
+
+       Parameters
+       ----------
+       pairs:      iterable_type
+                   The (r, theta) polar coordinates of the rays at z = 0.
+       chunk_size: integer_type
+                   The maximum number of rays in each bundle.
+    """
+    pairs = iter(pairs)
+    while True:
+        rt_flat = np.fromiter(chain.from_iterable(islice(pairs, chunk_size)),
+                              dtype=float)
+        if len(rt_flat) == 0:
+            return
+        xy = genpolar.polar_to_xy(rt_flat[0::2], rt_flat[1::2])
+        yield rt.parallel_bundle(xy)
+
+
+class SpotStatistics:
+    """
+    Running statistics of the x-y positions of rays on an output plane.  The
+    positions are added a chunk at a time with update, and are not stored.
+    """
+
+    def __init__(self, bins=100, hist_range=None):
+        """
+        Initialises the SpotStatistics class.
+
+        Parameters
+        ----------
+        bins:       integer_type
+                    The number of histogram bins along each axis.
+        hist_range: list_type
+                    The [[xmin, xmax], [ymin, ymax]] limits of the 2D
+                    histogram.  No histogram is kept if this is None.
+        """
+        self.count = 0
+        self.lost = 0
+        self._sum = np.zeros(2)
+        self._sum2 = np.zeros(2)
+        self._min = np.full(2, np.inf)
+        self._max = np.full(2, -np.inf)
+        self._hist_range = hist_range
+        self.histogram = None
+        self.edges = None
+        if hist_range is not None:
+            self.histogram = np.zeros((bins, bins), dtype=np.int64)
+            self.edges = (np.linspace(hist_range[0][0], hist_range[0][1],
+                                      bins + 1),
+                          np.linspace(hist_range[1][0], hist_range[1][1],
+                                      bins + 1))
+
+    def update(self, xy, lost=None):
+        """
+        Adds a chunk of x-y positions to the statistics.
+
+        Parameters
+        ----------
+        xy:   array_type
+              (N,2) array of x-y positions.
+        lost: array_type
+              Optional boolean array that is True for rays that should not be
+              included, such as rays lost in a RayBundle.
+        """
+        xy = np.asarray(xy, dtype=float)
+        if lost is not None:
+            self.lost += int(lost.sum())
+            xy = xy[~lost]
+        if len(xy) == 0:
+            return
+        self.count += len(xy)
+        self._sum += xy.sum(axis=0)
+        self._sum2 += np.einsum('ij,ij->j', xy, xy)
+        self._min = np.minimum(self._min, xy.min(axis=0))
+        self._max = np.maximum(self._max, xy.max(axis=0))
+        if self.histogram is not None:
+            h = np.histogram2d(xy[:, 0], xy[:, 1], bins=self.edges)[0]
+            self.histogram += h.astype(np.int64)
+
+    def centroid(self):
+        """
+        Finds the mean x-y position of the rays, which is NaN if there are
+        none.
+        """
+        if self.count == 0:
+            return np.full(2, np.nan)
+        return self._sum / self.count
+
+    def rms_radius(self):
+        """
+        Finds the root mean square radial distance of the rays from the z
+        axis, as rootmean does.  It is NaN if there are no rays, as for
+        analysis.rms_radius.
+        """
+        if self.count == 0:
+            return np.nan
+        return np.sqrt(self._sum2.sum() / self.count)
+
+    def rms_radius_centroid(self):
+        """
+        Finds the root mean square radial distance of the rays from their
+        centroid, which is NaN if there are no rays.
+        """
+        if self.count == 0:
+            return np.nan
+        c = self.centroid()
+        return np.sqrt(max(self._sum2.sum() / self.count - c.dot(c), 0.))
+
+    def min(self):
+        """
+        Finds the minimum x and y positions of the rays.
+        """
+        return self._min.copy()
+
+    def max(self):
+        """
+        Finds the maximum x and y positions of the rays.
+        """
+        return self._max.copy()
+
+
+def trace_chunks(system, chunks):
+    """Propagates each RayBundle from an iterable of bundles through an
+       optical system, yielding each bundle once it has been traced.
+
+       Parameters
+       ----------
+       system: instance_type
+               An OpticalElement, such as an OpticalSystem.
+       chunks: iterable_type
+               RayBundle objects to propagate.
+    """
+    for bundle in chunks:
+        system.propagate_bundle(bundle)
+        yield bundle
+
+
+def spot_statistics(system, chunks, stats=None):
+    """Traces every chunk of rays through an optical system and accumulates
+       the x-y positions where they finish.  Returns the SpotStatistics.
+
+       Parameters
+       ----------
+       system: instance_type
+               An OpticalElement, such as an OpticalSystem, that ends with an
+               output plane.
+       chunks: iterable_type
+               RayBundle objects to propagate, such as from polar_chunks.
+       stats:  instance_type
+               SpotStatistics object to add to.  A new one is created if this
+               is None.
+    """
+    if stats is None:
+        stats = SpotStatistics()
+    for bundle in trace_chunks(system, chunks):
+        stats.update(bundle.p()[:, :2], bundle.lost)
+    return stats
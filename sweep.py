@@ -0,0 +1,159 @@
+"""
+Parameter sweeps over lens prescriptions and ray bundle radii.
+
+Instead of building a new bundle of Ray objects for every point of a
+parameter grid, every grid point is traced at once: the surface parameters
+and bundle radii are broadcast against each other, and the rays of all the
+grid points are stacked into one array that is passed through the
+vectorized trace kernels in raytracer.
+"""
+from multiprocessing import Pool
+import numpy as np
+import genpolar
+import paraxial
+import raytracer as rt
+
+
+def trace_stack(z0, curv, n1, n2, ap_r, xy):
+    """Traces the same pupil sample through a stack of optical systems, made
+       of SphericalRefraction surfaces.  Returns the positions, directions
+       and lost mask of the rays after the last surface, as (G,N,3), (G,N,3)
+       and (G,N) arrays.
+
+       Parameters
+       ----------
+       z0, curv, n1, n2, ap_r: array_type
+                               (G,S) arrays of the parameters of S
+                               SphericalRefraction surfaces for G systems.
+       xy:                     array_type
+                               (G,N,2) or (N,2) array of the x-y starting
+                               positions of the rays, which travel in the
+                               positive z direction.
+    """
+    G = len(z0)
+    xy = np.broadcast_to(xy, (G,) + np.shape(xy)[-2:])
+    p = np.zeros(xy.shape[:-1] + (3,))
+    p[..., :2] = xy
+    k = np.zeros(p.shape)
+    k[..., 2] = 1.
+    lost = np.zeros(p.shape[:-1], dtype=bool)
+    for i in range(z0.shape[1]):
+        p, k, lost = rt.trace_surface(p, k, lost, z0[:, i, np.newaxis],
+                                      curv[:, i, np.newaxis],
+                                      n1[:, i, np.newaxis],
+                                      n2[:, i, np.newaxis],
+                                      ap_r[:, i, np.newaxis])
+    return p, k, lost
+
+
+def trace_grid(z0, curv, n1, n2, ap_r, xy, z_output):
+    """Traces the same pupil sample through a stack of optical systems, and
+       finds the rms spot radius of each on its output plane.  Returns the
+       tuple (rms, lost), the rms radius and fraction of rays lost for each
+       system.
+
+       Parameters
+       ----------
+       z_output: array_type
+                 (G,) array of the z positions of the output planes.
+
+       The other parameters are the same as for trace_stack.
+    """
+    p, k, lost = trace_stack(z0, curv, n1, n2, ap_r, xy)
+    points, hit = rt.surface_intercept(p, k, z_output[:, np.newaxis], 0.,
+                                       np.inf)
+    hit &= ~lost
+    r2 = np.where(hit, points[..., 0]**2 + points[..., 1]**2, 0.)
+    count = hit.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rms = np.sqrt(r2.sum(axis=-1) / count)
+    return rms, 1 - count / float(hit.shape[-1])
+
+
+def _trace_chunk(args):
+    "Traces one chunk of a parameter grid, in a worker process."
+    return trace_grid(*args)
+
+
+def sweep(z0, curv, n1, n2, ap_r, rmax, n=6, m=6, wavelength=588e-9,
+          z_output=None, workers=1, chunk_size=256):
+    """Traces a uniform bundle of parallel rays through each point of a grid
+       of lens prescriptions and bundle radii, and finds the rms spot radius
+       on an output plane.  By default the output plane is placed at the
+       paraxial focal point of each prescription.  Returns a dictionary of
+       arrays with the broadcast shape of the grid:
+
+       rms:         the rms spot radius, as found by rootmean.
+       diffraction: the diffraction-limited radius, wavelength * f / D,
+                    with f the back focal distance and D the bundle
+                    diameter.
+       focal_point: the z position of the output plane.
+       lost:        the fraction of rays lost before the output plane.
+
+       Parameters
+       ----------
+       z0, curv, n1, n2, ap_r: array_type
+                   The parameters of the SphericalRefraction surfaces, with
+                   the surfaces along the last axis.  Any leading axes form
+                   the grid.
+       rmax:       array_type
+                   The radius of the ray bundle, in mm.
+       n, m:       integer_type
+                   The numbers of concentric circles and the rate of increase
+                   of rays per circle, as for rt.bundle.
+       wavelength: array_type
+                   The wavelength in metres, for the diffraction limit.
+       z_output:   array_type
+                   The z position of the output plane.  The paraxial focal
+                   point is used if this is None.
+       workers:    integer_type
+                   The number of processes to share the grid between.
+       chunk_size: integer_type
+                   The number of grid points traced together, which limits
+                   the memory used.
+    """
+    z0, curv, n1, n2, ap_r = [np.atleast_1d(np.asarray(a, dtype=float))
+                              for a in (z0, curv, n1, n2, ap_r)]
+    surfaces = np.broadcast_arrays(z0, curv, n1, n2, ap_r)
+    focal = paraxial.cardinal_points(*surfaces[:4])
+    if z_output is None:
+        z_output = focal['focal_point']
+    rmax = np.asarray(rmax, dtype=float)
+    z_output = np.asarray(z_output, dtype=float)
+    shape = np.broadcast_shapes(surfaces[0].shape[:-1], rmax.shape,
+                                z_output.shape)
+    S = surfaces[0].shape[-1]
+    flat = [np.broadcast_to(a, shape + (S,)).reshape(-1, S)
+            for a in surfaces]
+    rmax_flat = np.broadcast_to(rmax, shape).ravel()
+    z_flat = np.broadcast_to(z_output, shape).ravel()
+    # One unit pupil sample, scaled to the bundle radius of each grid point.
+    unit = genpolar.xyuniform(n, 1., m)
+
+    def chunks():
+        "Yields the arguments of trace_grid for each chunk of the grid."
+        for start in range(0, len(z_flat), chunk_size):
+            stop = start + chunk_size
+            xy = unit * rmax_flat[start:stop, np.newaxis, np.newaxis]
+            yield (tuple(a[start:stop] for a in flat)
+                   + (xy, z_flat[start:stop]))
+
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            results = list(pool.imap(_trace_chunk, chunks()))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_trace_chunk(chunk) for chunk in chunks()]
+    rms = np.concatenate([r[0] for r in results]).reshape(shape)
+    lost = np.concatenate([r[1] for r in results]).reshape(shape)
+    bfd = np.broadcast_to(z_output, shape) - np.broadcast_to(
+        surfaces[0][..., -1], shape)
+    diffraction = np.asarray(wavelength) * bfd / (2 * rmax / 1000.)
+    out_shape = np.broadcast_shapes(shape, np.shape(wavelength))
+    return {'rms': np.broadcast_to(rms, out_shape),
+            'diffraction': np.broadcast_to(diffraction, out_shape),
+            'focal_point': np.broadcast_to(z_output, shape),
+            'lost': lost}
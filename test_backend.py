@@ -0,0 +1,85 @@
+"""
+Checks that the fused trace loop of the numba backend gives exactly the same
+rays as the numpy backend.  The loop is run as plain Python, which needs no
+Numba, and compiled, when Numba is installed.
+"""
+import importlib.util
+import numpy as np
+import pytest
+import backend
+import raytracer as rt
+
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+
+def planoconvex():
+    "planoconvex.py's convex-first lens, with the bundle to trace."
+    elements = [rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8),
+                rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8),
+                rt.OutputPlane(198.45, 10000)]
+    return elements, rt.ray_bundle(10, 25., 6)
+
+
+def polychromatic():
+    "An N-BK7 singlet traced at three wavelengths, with the bundle."
+    elements = [rt.SphericalRefraction(100, 0.02, 'AIR', 'N-BK7', 21.8),
+                rt.SphericalRefraction(105, -0.005, 'N-BK7', 'AIR', 21.8),
+                rt.OutputPlane(180, 10000)]
+    return elements, rt.ray_bundle(10, 20., 6, [486e-9, 588e-9, 656e-9])
+
+
+def tir():
+    """A lens with a steep back surface, where the outer rays are totally
+       internally reflected and then miss the output plane.
+    """
+    elements = [rt.SphericalRefraction(100, 0, 1.0, 1.5, 50),
+                rt.SphericalRefraction(120, -0.08, 1.5, 1.0, 12),
+                rt.OutputPlane(200, 10000)]
+    return elements, rt.ray_bundle(10, 11., 6)
+
+
+SYSTEMS = [planoconvex, polychromatic, tir]
+
+
+def trace(system, kernel=None):
+    """Traces a system with the numpy backend, or through its surface table
+       with a kernel.  Returns the arrays that the backends update.
+    """
+    elements, bundle = system()
+    if kernel is None:
+        backend._propagate_numpy(elements, bundle)
+    else:
+        table = backend.surface_table(elements, bundle.wavelength)
+        backend._compiled['trace_rays'] = kernel
+        try:
+            backend._propagate_numba(elements, bundle, table)
+        finally:
+            backend._compiled.clear()
+    return (bundle.p(), bundle.d(), bundle.status, bundle.terminated,
+            bundle.opl, bundle.index)
+
+
+def check(system, kernel):
+    "Checks that a kernel and the numpy backend trace a system identically."
+    expected = trace(system)
+    found = trace(system, kernel)
+    names = ('p', 'k', 'status', 'terminated', 'opl', 'index')
+    for name, a, b in zip(names, expected, found):
+        assert np.array_equal(a, b), name
+
+
+@pytest.mark.parametrize('system', SYSTEMS)
+def test_python_loop(system):
+    check(system, backend._trace_rays)
+
+
+@pytest.mark.skipif(not HAVE_NUMBA, reason='Numba is not installed')
+@pytest.mark.parametrize('system', SYSTEMS)
+def test_compiled_loop(system):
+    check(system, backend._kernel())
+
+
+def test_statuses():
+    "The test systems cover refraction, vignetting and reflection."
+    assert set(trace(tir)[2]) >= {rt.REFRACTED, rt.MISSED}
+    assert rt.VIGNETTED in trace(planoconvex)[2]
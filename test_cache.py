@@ -0,0 +1,100 @@
+"""
+Checks that the trace cache gives back exactly what was traced, from memory
+and from disk, and that anything that changes a trace changes its key.
+"""
+import os
+import numpy as np
+import cache
+import raytracer as rt
+
+
+def planoconvex(curv=0.02, n2=1.5168):
+    "planoconvex.py's convex-first lens."
+    return [rt.SphericalRefraction(100, curv, 1.0, n2, 21.8),
+            rt.SphericalRefraction(105, 0, n2, 1.0, 21.8),
+            rt.OutputPlane(198.45, 10000)]
+
+
+def arrays(bundle):
+    "The arrays of a traced bundle."
+    return (np.array(bundle.positions), np.array(bundle.directions),
+            bundle.lost, bundle.terminated, bundle.status, bundle.opl,
+            bundle.index)
+
+
+def check(a, b):
+    "Checks that two traced bundles are identical."
+    for x, y in zip(arrays(a), arrays(b)):
+        assert np.array_equal(x, y)
+
+
+def test_disk(tmp_path):
+    "A trace saved by one cache is read back unchanged by another."
+    expected = rt.ray_bundle(8, 25., 6)
+    rt.OpticalSystem(planoconvex()).propagate_bundle(expected)
+    first = cache.TraceCache(directory=str(tmp_path))
+    check(first.trace(planoconvex(), 8, 25., 6), expected)
+    assert (first.hits, first.misses) == (0, 1)
+    assert len(os.listdir(str(tmp_path))) == 1
+    second = cache.TraceCache(directory=str(tmp_path))
+    check(second.trace(planoconvex(), 8, 25., 6), expected)
+    assert (second.hits, second.misses) == (1, 0)
+    # The second lookup comes from memory.
+    check(second.trace(planoconvex(), 8, 25., 6), expected)
+    assert second.hits == 2
+
+
+def test_copies():
+    "Changing a returned bundle doesn't change the cached trace."
+    traces = cache.TraceCache()
+    bundle = traces.trace(planoconvex(), 5, 25., 6)
+    expected = arrays(traces.trace(planoconvex(), 5, 25., 6))
+    bundle.positions[-1][:] = 0.
+    bundle.lost[:] = True
+    bundle.opl[:] = 0.
+    for x, y in zip(expected, arrays(traces.trace(planoconvex(), 5, 25.,
+                                                  6))):
+        assert np.array_equal(x, y)
+
+
+def test_keys(tmp_path, monkeypatch):
+    "Changing the lens, the bundle or the format misses the cache."
+    traces = cache.TraceCache(directory=str(tmp_path))
+    traces.trace(planoconvex(), 5, 25., 6)
+    for elements, n, rmax in ((planoconvex(0.021), 5, 25.),
+                              (planoconvex(n2='N-BK7'), 5, 25.),
+                              (planoconvex(), 6, 25.),
+                              (planoconvex(), 5, 24.)):
+        misses = traces.misses
+        traces.trace(elements, n, rmax, 6)
+        assert traces.misses == misses + 1
+    traces.trace(planoconvex(), 5, 25., 6)
+    assert traces.hits == 1
+    # Files saved by an older format are traced again.
+    monkeypatch.setattr(cache, 'FORMAT', cache.FORMAT + 1)
+    traces.clear()
+    traces.trace(planoconvex(), 5, 25., 6)
+    assert traces.misses == 6
+    assert len(os.listdir(str(tmp_path))) == 6
+
+
+def test_lru():
+    "The least recently used result is dropped from memory."
+    traces = cache.TraceCache(max_entries=2)
+    for curv in (0.02, 0.021, 0.02, 0.022):
+        traces.focal_point(planoconvex(curv))
+    assert len(traces) == 2
+    assert (traces.hits, traces.misses) == (1, 3)
+    traces.focal_point(planoconvex(0.02))
+    traces.focal_point(planoconvex(0.021))
+    assert (traces.hits, traces.misses) == (2, 4)
+
+
+def test_focal_point(tmp_path):
+    elements = planoconvex()
+    expected = rt.OpticalSystem(elements).focal_point()
+    assert cache.TraceCache(directory=str(tmp_path)).focal_point(
+        elements) == expected
+    traces = cache.TraceCache(directory=str(tmp_path))
+    assert traces.focal_point(elements) == expected
+    assert traces.hits == 1
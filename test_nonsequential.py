@@ -0,0 +1,83 @@
+"""
+Checks that walking the bounding volume hierarchy of a scene finds the same
+nearest hits as testing every element, and that a scene of a sequential lens
+traces it as an OpticalSystem does.
+"""
+import numpy as np
+import nonsequential
+import raytracer as rt
+
+
+def clutter(count=300, seed=1):
+    """A scene of randomly placed spheres, mirrors, aspheres and output
+       planes, a third of them tilted and decentred.
+    """
+    rng = np.random.default_rng(seed)
+    elements = []
+    for i in range(count):
+        z0 = rng.uniform(0., 600.)
+        curv = rng.choice([0., 1.]) * rng.uniform(-0.05, 0.05)
+        ap_r = rng.uniform(2., 15.)
+        if curv != 0:
+            ap_r = min(ap_r, 0.9 / abs(curv))
+        shift = {}
+        if i % 3 == 0:
+            shift = {'decenter': tuple(rng.uniform(-20., 20., 2)),
+                     'tilt': tuple(rng.uniform(-30., 30., 2))}
+        kind = i % 4
+        if kind == 0:
+            elements.append(rt.SphericalRefraction(z0, curv, 1.0, 1.5, ap_r,
+                                                   **shift))
+        elif kind == 1:
+            elements.append(rt.SphericalMirror(z0, curv, ap_r, **shift))
+        elif kind == 2:
+            elements.append(rt.AsphericRefraction(
+                z0, curv, 1.0, 1.6, ap_r, conic=-0.5,
+                coefficients=(1e-5,), **shift))
+        else:
+            elements.append(rt.OutputPlane(z0, ap_r, **shift))
+    return elements
+
+
+def test_nearest_hit():
+    scene = nonsequential.Scene(clutter())
+    rng = np.random.default_rng(2)
+    n = 2000
+    p = np.column_stack((rng.uniform(-25., 25., (n, 2)),
+                         rng.uniform(-50., 650., n)))
+    k = rt.norm_rows(rng.normal(size=(n, 3)) * [0.3, 0.3, 1.])
+    element, length = scene.nearest_hit(p, k)
+    # Every element is tested against every ray.
+    lengths = np.array([scene._lengths(p, k, np.full(n, i), 1e-9)
+                        for i in range(len(scene))])
+    expected = np.argmin(lengths, axis=0)
+    best = lengths[expected, np.arange(n)]
+    expected[np.isinf(best)] = -1
+    assert np.array_equal(element, expected)
+    assert np.array_equal(length, best)
+    # Enough rays hit something for this to test the hierarchy.
+    assert 0.2 < np.mean(element >= 0) < 1
+
+
+def planoconvex():
+    "planoconvex.py's convex-first lens."
+    return [rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8),
+            rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8),
+            rt.OutputPlane(198.45, 10000)]
+
+
+def test_sequential():
+    """A scene of a lens traces each ray through it in turn, exactly as an
+       OpticalSystem does, when every ray is inside the aperture.
+    """
+    expected = rt.ray_bundle(10, 20., 6)
+    rt.OpticalSystem(planoconvex()).propagate_bundle(expected)
+    bundle = rt.ray_bundle(10, 20., 6)
+    # The elements are given out of order.
+    path = nonsequential.Scene(planoconvex()[::-1]).propagate_bundle(bundle)
+    assert np.array_equal(path.T, np.tile([2, 1, 0], (len(bundle), 1)))
+    assert not bundle.lost.any() and not expected.lost.any()
+    assert np.array_equal(bundle.status, expected.status)
+    assert np.array_equal(bundle.p(), expected.p())
+    assert np.array_equal(bundle.d(), expected.d())
+    assert np.array_equal(bundle.opl, expected.opl)
@@ -0,0 +1,85 @@
+"""
+Checks that the optimiser reduces the rms spot radius of a badly bent
+singlet while holding its focal length, and that the optimised surfaces
+trace to the spot that it reports.
+"""
+import numpy as np
+import pytest
+import analysis
+import genpolar
+import optimise
+import paraxial
+import raytracer as rt
+
+
+def planoconvex():
+    "planoconvex.py's lens the wrong way round, with the plane side first."
+    return [rt.SphericalRefraction(100, 0, 1.0, 1.5168, 21.8),
+            rt.SphericalRefraction(105, -0.02, 1.5168, 1.0, 21.8)]
+
+
+def rms(elements, rmax=10.):
+    "Finds the rms spot radius of the elements at their paraxial focus."
+    arrays = [a[np.newaxis] for a in paraxial.surface_arrays(elements)]
+    ap_r = np.array([[e._ap_r for e in elements]])
+    xy = genpolar.xyuniform(6, rmax, 6)
+    spots = optimise.spot_stack(*arrays, ap_r=ap_r, xy=xy)[0][0]
+    return analysis.rms_radius(spots)
+
+
+def test_converges():
+    elements = planoconvex()
+    start = rms(elements)
+    result = optimise.optimise(elements, 10.)
+    assert result['rms'] < 0.75 * start
+    assert np.isclose(result['rms'], rms(result['elements']), rtol=1e-12)
+    # Every accepted step lowers the spot size.
+    assert np.all(np.diff(result['history']) <= 0)
+    assert result['history'][-1] == result['rms']
+    assert result['iterations'] < 100
+    # The lens is bent to put most of the power on the first surface.
+    assert result['curv'][0] > -3 * result['curv'][1] > 0
+
+
+def test_focal_length():
+    "The focal length is held at its starting value, or at a given one."
+    elements = planoconvex()
+    efl = paraxial.cardinal_points(*paraxial.surface_arrays(elements))['efl']
+    result = optimise.optimise(elements, 10.)
+    assert np.isclose(result['efl'], efl, rtol=1e-12)
+    result = optimise.optimise(elements, 10., efl=90.)
+    assert np.isclose(result['efl'], 90., rtol=1e-12)
+    optimised = paraxial.surface_arrays(result['elements'])
+    assert np.isclose(paraxial.cardinal_points(*optimised)['efl'], 90.,
+                      rtol=1e-12)
+    assert np.isclose(result['focal_point'],
+                      paraxial.focal_point(result['elements']), rtol=1e-12)
+
+
+def test_spacing():
+    "Varied vertices stay in order, min_spacing apart, after z = 0."
+    result = optimise.optimise(planoconvex(), 10., vary_z0=True,
+                               min_spacing=2.)
+    z0 = result['z0']
+    assert z0[0] >= 2. and z0[1] - z0[0] >= 2. - 1e-9
+    assert [e._z0 for e in result['elements']] == list(z0)
+
+
+def test_media():
+    "Materials are passed on to the optimised surfaces by name."
+    elements = [rt.SphericalRefraction(100, 0, 'AIR', 'N-BK7', 21.8),
+                rt.SphericalRefraction(105, -0.02, 'N-BK7', 'AIR', 21.8)]
+    result = optimise.optimise(elements, 10., iterations=2)
+    assert [e.parameters()[2:4] for e in result['elements']] == [
+        ('AIR', 'N-BK7'), ('N-BK7', 'AIR')]
+
+
+def test_rejects():
+    tilted = planoconvex()
+    tilted[0] = rt.SphericalRefraction(100, 0, 1.0, 1.5168, 21.8,
+                                       tilt=(1., 0.))
+    with pytest.raises(Exception, match='Tilted or decentred'):
+        optimise.optimise(tilted, 10.)
+    mirror = [rt.SphericalMirror(100, -0.01, 20)]
+    with pytest.raises(Exception, match='Only SphericalRefraction'):
+        optimise.optimise(mirror, 10.)
@@ -0,0 +1,64 @@
+"""
+Checks that tracing a bundle across several processes gives exactly the
+same rays, in the same order, as tracing it in one.
+"""
+import numpy as np
+import pytest
+import parallel
+import raytracer as rt
+
+
+def planoconvex():
+    "planoconvex.py's convex-first lens, with the bundle to trace."
+    elements = [rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8),
+                rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8),
+                rt.OutputPlane(198.45, 10000)]
+    return elements, rt.ray_bundle(12, 25., 6)
+
+
+def polychromatic():
+    "A tilted N-BK7 singlet traced at three wavelengths, with the bundle."
+    elements = [rt.SphericalRefraction(100, 0.02, 'AIR', 'N-BK7', 21.8,
+                                       tilt=(2., 1.)),
+                rt.SphericalRefraction(105, -0.005, 'N-BK7', 'AIR', 21.8),
+                rt.OutputPlane(180, 10000)]
+    return elements, rt.ray_bundle(10, 20., 6, [486e-9, 588e-9, 656e-9])
+
+
+def tir():
+    """A lens with a steep back surface, where the outer rays are totally
+       internally reflected and then miss the output plane.
+    """
+    elements = [rt.SphericalRefraction(100, 0, 1.0, 1.5, 50),
+                rt.SphericalRefraction(120, -0.08, 1.5, 1.0, 12),
+                rt.OutputPlane(200, 10000)]
+    return elements, rt.ray_bundle(10, 11., 6)
+
+
+SYSTEMS = [planoconvex, polychromatic, tir]
+
+
+def trace(system, workers):
+    "Traces a system with a number of workers, returning the ray arrays."
+    elements, bundle = system()
+    parallel.propagate_bundle(elements, bundle, workers)
+    return (bundle.p(), bundle.d(), bundle.lost, bundle.status,
+            bundle.terminated, bundle.opl, bundle.index)
+
+
+@pytest.mark.parametrize('system', SYSTEMS)
+def test_parallel(system):
+    names = ('p', 'k', 'lost', 'status', 'terminated', 'opl', 'index')
+    serial = trace(system, 1)
+    for workers in (2, 3):
+        for name, a, b in zip(names, serial, trace(system, workers)):
+            assert np.array_equal(a, b), name
+
+
+def test_slices():
+    "The slices cover every ray once, in order, with none left empty."
+    for n, tasks in ((10, 3), (3, 8), (1000, 16)):
+        slices = parallel._slices(n, tasks)
+        assert slices[0][0] == 0 and slices[-1][1] == n
+        assert all(a < b for a, b in slices)
+        assert all(b == c for (a, b), (c, d) in zip(slices, slices[1:]))
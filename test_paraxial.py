@@ -0,0 +1,93 @@
+"""
+Checks the paraxial ray transfer matrices against rays traced very close to
+the z axis, where the traced focus and the paraxial focus agree.
+"""
+import numpy as np
+import pytest
+import paraxial
+import raytracer as rt
+
+
+def singlet():
+    "planoconvex.py's convex-first lens."
+    return [rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8),
+            rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8)]
+
+
+def doublet():
+    "A cemented doublet of N-BK7 and N-SF11, followed by a meniscus."
+    return [rt.SphericalRefraction(100, 0.016, 'AIR', 'N-BK7', 20),
+            rt.SphericalRefraction(106, -0.02, 'N-BK7', 'N-SF11', 20),
+            rt.SphericalRefraction(108, -0.004, 'N-SF11', 'AIR', 20),
+            rt.SphericalRefraction(115, 0.01, 'AIR', 1.6, 20),
+            rt.SphericalRefraction(118, 0.005, 1.6, 'AIR', 20)]
+
+
+def concave():
+    """A single concave surface into glass, where the focal length in the
+       glass is n2 times the effective focal length.
+    """
+    return [rt.SphericalRefraction(50, -0.01, 1.0, 1.5, 30)]
+
+
+SYSTEMS = [singlet, doublet, concave]
+
+
+def traced(elements, height=1e-4):
+    """Traces a ray parallel to the z axis at a small height.  Returns the
+       tuple (z, efl) of where it crosses the z axis, which is virtual for a
+       diverging system, and the effective focal length from its slope.
+    """
+    ray = rt.Ray([0., height, 0.], [0., 0., 1.])
+    for e in elements:
+        assert e.propagate_ray(ray)
+    (x, y, z), (kx, ky, kz) = ray.p(), ray.d()
+    return z - y * kz / ky, -height * kz / ky
+
+
+@pytest.mark.parametrize('system', SYSTEMS)
+def test_focal_point(system):
+    elements = system()
+    arrays = paraxial.surface_arrays(elements)
+    points = paraxial.cardinal_points(*arrays)
+    z, efl = traced(elements)
+    assert np.isclose(points['focal_point'], z, rtol=1e-7)
+    assert np.isclose(points['efl'] * arrays[3][-1], efl, rtol=1e-7)
+    assert np.isclose(paraxial.focal_point(elements), z, rtol=1e-7)
+
+
+def test_wavelengths():
+    "The focal point of a dispersive lens moves with the wavelength."
+    elements = doublet()
+    for wavelength in (486e-9, 656e-9):
+        arrays = paraxial.surface_arrays(elements, wavelength)
+        z = paraxial.cardinal_points(*arrays)['focal_point']
+        bundle = rt.parallel_bundle([[0., 1e-4]], wavelength=[wavelength])
+        for e in elements:
+            e.propagate_bundle(bundle)
+        (x, y, pz), (kx, ky, kz) = bundle.p()[0], bundle.d()[0]
+        assert np.isclose(z, pz - y * kz / ky, rtol=1e-7)
+
+
+def test_stacked():
+    "Stacked prescriptions give the same results as each one alone."
+    z0 = [[100., 105.], [50., 60.]]
+    curv = [[0.02, 0.], [-0.01, 0.]]
+    n1 = [[1., 1.5168], [1., 1.5]]
+    n2 = [[1.5168, 1.], [1.5, 1.5]]
+    stacked = paraxial.cardinal_points(z0, curv, n1, n2)
+    for j in range(2):
+        alone = paraxial.cardinal_points(z0[j], curv[j], n1[j], n2[j])
+        for name in stacked:
+            assert stacked[name][j] == alone[name]
+    assert np.isclose(stacked['focal_point'][1],
+                      paraxial.focal_point(concave()), rtol=1e-12)
+
+
+def test_image():
+    "An object at the front focal point is imaged at infinity."
+    arrays = paraxial.surface_arrays(singlet())
+    points = paraxial.cardinal_points(*arrays)
+    z_image, magnification = paraxial.image(
+        *arrays, z_object=points['front_focal_point'])
+    assert abs(z_image) > 1e9
@@ -0,0 +1,131 @@
+"""
+Checks that prescription files are parsed, or rejected with the line at
+fault, and that the compiled table of several lenses traces each of them as
+their optical elements do.
+"""
+import numpy as np
+import pytest
+import analysis
+import genpolar
+import prescription
+import raytracer as rt
+
+DOUBLET = """
+# A cemented doublet, which has more surfaces than the example lenses.
+lens doublet
+object AIR
+z 50
+#       curv    thickness  material  aperture
+surface 0.016   6          N-BK7     15
+surface -0.02   2          N-SF11    15
+surface -0.004  0          AIR       15
+image focus
+
+lens window
+z 20
+surface 0       3          F_SILICA  10
+surface 0       0          AIR       10
+image 60
+"""
+
+
+def lenses():
+    "The example lenses and the lenses above."
+    return prescription.load('lenses') + prescription.parse(DOUBLET)
+
+
+def test_parse():
+    doublet, window = prescription.parse(DOUBLET)
+    assert doublet == {'name': 'doublet', 'object': 'AIR', 'image': None,
+                       'surfaces': [(50., 0.016, 'N-BK7', 15.),
+                                    (56., -0.02, 'N-SF11', 15.),
+                                    (58., -0.004, 'AIR', 15.)]}
+    assert window['image'] == 60.
+    examples = prescription.load('lenses')
+    assert [lens['name'] for lens in examples] == [
+        'single_surface', 'convex_first', 'plane_first']
+    assert examples[1]['surfaces'][1] == (105., 0., 'AIR', 21.8)
+
+
+ERRORS = [
+    ('surface 0 1 1.5 10', 'line 1: surface comes before the first lens'),
+    ('lens a\nwidth 3', 'line 2: unknown keyword width'),
+    ('lens a\nsurface 0 1 1.5', 'line 2: surface takes 4 values'),
+    ('lens a\nsurface x 1 1.5 10', 'line 2: x is not a number'),
+    ('lens a\nsurface nan 1 1.5 10', 'line 2: nan is not a finite number'),
+    ('lens a\nz inf', 'line 2: inf is not a finite number'),
+    ('lens a\nsurface 0 1 GLASS 10', 'line 2: there is no material called'),
+    ('lens a\nsurface 0 1 0.5 10', 'line 2: the refractive index 0.5'),
+    ('lens a\nsurface 0 -1 1.5 10', 'line 2: the thickness is negative'),
+    ('lens a\nsurface 0 1 1.5 0', 'line 2: the aperture radius must be'),
+    ('lens a\nsurface 0.2 1 1.5 10', 'line 2: the aperture radius is larger'),
+    ('lens a\nz -5', 'line 2: z is behind z = 0'),
+    ('lens a\nz 10\nsurface 0 1 1.5 5\nz 9',
+     'line 4: z moves back past the last surface'),
+    ('lens a\nz 10\nsurface 0 0 1.5 5\nsurface 0 1 1 5',
+     'line 4: the surface is not after the last surface'),
+    ('lens a\nsurface 0 1 1.5 5\nobject 1.2', 'line 3: object comes after'),
+    ('lens a\nimage 10', 'line 2: image comes before the surfaces'),
+    ('lens a\nz 10\nsurface 0 1 1.5 5\nimage 5',
+     'line 4: the image is not after the last surface'),
+    ('lens a\nz 10\nsurface 0 1 1.5 5\nimage 50\nsurface 0 1 1 5',
+     'line 5: surface comes after the image'),
+    ('lens a', 'lens a has no surfaces'),
+    ('lens a\nz 1\nsurface 0 1 1.5 5\nlens a\nz 1\nsurface 0 1 1.5 5',
+     'there are two lenses called a'),
+    ('lens a\nz 10\nsurface -0.05 0 1.5 5\nimage focus',
+     'line 4: the focal point of lens a is not after the last surface'),
+    ('lens a\nz 10\nsurface 0 0 1.5 5',
+     'line 1: the focal point of lens a is not after the last surface'),
+]
+
+
+@pytest.mark.parametrize('text, message', ERRORS)
+def test_errors(text, message):
+    with pytest.raises(Exception) as error:
+        prescription.parse(text, 'test.lens')
+    assert str(error.value).startswith('test.lens')
+    assert message in str(error.value)
+
+
+def test_compile_table():
+    "Shorter lenses are padded at the front, with the last surfaces aligned."
+    table = prescription.compile_table(lenses())
+    assert table['z0'].shape == (5, 3)
+    assert list(table['surfaces']) == [1, 2, 2, 3, 2]
+    assert list(table['names']) == ['single_surface', 'convex_first',
+                                    'plane_first', 'doublet', 'window']
+    assert table['z0'][1, 0] == 0. and table['curv'][1, 0] == 0.
+    assert np.isinf(table['ap_r'][1, 0])
+    assert table['z0'][1, 2] == 105. and table['ap_r'][1, 2] == 21.8
+    assert table['z_image'][4] == 60.
+    # The padding is in the medium of the object, so it changes nothing.
+    padding = np.arange(3) < 3 - table['surfaces'][:, np.newaxis]
+    assert padding.sum() == 5
+    assert np.all(table['n1'][padding] == table['n2'][padding])
+    assert np.all(table['n1'][padding] == 1.)
+
+
+@pytest.mark.parametrize('wavelength', [None, 486e-9])
+def test_trace_table(wavelength):
+    """Every lens in the table traces as its elements do on their own.  The
+       window vignettes some of the rays.
+    """
+    table = prescription.compile_table(lenses(), wavelength)
+    result = prescription.trace_table(table, 12., n=8)
+    for i, lens in enumerate(lenses()):
+        elements = prescription.elements(lens)
+        if wavelength is None:
+            assert np.isclose(table['z_image'][i], elements[-1]._z0,
+                              rtol=1e-12)
+        # Paraxial foci move with the wavelength.
+        elements[-1] = rt.OutputPlane(table['z_image'][i], 10000)
+        bundle = rt.parallel_bundle(genpolar.xyuniform(8, 12., 6),
+                                    wavelength=wavelength)
+        rt.OpticalSystem(elements).propagate_bundle(bundle)
+        xy = analysis.spot_positions(bundle)
+        assert np.isclose(result['rms'][i], analysis.rms_radius(xy),
+                          rtol=1e-9)
+        assert result['lost'][i] == np.mean(bundle.lost)
+        assert result['focal_point'][i] == table['z_image'][i]
+    assert 0 < result['lost'][4] < 1
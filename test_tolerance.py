@@ -0,0 +1,110 @@
+"""
+Checks the statistics of the random errors made by perturb, and that
+monte_carlo traces unperturbed copies exactly as the nominal lens.
+"""
+import numpy as np
+import pytest
+import paraxial
+import raytracer as rt
+import tolerance
+
+# A cemented doublet followed by a singlet, as (S,) arrays.
+Z0 = np.array([100., 106., 108., 115., 118.])
+CURV = np.array([0.016, -0.02, -0.004, 0.01, 0.005])
+N1 = np.array([1., 1.5168, 1.78, 1., 1.6])
+N2 = np.array([1.5168, 1.78, 1., 1.6, 1.])
+AP_R = np.array([20., 20., 20., 18., 18.])
+TRIALS = 20000
+
+
+def perturb(tolerances, distribution='normal', seed=0):
+    "Makes TRIALS perturbed copies of the lens."
+    return tolerance.perturb(Z0, CURV, N1, N2, AP_R, TRIALS, tolerances,
+                             distribution, seed)
+
+
+def test_normal():
+    "The errors have the tolerances as standard deviations."
+    z0, curv, n1, n2, ap_r = perturb({'curv': 1e-4, 'ap_r': 0.1})
+    assert z0.shape == curv.shape == ap_r.shape == (TRIALS, 5)
+    errors = curv - CURV
+    assert np.allclose(errors.mean(axis=0), 0., atol=5e-6)
+    assert np.allclose(errors.std(axis=0), 1e-4, rtol=0.03)
+    assert np.allclose((ap_r - AP_R).std(axis=0), 0.1, rtol=0.03)
+    # The surfaces are perturbed independently.
+    assert abs(np.corrcoef(errors[:, 0], errors[:, 1])[0, 1]) < 0.03
+    # Parameters without tolerances are left alone.
+    assert np.array_equal(z0, np.tile(Z0, (TRIALS, 1)))
+    assert np.array_equal(n2, np.tile(N2, (TRIALS, 1)))
+
+
+def test_uniform():
+    "The errors are spread evenly between plus and minus the tolerances."
+    curv = perturb({'curv': 1e-4}, 'uniform')[1]
+    errors = curv - CURV
+    assert np.all(np.abs(errors) <= 1e-4)
+    assert np.allclose(errors.std(axis=0), 1e-4 / np.sqrt(3), rtol=0.03)
+
+
+def test_thickness():
+    "Spacing errors add up along the lens."
+    z0 = perturb({'thickness': 0.05})[0]
+    errors = z0 - Z0
+    variance = 0.05**2 * np.arange(1, 6)
+    assert np.allclose(errors.var(axis=0), variance, rtol=0.05)
+    assert np.allclose(np.diff(errors, axis=1).std(axis=0), 0.05, rtol=0.03)
+
+
+def test_index():
+    """Only the glass is perturbed, and each medium is the same either side
+       of the surfaces.
+    """
+    z0, curv, n1, n2, ap_r = perturb({'index': 1e-3})
+    glass = N2 != 1.
+    assert np.all(n2[:, ~glass] == 1.) and np.all(n1[:, 0] == 1.)
+    assert np.allclose((n2 - N2)[:, glass].std(axis=0), 1e-3, rtol=0.03)
+    assert np.array_equal(n1[:, 1:], n2[:, :-1])
+
+
+def test_per_surface():
+    "Tolerances can be given for each surface."
+    sizes = np.array([0., 1e-4, 2e-4, 0., 3e-4])
+    errors = perturb({'curv': sizes})[1] - CURV
+    assert np.allclose(errors.std(axis=0), sizes, rtol=0.03)
+
+
+def test_repeatable():
+    a, b = perturb({'curv': 1e-4}, seed=5), perturb({'curv': 1e-4}, seed=5)
+    assert all(np.array_equal(x, y) for x, y in zip(a, b))
+    c = perturb({'curv': 1e-4}, seed=6)
+    assert not np.array_equal(a[1], c[1])
+
+
+def test_errors():
+    with pytest.raises(Exception, match='no tolerance called tilt'):
+        perturb({'tilt': 1.})
+    with pytest.raises(Exception, match="'normal' or 'uniform'"):
+        perturb({'curv': 1e-4}, 'gaussian')
+
+
+def planoconvex(tilt=(0., 0.)):
+    "planoconvex.py's convex-first lens."
+    return [rt.SphericalRefraction(100, 0.02, 1.0, 1.5168, 21.8, tilt=tilt),
+            rt.SphericalRefraction(105, 0, 1.5168, 1.0, 21.8),
+            rt.OutputPlane(198.45, 10000)]
+
+
+def test_monte_carlo():
+    "Trials without errors are the nominal lens, at its paraxial focus."
+    result = tolerance.monte_carlo(planoconvex(), {}, trials=10, rmax=5.)
+    assert np.all(result['rms'] == result['nominal'])
+    assert np.all(result['focal_point']
+                  == paraxial.focal_point(planoconvex()))
+    assert result['std'] == 0.
+    result = tolerance.monte_carlo(planoconvex(), {'curv': 1e-4}, 2000,
+                                   rmax=5., seed=0, spec=result['nominal'])
+    assert result['std'] > 0.
+    assert 0 < result['yield'] < 1
+    assert result['percentiles'][50] <= result['percentiles'][95]
+    with pytest.raises(Exception, match='Tilted or decentred'):
+        tolerance.monte_carlo(planoconvex((1., 0.)), {})
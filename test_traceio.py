@@ -0,0 +1,81 @@
+"""
+Checks that traces written to trace files, a chunk at a time, are read back
+through memory maps with the rays in the same order.
+"""
+import numpy as np
+import pytest
+import genpolar
+import raytracer as rt
+import streaming
+import traceio
+
+
+def planoconvex():
+    "planoconvex.py's convex-first lens."
+    return rt.OpticalSystem([
+        rt.SphericalRefraction(100, 0.02, 1.0, 'N-BK7', 21.8),
+        rt.SphericalRefraction(105, 0, 'N-BK7', 1.0, 21.8),
+        rt.OutputPlane(198.45, 10000)])
+
+
+def chunks(size=100):
+    "rtuniform(12, 25., 6) in bundles of size rays, some of them vignetted."
+    return streaming.polar_chunks(genpolar.rtuniform(12, 25., 6), size)
+
+
+def expected():
+    "The whole bundle traced at once."
+    bundle = rt.parallel_bundle(genpolar.xyuniform(12, 25., 6))
+    planoconvex().propagate_bundle(bundle)
+    return bundle
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'trace.bin')
+    bundle = expected()
+    n = traceio.write_trace(path, planoconvex(), chunks(), 1000, dtype)
+    assert n == len(bundle)
+    f = traceio.TraceFile(path)
+    assert len(f) == n
+    assert f.header['capacity'] == 1000
+    assert f.header['system'] == traceio.describe(planoconvex())
+    assert isinstance(f.positions, np.memmap)
+    assert f.positions.dtype == dtype and f.directions.dtype == dtype
+    assert f.positions.shape == (n, 3)
+    # float32 files hold the float64 trace rounded to the nearest float32.
+    assert np.array_equal(f.positions, bundle.p().astype(dtype))
+    assert np.array_equal(f.directions, bundle.d().astype(dtype))
+    assert np.array_equal(f.status, bundle.status)
+    assert np.array_equal(f.terminated, bundle.terminated)
+    assert np.array_equal(f.lost(), bundle.lost)
+    assert f.lost().any() and not f.lost().all()
+
+
+def test_writer(tmp_path):
+    "The writer counts the rays written, and refuses more than capacity."
+    path = str(tmp_path / 'trace.bin')
+    with traceio.TraceWriter(path, 150, dtype=np.float32) as writer:
+        assert writer.count == 0
+        bundles = list(chunks(100))
+        writer.write(bundles[0])
+        assert writer.count == 100
+        with pytest.raises(Exception, match='full'):
+            writer.write(bundles[1])
+        assert writer.count == 100
+    assert len(traceio.TraceFile(path)) == 100
+
+
+def test_empty(tmp_path):
+    path = str(tmp_path / 'trace.bin')
+    traceio.TraceWriter(path, 10, rt.OutputPlane(10, 5)).close()
+    f = traceio.TraceFile(path)
+    assert len(f) == 0 and f.positions.shape == (0, 3)
+    assert f.header['system'] == [['OutputPlane', 10., 5., 0., 0., 0., 0.]]
+
+
+def test_not_a_trace(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'\0' * traceio.HEADER_SIZE)
+    with pytest.raises(Exception, match='not a trace file'):
+        traceio.TraceFile(str(path))
@@ -0,0 +1,172 @@
+"""
+Monte Carlo tolerancing of lenses made of SphericalRefraction surfaces.
+
+Thousands of copies of a lens are made with random manufacturing errors in
+the curvature, spacing, refractive index and aperture radius of its
+surfaces.  The copies are stacked into (T,S) parameter arrays and traced
+together by sweep.sweep, optionally across several processes.  Each copy is
+refocused at its own paraxial focal point, found from its ray transfer
+matrix rather than by tracing a ray, so a trial costs little more than
+tracing its bundle.  The rms spot radii of the trials are summarised by
+percentiles, and by the yield against a specification.
+"""
+import numpy as np
+import paraxial
+import raytracer as rt
+import sweep
+
+# The parameters that can be given tolerances.
+TOLERANCES = ('curv', 'thickness', 'index', 'ap_r')
+
+
+def perturb(z0, curv, n1, n2, ap_r, trials, tolerances,
+            distribution='normal', seed=None):
+    """Makes randomly perturbed copies of a lens prescription.  Returns the
+       tuple (z0, curv, n1, n2, ap_r) of (T,S) arrays for T trials of S
+       surfaces.
+
+       Parameters
+       ----------
+       z0, curv, n1, n2, ap_r: array_type
+                     (S,) arrays of the parameters of the surfaces.
+       trials:       integer_type
+                     The number of perturbed copies, T.
+       tolerances:   dict_type
+                     The size of the errors, for all of the surfaces or as
+                     an (S,) array, keyed by the names in TOLERANCES:
+                     "curv" for the curvature, "thickness" for the spacing
+                     of each vertex from the one before, so that errors
+                     add up along the lens, "index" for the refractive index
+                     of the medium after each surface, which is left alone
+                     for air, and "ap_r" for the aperture radius.  Missing
+                     parameters are not perturbed.
+       distribution: string_type
+                     'normal', for errors with the tolerances as standard
+                     deviations, or 'uniform', for errors spread evenly
+                     between plus and minus the tolerances.
+       seed:         integer_type
+                     The seed of the random numbers, for repeatable trials.
+    """
+    for name in tolerances:
+        if name not in TOLERANCES:
+            raise Exception('There is no tolerance called %s.' % name)
+    if distribution not in ('normal', 'uniform'):
+        raise Exception("distribution must be 'normal' or 'uniform'.")
+    z0, curv, n1, n2, ap_r = [np.asarray(a, dtype=float)
+                              for a in (z0, curv, n1, n2, ap_r)]
+    rng = np.random.default_rng(seed)
+    shape = (trials, len(z0))
+
+    def errors(name):
+        "Draws the (T,S) errors of one parameter."
+        size = np.broadcast_to(np.asarray(tolerances.get(name, 0.),
+                                          dtype=float), shape[1:])
+        if distribution == 'normal':
+            return rng.standard_normal(shape) * size
+        return rng.uniform(-1., 1., shape) * size
+
+    curv = curv + errors('curv')
+    z0 = z0 + np.cumsum(errors('thickness'), axis=1)
+    # The medium after each surface is the medium before the next.
+    dn = errors('index') * (n2 != 1.)
+    n2 = n2 + dn
+    n1 = np.tile(n1, (trials, 1))
+    n1[:, 1:] += dn[:, :-1]
+    ap_r = np.maximum(ap_r + errors('ap_r'), 0.)
+    return z0, curv, n1, n2, ap_r
+
+
+def monte_carlo(elements, tolerances, trials=1000, rmax=None, n=6, m=6,
+                distribution='normal', seed=None, spec=None,
+                percentiles=(50, 84, 95, 99), workers=1, chunk_size=256):
+    """Traces randomly perturbed copies of a lens, each at its own paraxial
+       focal point, and finds the distribution of their rms spot radii.
+       Returns a dictionary of:
+
+       rms:         (T,) array of the rms spot radius of each trial.
+       focal_point: (T,) array of the paraxial focal point of each trial.
+       lost:        (T,) array of the fraction of rays lost in each trial.
+       nominal:     the rms spot radius of the unperturbed lens.
+       mean, std:   the mean and standard deviation of the rms radii.
+       percentiles: a dictionary of the rms radius at each percentile.
+       yield:       the fraction of trials with an rms radius within the
+                    specification, if one is given.
+       parameters:  a dictionary of the (T,S) arrays of the perturbed
+                    surface parameters, z0, curv, n1, n2 and ap_r.
+
+       Parameters
+       ----------
+       elements:     list_type
+                     SphericalRefraction surfaces centred on the z axis, or
+                     an OpticalSystem, in the order that rays pass through
+                     them.  Output planes are ignored.
+       tolerances:   dict_type
+                     The size of the errors, as for perturb.
+       trials:       integer_type
+                     The number of perturbed copies to trace.
+       rmax:         float_type
+                     The radius of the ray bundle.  Defaults to the aperture
+                     radius of the first surface.
+       n, m:         integer_type
+                     The numbers of concentric circles and the rate of
+                     increase of rays per circle, as for rt.bundle.
+       distribution: string_type
+                     'normal' or 'uniform', as for perturb.
+       seed:         integer_type
+                     The seed of the random numbers.
+       spec:         float_type
+                     The largest acceptable rms spot radius, for the yield.
+       percentiles:  list_type
+                     The percentiles of the rms radii to report.
+       workers:      integer_type
+                     The number of processes to share the trials between.
+       chunk_size:   integer_type
+                     The number of trials traced together.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    surfaces = [e for e in elements if hasattr(e, '_curv')]
+    if any(type(e) is not rt.SphericalRefraction for e in surfaces):
+        raise Exception('Only SphericalRefraction surfaces can be '
+                        'toleranced.')
+    # The stacked trace is of surfaces centred on the z axis.
+    if any(e._rotation is not None for e in surfaces):
+        raise Exception('Tilted or decentred surfaces can not be '
+                        'toleranced.')
+    z0, curv, n1, n2 = paraxial.surface_arrays(surfaces)
+    ap_r = np.array([e._ap_r for e in surfaces])
+    if rmax is None:
+        rmax = ap_r[0]
+    nominal = sweep.sweep(z0, curv, n1, n2, ap_r, rmax, n, m)['rms']
+    arrays = perturb(z0, curv, n1, n2, ap_r, trials, tolerances,
+                     distribution, seed)
+    traced = sweep.sweep(*arrays, rmax=rmax, n=n, m=m, workers=workers,
+                         chunk_size=chunk_size)
+    rms = traced['rms']
+    result = {'rms': rms,
+              'focal_point': traced['focal_point'],
+              'lost': traced['lost'],
+              'nominal': float(nominal),
+              'mean': float(np.nanmean(rms)),
+              'std': float(np.nanstd(rms)),
+              'percentiles': dict(zip(percentiles, np.nanpercentile(
+                  rms, percentiles))),
+              'parameters': dict(zip(('z0', 'curv', 'n1', 'n2', 'ap_r'),
+                                     arrays))}
+    if spec is not None:
+        result['yield'] = float(np.mean(rms <= spec))
+    return result
+
+
+def report(result):
+    """Finds a few lines of text summarising the result of monte_carlo.
+    """
+    lines = ['%d trials' % len(result['rms']),
+             'Nominal rms spot radius = %.6g mm' % result['nominal'],
+             'Mean rms spot radius = %.6g mm, standard deviation %.6g mm'
+             % (result['mean'], result['std'])]
+    for percentile, value in sorted(result['percentiles'].items()):
+        lines.append('%gth percentile = %.6g mm' % (percentile, value))
+    if 'yield' in result:
+        lines.append('Yield = %.1f%%' % (100 * result['yield']))
+    return '\n'.join(lines)
@@ -0,0 +1,207 @@
+"""
+A compact binary file format for saving large traces.
+
+A trace file starts with a fixed-size header, holding a magic string and a
+JSON description of the optical system and the arrays, followed by
+contiguous arrays of the final positions and directions of every ray, a
+status code for each ray and the index of the element where it was lost.
+Traces can be written a chunk at a time, and are read back with np.memmap,
+so analyses can work on slices of a file without loading all of it.
+"""
+import json
+import numpy as np
+import raytracer as rt
+
+MAGIC = b'ORTRACE2'
+HEADER_SIZE = 4096
+
+
+def describe(elements):
+    """Finds a list describing a sequence of optical elements, an
+       OpticalSystem or a single element, made of the name and parameters of
+       each element, to save in a file header.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    elif isinstance(elements, rt.OpticalElement):
+        elements = [elements]
+    return [[type(e).__name__] + [a if isinstance(a, str) else float(a)
+                                  for a in e.parameters()]
+            for e in elements]
+
+
+def _layout(capacity, dtype):
+    """Finds the (name, dtype, shape, offset) of each array in a file that
+       holds capacity rays.
+    """
+    arrays = [('positions', np.dtype(dtype), (capacity, 3)),
+              ('directions', np.dtype(dtype), (capacity, 3)),
+              ('status', np.dtype(np.uint8), (capacity,)),
+              ('terminated', np.dtype(np.int16), (capacity,))]
+    layout = []
+    offset = HEADER_SIZE
+    for name, dt, shape in arrays:
+        layout.append((name, dt, shape, offset))
+        offset += dt.itemsize * int(np.prod(shape))
+    return layout, offset
+
+
+def _write_header(f, header):
+    "Writes the magic string and JSON header, padded to HEADER_SIZE."
+    text = json.dumps(header).encode('utf-8')
+    if len(MAGIC) + len(text) > HEADER_SIZE:
+        raise Exception('The system description is too long for the '
+                        'header.')
+    f.seek(0)
+    f.write(MAGIC + text.ljust(HEADER_SIZE - len(MAGIC)))
+
+
+class TraceWriter:
+    """
+    Writes the final state of traced RayBundles to a trace file, a chunk at a
+    time.  The file is made big enough for capacity rays when it is opened,
+    and the number of rays actually written is saved when it is closed.
+    """
+
+    def __init__(self, path, capacity, elements=None, dtype=np.float64):
+        """
+        Initialises the TraceWriter class.
+
+        Parameters
+        ----------
+        path:     string_type
+                  The file to write.
+        capacity: integer_type
+                  The largest number of rays that will be written.
+        elements: list_type
+                  Optical elements, an OpticalSystem or a single element, to
+                  describe in the header.
+        dtype:    type_type
+                  np.float32 or np.float64, for the positions and
+                  directions.
+        """
+        self._path = path
+        self._count = 0
+        self._capacity = int(capacity)
+        self._header = {'version': 2,
+                        'dtype': np.dtype(dtype).str,
+                        'capacity': self._capacity,
+                        'n_rays': 0,
+                        'system': describe(elements) if elements else []}
+        layout, size = _layout(self._capacity, dtype)
+        with open(path, 'wb') as f:
+            _write_header(f, self._header)
+            f.truncate(size)
+        self._arrays = dict((name, np.memmap(path, dtype=dt, mode='r+',
+                                             offset=offset, shape=shape))
+                            for name, dt, shape, offset in layout)
+
+    @property
+    def count(self):
+        """
+        count: The number of rays written so far.
+        """
+        return self._count
+
+    def write(self, bundle):
+        """
+        Writes the latest positions, directions and status of every ray in a
+        RayBundle after those already written.
+        """
+        n = len(bundle)
+        start, stop = self._count, self._count + n
+        if stop > self._capacity:
+            raise Exception('The trace file is full.')
+        a = self._arrays
+        a['positions'][start:stop] = bundle.p()
+        a['directions'][start:stop] = bundle.d()
+        a['status'][start:stop] = bundle.status
+        a['terminated'][start:stop] = bundle.terminated
+        self._count = stop
+
+    def close(self):
+        """
+        Flushes the arrays and saves the number of rays written in the
+        header.
+        """
+        if self._arrays is None:
+            return
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = None
+        self._header['n_rays'] = self._count
+        with open(self._path, 'r+b') as f:
+            _write_header(f, self._header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceFile:
+    """
+    Reads a trace file.  The arrays positions, directions, status and
+    terminated are read-only memory maps of the rays that were written, so
+    nothing is loaded until it is used.
+    """
+
+    def __init__(self, path):
+        """
+        Initialises the TraceFile class.
+
+        Parameters
+        ----------
+        path: string_type
+              The trace file to read.
+        """
+        with open(path, 'rb') as f:
+            block = f.read(HEADER_SIZE)
+        if block[:len(MAGIC)] != MAGIC:
+            raise Exception('This is not a trace file.')
+        self.header = json.loads(block[len(MAGIC):].decode('utf-8'))
+        n = self.header['n_rays']
+        layout = _layout(self.header['capacity'], self.header['dtype'])[0]
+        for name, dt, shape, offset in layout:
+            if n == 0:
+                array = np.zeros((0,) + shape[1:], dtype=dt)
+            else:
+                array = np.memmap(path, dtype=dt, mode='r', offset=offset,
+                                  shape=(n,) + shape[1:])
+            setattr(self, name, array)
+
+    def lost(self):
+        """
+        Finds the boolean array that is True for rays that were lost.
+        """
+        return self.status >= rt.VIGNETTED
+
+    def __len__(self):
+        return self.header['n_rays']
+
+
+def write_trace(path, system, chunks, capacity, dtype=np.float64):
+    """Traces every chunk of rays through an optical system and writes the
+       results to a trace file, holding only one chunk in memory at a time.
+       Returns the number of rays written.
+
+       Parameters
+       ----------
+       path:     string_type
+                 The file to write.
+       system:   instance_type
+                 An OpticalSystem, or other OpticalElement with parameters.
+       chunks:   iterable_type
+                 RayBundle objects to propagate, such as from
+                 streaming.polar_chunks.
+       capacity: integer_type
+                 The largest number of rays that will be written.
+       dtype:    type_type
+                 np.float32 or np.float64, for the positions and directions.
+    """
+    with TraceWriter(path, capacity, system, dtype) as writer:
+        for bundle in chunks:
+            system.propagate_bundle(bundle)
+            writer.write(bundle)
+        return writer.count
@@ -5,16 +5,36 @@ Created on Fri Nov 25 10:19:14 2016
 @author: bms115
 """
 import numpy as np
+from math import sqrt
 
 
 def norm(vector):
     "Normalises a vector, provided that the vector has a non-zero magnitude."
-    n = np.linalg.norm(vector)
+    n = sqrt(vector.dot(vector))
     if n > 0:
         return vector / n
     else:
         return vector
 
+def dot_rows(a, b):
+    """Finds the dot product of each pair of rows of two (...,3) arrays.  The
+       products are added in order, as in the compiled backend, so that both
+       give exactly the same results.  It is only for the array kernels;
+       single rays are traced with norm and ndarray.dot, which are cheaper
+       for one vector.
+    """
+    return (a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+            + a[..., 2] * b[..., 2])
+
+def norm_rows(vectors):
+    """Normalises each row of an (...,3) array of vectors.  Rows with zero
+       magnitude are left unchanged.
+    """
+    vectors = np.asarray(vectors, dtype=float)
+    n = np.sqrt(dot_rows(vectors, vectors))
+    n = np.where(n == 0, 1., n)
+    return vectors / n[..., np.newaxis]
+
 def normal_vector(opticalelement, point):
     """Finds the normal vector to an optical element at a given point.  All
        normal vectors must be in the negative z direction.
@@ -23,10 +43,11 @@ def normal_vector(opticalelement, point):
     if opticalelement._curv == 0:
         return np.array([0., 0., -1])
     else:
-        if norm(np.array(point) - opticalelement.centre())[2] > 0:
-            return -norm(np.array(point) - opticalelement.centre())
+        normal = norm(np.asarray(point, dtype=float) - opticalelement._centre)
+        if normal[2] > 0:
+            return -normal
         else:
-            return norm(np.array(point) - opticalelement.centre())
+            return normal
 
 def x_intercept(ray):
     "Finds the x intercept of a ray."
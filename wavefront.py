@@ -0,0 +1,196 @@
+"""
+Wavefront, point spread function (PSF) and modulation transfer function
+(MTF) analysis from the optical path lengths of traced rays.
+
+A bundle of parallel rays through the cells of a regular square grid over
+the entrance pupil is traced through the system, and the optical path
+difference (OPD) of each ray from the chief ray is measured on a reference
+sphere centred on the image point of the chief ray.  The PSF is the squared
+modulus of the Fourier transform of the pupil function, found with a
+zero-padded FFT, and the MTF is the modulus of the Fourier transform of the
+PSF.  Everything works on whole arrays, so a wavefront from a 64 by 64 grid
+takes a few milliseconds, and can be cached with TraceCache.wavefront.
+
+Wavefronts are dictionaries of arrays:
+
+    opd:        (size,size) array of the OPD in waves, 0 outside the pupil.
+    pupil:      (size,size) boolean array, True for the cells whose rays
+                reached the image.
+    wavelength: The wavelength in metres.
+    na:         The image space numerical aperture.
+    image:      The image point of the chief ray.
+"""
+import numpy as np
+import raytracer as rt
+import paraxial
+import materials
+
+
+def pupil_grid(size, radius):
+    """Finds the x-y points at the centres of the cells of a size by size
+       grid over a circular pupil.  Returns the tuple (xy, inside), where xy
+       is an (N,2) array of the points within the pupil, and inside is a
+       (size,size) boolean array that is True for the cells within it.
+
+       Parameters
+       ----------
+       size:   integer_type
+               The number of cells across the pupil.
+       radius: float_type
+               The radius of the pupil.
+    """
+    x = ((np.arange(size) + 0.5) * (2. / size) - 1.) * radius
+    xx, yy = np.meshgrid(x, x)
+    inside = xx * xx + yy * yy <= radius * radius
+    return np.column_stack((xx[inside], yy[inside])), inside
+
+
+def pupil_wavefront(elements, size=64, wavelength=None, field=(0., 0.),
+                    radius=None, z_image=None):
+    """Traces a grid of rays over the entrance pupil of a system, and finds
+       the optical path difference of each ray from the chief ray on a
+       reference sphere centred on the image point of the chief ray.
+       Returns a wavefront dictionary.
+
+       Parameters
+       ----------
+       elements:   list_type
+                   Optical elements, or an OpticalSystem, in the order that
+                   rays pass through them.  The entrance pupil is at the
+                   vertex of the first element.
+       size:       integer_type
+                   The number of rays across the pupil.
+       wavelength: float_type
+                   The wavelength in metres.  The reference wavelength is
+                   used if this is None.
+       field:      list_type
+                   The field angles in degrees, as for rt.parallel_bundle.
+       radius:     float_type
+                   The radius of the entrance pupil.  Defaults to the
+                   aperture radius of the first element.
+       z_image:    float_type
+                   The z position of the image plane.  Defaults to the z
+                   position of the last element if that is an output plane,
+                   and to the paraxial focal point otherwise.
+    """
+    if hasattr(elements, 'elements'):
+        elements = elements.elements()
+    elements = list(elements)
+    if isinstance(elements[-1], rt.OutputPlane):
+        plane = elements.pop()
+        if z_image is None:
+            z_image = plane._z0
+    if z_image is None:
+        z_image = paraxial.focal_point(elements, wavelength)
+    first = elements[0]
+    if radius is None:
+        radius = first._ap_r
+    xy, inside = pupil_grid(size, radius)
+    # The chief ray, through the centre of the pupil, is traced first.
+    xy = np.vstack(([0., 0.], xy))
+    bundle = rt.parallel_bundle(xy, first._z0 - radius, wavelength, field,
+                                first._z0)
+    # The path lengths are measured from the plane wavefront through the
+    # origin, so that tilted bundles start in phase.
+    n0 = 1.
+    if isinstance(first, rt.SphericalRefraction):
+        n0 = first.indices(bundle.wavelength)[0]
+    bundle.set_index(n0)
+    bundle.opl = bundle.index * np.einsum('ij,ij->i', bundle.p(), bundle.d())
+    rt.OpticalSystem(elements).propagate_bundle(bundle)
+    if bundle.lost[0]:
+        raise Exception('The chief ray is lost.')
+    p, k = bundle.p(), bundle.d()
+    image = p[0] + k[0] * (z_image - p[0, 2]) / k[0, 2]
+    # Each ray continues to the reference sphere through the chief ray's
+    # last intercept, taking the root nearest to its last intercept.
+    v = p - image
+    vk = np.einsum('ij,ij->i', v, k)
+    c = np.einsum('ij,ij->i', v, v) - np.dot(v[0], v[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        length = -c / (vk + np.copysign(np.sqrt(vk * vk - c), vk))
+    length[0] = 0.
+    live = ~bundle.lost & np.isfinite(length)
+    path = bundle.opl + bundle.index * np.where(live, length, 0.)
+    if wavelength is None:
+        wavelength = materials.REFERENCE_WAVELENGTH
+    # Positions are in mm and wavelengths in metres.
+    opd = (path - path[0]) / (wavelength * 1e3)
+    sin = np.cross(k[live], k[0])
+    na = bundle.index[0] * np.sqrt(np.einsum('ij,ij->i', sin, sin).max())
+    pupil = np.zeros((size, size), dtype=bool)
+    pupil[inside] = live[1:]
+    grid = np.zeros((size, size))
+    grid[inside] = np.where(live[1:], opd[1:], 0.)
+    return {'opd': grid, 'pupil': pupil,
+            'wavelength': np.array(float(wavelength)), 'na': np.array(na),
+            'image': image}
+
+
+def rms_wavefront(wavefront):
+    """Finds the root mean square wavefront error in waves, about the mean
+       of the optical path differences over the pupil.
+    """
+    opd = wavefront['opd'][wavefront['pupil']]
+    return np.sqrt(np.mean((opd - opd.mean())**2))
+
+
+def strehl_ratio(wavefront):
+    """Finds the Strehl ratio, the peak of the PSF at the image point of the
+       chief ray relative to that of a perfect system, without an FFT.
+    """
+    opd = wavefront['opd'][wavefront['pupil']]
+    return abs(np.exp(2j * np.pi * opd).sum())**2 / float(len(opd))**2
+
+
+def _image_field(wavefront, pad):
+    """Finds the zero-padded FFT of the pupil function, and the spacing of
+       its samples in the image in mm.
+    """
+    pupil, opd = wavefront['pupil'], wavefront['opd']
+    m = pad * len(opd)
+    function = np.zeros(opd.shape, dtype=complex)
+    function[pupil] = np.exp(2j * np.pi * opd[pupil])
+    spacing = (float(wavefront['wavelength']) * 1e3
+               / (2. * float(wavefront['na']) * pad))
+    return np.fft.fft2(function, s=(m, m)), spacing
+
+
+def psf(wavefront, pad=4):
+    """Finds the point spread function of a wavefront on a square grid
+       centred on the image point of the chief ray, normalised so that a
+       perfect system has a peak of one.  Returns the tuple (psf, spacing),
+       where spacing is the distance between samples in mm.
+
+       Parameters
+       ----------
+       wavefront: instance_type
+                  A wavefront dictionary, as made by pupil_wavefront.
+       pad:       integer_type
+                  The factor that the pupil grid is zero-padded by before
+                  the FFT, which sets how finely the PSF is sampled.
+    """
+    field, spacing = _image_field(wavefront, pad)
+    intensity = np.fft.fftshift(field.real**2 + field.imag**2)
+    return intensity / float(wavefront['pupil'].sum())**2, spacing
+
+
+def mtf(wavefront, pad=4):
+    """Finds the modulation transfer function of a wavefront.  Returns the
+       tuple (frequency, mtf), where mtf is a square array with zero
+       frequency at its centre, and frequency is the spatial frequency in
+       cycles per mm along each of its axes.  The MTF falls to zero at the
+       cutoff frequency of 2 NA / wavelength.
+
+       Parameters
+       ----------
+       wavefront: instance_type
+                  A wavefront dictionary, as made by pupil_wavefront.
+       pad:       integer_type
+                  The zero-padding factor, as for psf.  It must be at least
+                  2 for the MTF not to be aliased.
+    """
+    field, spacing = _image_field(wavefront, pad)
+    otf = np.abs(np.fft.fft2(field.real**2 + field.imag**2))
+    frequency = np.fft.fftshift(np.fft.fftfreq(len(otf), spacing))
+    return frequency, np.fft.fftshift(otf / otf[0, 0])